@@ -0,0 +1,117 @@
+"""Cold-start benchmark for the Lambda handler.
+
+Every run starts a fresh interpreter (as a new Lambda container would),
+then times the handler import, an optional warm-up ping, the first
+invocation and a second, warm invocation. AWS calls are answered by the
+stubs in ``lambda_files/stub_clients.py``; with ``--boto3`` real boto3
+clients are still constructed, so their setup cost is included.
+
+    python benchmarks/cold_start.py --runs 20 --boto3 --warmup
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_files")
+
+
+def child(args):
+    sys.path.insert(0, LAMBDA_DIR)
+    timings = {}
+
+    started = time.perf_counter()
+    import lambda_function
+    import aws_clients
+    from stub_clients import StubBedrockRuntime, StubKnowledgeBase
+    timings["import_s"] = time.perf_counter() - started
+
+    def stub_factory(service_name):
+        if args.boto3:
+            aws_clients._boto3_client(service_name)
+        if service_name == "bedrock-runtime":
+            return StubBedrockRuntime(
+                first_token_latency=args.latency, token_latency=0.0, rewrite_latency=args.latency
+            )
+        return StubKnowledgeBase(latency=args.latency)
+
+    aws_clients.set_client_factory(stub_factory)
+
+    if args.warmup:
+        started = time.perf_counter()
+        lambda_function.lambda_handler({"warmup": True}, None)
+        timings["warmup_s"] = time.perf_counter() - started
+
+    for name in ("first_invoke_s", "warm_invoke_s"):
+        event = {"input": "How do LangChain retrievers work?", "thread_id": name}
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        timings[name] = time.perf_counter() - started
+        if "Answer" not in response:
+            raise RuntimeError(f"Invocation failed: {response}")
+
+    print(json.dumps(timings))
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "min": samples[0],
+        "max": samples[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--boto3", action="store_true", help="construct real boto3 clients")
+    parser.add_argument("--warmup", action="store_true", help="send a warm-up ping first")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated AWS latency (s)")
+    parser.add_argument("--output", help="write the summary as JSON to this path")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    env = {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        **os.environ,
+        "PYTHONDONTWRITEBYTECODE": "0",
+    }
+    command = [sys.executable, os.path.abspath(__file__), "--child",
+               "--latency", str(args.latency)]
+    command += ["--boto3"] if args.boto3 else []
+    command += ["--warmup"] if args.warmup else []
+
+    runs = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+        timings = json.loads(output.stdout.strip().splitlines()[-1])
+        timings["process_s"] = time.perf_counter() - started
+        runs.append(timings)
+
+    summary = {
+        "runs": args.runs,
+        "boto3": args.boto3,
+        "warmup": args.warmup,
+        "latency": args.latency,
+        "timings": {name: summarize([run[name] for run in runs]) for name in runs[0]},
+    }
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Datasets, statistics and result files shared by the benchmarks."""
+
+import os
+import sys
+import csv
+import json
+import random
+import hashlib
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+LAMBDA_DIR = os.path.join(ROOT, "lambda_files")
+QA_PATH = os.path.join(ROOT, "data", "question_answer_data.csv")
+RESULTS_DIR = os.path.join(ROOT, "results", "benchmarks")
+
+for path in (ROOT, LAMBDA_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from langchain.schema import Document
+
+
+def load_qa(path: str = QA_PATH) -> List[Tuple[str, str]]:
+    """``(question, answer)`` pairs of the evaluation set."""
+    with open(path, encoding="utf-8") as f:
+        return [(row["input_question"], row["output_answer"]) for row in csv.DictReader(f)]
+
+
+def build_corpus(qa: List[Tuple[str, str]], scale: int = 1, seed: int = 0) -> List[Document]:
+    """One document per answer (the retrieval targets, ``source`` = row
+    index), plus ``scale - 1`` times as many synthetic distractors made by
+    shuffling the sentences and words of random answers."""
+    documents = [
+        Document(page_content=answer, metadata={"source": str(i)})
+        for i, (_, answer) in enumerate(qa)
+    ]
+    rng = random.Random(seed)
+    answers = [answer for _, answer in qa]
+    for i in range((scale - 1) * len(qa)):
+        words = " ".join(rng.sample(answers, 3)).split()
+        rng.shuffle(words)
+        documents.append(Document(
+            page_content=" ".join(words[:rng.randint(80, 400)]),
+            metadata={"source": f"synthetic-{i}"}
+        ))
+    return documents
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    if not len(ms):
+        return {}
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+class PeakMemory():
+    """Context manager recording the tracemalloc peak (MiB) of a block."""
+
+    def __enter__(self):
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc):
+        self.peak_mib = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+
+def write_results(exp_name: str, results: dict, parameters: dict, rows: List[dict],
+                  output_dir: str = RESULTS_DIR) -> str:
+    """Writes ``<exp_name>_<hash>.json`` ({exp_name, results, parameters},
+    as in ``results/``) and the per-query rows as ``.csv``; the hash is
+    derived from the parameters. Returns the JSON path."""
+    digest = hashlib.sha256(
+        json.dumps(parameters, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()[:12]
+    name = f"{exp_name}_{digest}"
+    os.makedirs(output_dir, exist_ok=True)
+
+    json_path = os.path.join(output_dir, f"{name}.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({"exp_name": name, "results": results, "parameters": parameters}, f, indent=4)
+
+    if rows:
+        with open(os.path.join(output_dir, f"{name}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=[""] + list(rows[0]))
+            writer.writeheader()
+            for i, row in enumerate(rows):
+                writer.writerow({"": i, **row})
+    return json_path
@@ -0,0 +1,51 @@
+"""Deterministic stand-ins for the embedding model used by the benchmarks."""
+
+import re
+import time
+import zlib
+from typing import List
+
+import asyncio
+import numpy as np
+
+
+class HashingEmbeddings():
+    """Bag-of-words (and bigrams) embeddings by feature hashing.
+
+    Texts sharing words get similar vectors, so retrieval quality is
+    meaningful, and results are identical across runs. ``latency`` adds a
+    fixed delay per call to imitate a remote model.
+    """
+
+    def __init__(self, dimension: int = 512, latency: float = 0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dimension] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
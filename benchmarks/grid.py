@@ -0,0 +1,82 @@
+"""Offline Parent-Child grid search with a shared embedding cache.
+
+Sweeps parent and child chunking settings over the QA dataset with hashing
+embeddings, reporting recall@k per config and how many embedding calls the
+sweep needed.
+
+    python benchmarks/grid.py --child-sizes 150 500 --parent-sizes 0 1000 2000
+"""
+
+import time
+import argparse
+import itertools
+import tempfile
+
+from common import build_corpus, load_qa
+from fakes import HashingEmbeddings
+
+from grid_search import ParentChildGridSearch
+
+
+def recall_evaluator(qa, top_k: int):
+    """Share of questions whose answer document (by ``source``) is retrieved."""
+    def evaluate(retriever, config) -> dict:
+        hits = 0
+        for i, (question, _) in enumerate(qa):
+            docs = retriever.invoke(question, top_k=top_k)
+            hits += any(doc.metadata.get("source") == str(i) for doc in docs)
+        return {f"recall@{top_k}": hits / len(qa)}
+    return evaluate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--child-sizes", type=int, nargs="+", default=[150, 500])
+    parser.add_argument("--child-overlaps", type=int, nargs="+", default=[50])
+    parser.add_argument("--parent-sizes", type=int, nargs="+", default=[0, 1000, 2000],
+                        help="0 keeps whole documents as parents")
+    parser.add_argument("--parent-overlap", type=int, default=200)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--cache-dir", default=None, help="embedding cache (default: temporary)")
+    parser.add_argument("--results-dir", default=None)
+    args = parser.parse_args()
+
+    qa = load_qa()
+    configs = [
+        {
+            "top_k": args.top_k,
+            "chunk_parents": parent_size > 0,
+            "parent_chunk_size": parent_size or None,
+            "parent_overlap": args.parent_overlap if parent_size else None,
+            "child_chunk_size": child_size,
+            "child_overlap": child_overlap,
+        }
+        for child_size, child_overlap, parent_size in itertools.product(
+            args.child_sizes, args.child_overlaps, args.parent_sizes
+        )
+    ]
+
+    embeddings = HashingEmbeddings(args.dimension)
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix="grid-embeddings-")
+    search = ParentChildGridSearch(
+        embeddings, build_corpus(qa, args.scale), embedding_dimension=args.dimension,
+        cache_dir=cache_dir, results_dir=args.results_dir
+    )
+
+    started = time.perf_counter()
+    results = search.run(configs, recall_evaluator(qa, args.top_k))
+    elapsed = time.perf_counter() - started
+
+    for entry in results:
+        p = entry["parameters"]
+        print(f"child {p['child_chunk_size']:>5}/{p['child_overlap']:<4} "
+              f"parent {str(p['parent_chunk_size']):>5}: {entry['results']}")
+    print(f"\n{len(configs)} configs, {search.child_indexes_built} child indexes, "
+          f"{embeddings.calls} embedding calls, {elapsed:.1f}s")
+    print(search.stats())
+
+
+if __name__ == "__main__":
+    main()
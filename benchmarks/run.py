@@ -0,0 +1,324 @@
+"""Offline retrieval and latency benchmarks.
+
+Runs without Pinecone or Bedrock: ``ParentChildRetriever`` uses the local
+vector index and hashing embeddings, ``BedrockController`` the stub
+Bedrock and Knowledge Base clients. The corpus is the QA dataset, scaled
+with synthetic distractor documents. Results go to ``results/benchmarks``
+as ``<exp_name>_<hash>.json`` plus a per-query ``.csv``.
+
+    python benchmarks/run.py --suite all --scales 1 10 --hybrid
+"""
+
+import json
+import time
+import argparse
+from typing import List, Tuple
+
+from common import PeakMemory, build_corpus, latency_summary, load_qa, write_results
+from fakes import HashingEmbeddings
+
+from parent_child import ParentChildRetriever
+from hybrid_retriever import HybridRetriever
+from bm25 import BM25Index
+import tracing
+
+
+def retriever_parameters(args, scale: int) -> dict:
+    return {
+        "retriever_name": "parent_child",
+        "top_k": args.top_k,
+        "scale": scale,
+        "child_chunk_size": args.child_chunk_size,
+        "child_overlap": args.child_overlap,
+        "embedding_dimension": args.dimension,
+        "ivf_lists": args.ivf_lists,
+        "quantization": args.quantization,
+        "slim_metadata": args.slim_metadata,
+        "hybrid": args.hybrid,
+        "embed_latency": args.embed_latency,
+    }
+
+
+def build_retriever(args, sparse: bool = False) -> ParentChildRetriever:
+    return ParentChildRetriever(
+        HashingEmbeddings(args.dimension, latency=args.embed_latency),
+        index_backend="local",
+        embedding_dimension=args.dimension,
+        child_chunk_size=args.child_chunk_size,
+        child_overlap=args.child_overlap,
+        ivf_lists=args.ivf_lists,
+        quantization=args.quantization,
+        slim_metadata=args.slim_metadata,
+        sparse_index=BM25Index() if sparse else None,
+        tracer=tracing.tracer,
+    )
+
+
+def bench_retriever(args, qa: List[Tuple[str, str]], scale: int) -> List[str]:
+    documents = build_corpus(qa, scale)
+    retriever = build_retriever(args, sparse=args.hybrid)
+
+    with PeakMemory() as ingest_memory:
+        started = time.perf_counter()
+        parent_ids = retriever.add_documents(documents)
+        ingest_s = time.perf_counter() - started
+    chunks = retriever.describe()["total_vector_count"]
+    gold = parent_ids[:len(qa)]
+    payload = payload_summary(retriever, qa, args.top_k)
+
+    searchers, hybrid = {"dense": retriever.invoke}, None
+    if args.hybrid:
+        hybrid = HybridRetriever(retriever)
+        searchers["hybrid"] = hybrid.invoke
+    if args.quantization:
+        searchers["dense_float"] = exact_search(retriever)
+
+    paths = []
+    for name, search in searchers.items():
+        rows, latencies = [], []
+        with PeakMemory() as query_memory:
+            for i, (question, _) in enumerate(qa):
+                started = time.perf_counter()
+                docs = search(question, top_k=args.top_k)
+                latencies.append(time.perf_counter() - started)
+                hit = retriever.parent_docs[gold[i]] in docs
+                rows.append({"user_input": question, "latency_ms": latencies[-1] * 1000,
+                             f"hit@{args.top_k}": hit})
+
+        results = {
+            **quantization_summary(retriever, name),
+            **payload,
+            "documents": len(documents),
+            "chunks": chunks,
+            "ingest_seconds": ingest_s,
+            "documents_per_second": len(documents) / ingest_s,
+            "chunks_per_second": chunks / ingest_s,
+            "ingest_peak_mib": ingest_memory.peak_mib,
+            "query_peak_mib": query_memory.peak_mib,
+            f"recall@{args.top_k}": sum(r[f"hit@{args.top_k}"] for r in rows) / len(rows),
+            **latency_summary(latencies),
+        }
+        parameters = {**retriever_parameters(args, scale), "search": name}
+        paths.append(report(f"{name}_bench_x{scale}", results, parameters, rows, args))
+    if hybrid is not None:
+        hybrid.close()
+    return paths
+
+
+def exact_search(retriever: ParentChildRetriever):
+    """``invoke`` over the float vectors only, to measure the recall lost
+    to quantization on the same index."""
+    def search(question: str, top_k: int):
+        index = retriever.child_index
+        quantization, index.quantization = index.quantization, None
+        try:
+            return retriever.invoke(question, top_k=top_k)
+        finally:
+            index.quantization = quantization
+    return search
+
+
+def quantization_summary(retriever: ParentChildRetriever, search: str) -> dict:
+    if search == "dense_float" or not retriever.quantization:
+        return {}
+    memory = retriever.child_index.memory_stats()
+    return {
+        "vector_float_mib": memory["float_bytes"] / 2 ** 20,
+        "vector_code_mib": memory["code_bytes"] / 2 ** 20,
+        "vector_saved_mib": (memory["float_bytes"] - memory["code_bytes"]) / 2 ** 20,
+        "vector_compression": memory["compression"],
+    }
+
+
+def payload_summary(retriever: ParentChildRetriever, qa: List[Tuple[str, str]],
+                    top_k: int) -> dict:
+    """JSON bytes of the vector metadata held by the index, and of a raw
+    index query response with metadata (as sent over the wire by Pinecone)."""
+    index = retriever.child_index
+    metadata_bytes = sum(
+        len(json.dumps(metadata)) for ns in index.namespaces.values() for metadata in ns.metadata
+    )
+    vectors = retriever.embedding_scheduler.embed_documents([q for q, _ in qa])
+    response_bytes = [
+        len(json.dumps(index.query(vector=[vector], top_k=top_k,
+                                   namespace=retriever.namespace, include_metadata=True)))
+        for vector in vectors
+    ]
+    n_vectors = index.describe_index_stats()["total_vector_count"]
+    return {
+        "index_metadata_bytes_per_vector": metadata_bytes / max(1, n_vectors),
+        "query_response_bytes": sum(response_bytes) / len(response_bytes),
+    }
+
+
+SPECULATION_THRESHOLDS = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+def speculation_row(controller, question: str, answer: str, timings: dict,
+                    passage_ids: dict) -> dict:
+    """The speculation decision of a turn, with the passages retrieved for
+    the raw input and for the rewritten query (what serial mode would use),
+    so the overlap threshold can be checked against serial results."""
+    row = {"speculation": timings.get("speculation"), "term_overlap": timings.get("term_overlap"),
+           "retrieved_ids": [passage_ids.get(text) for text in timings["retrieved"]],
+           "raw_ids": None, "serial_ids": None, "serial_match": None,
+           "raw_hit": None, "serial_hit": None}
+    if row["speculation"] is None:
+        return row
+    raw = [result["text"] for result in controller._retrieve_results(question)]
+    serial = [result["text"] for result in controller._retrieve_results(timings["query"])]
+    row.update({
+        "raw_ids": [passage_ids.get(text) for text in raw],
+        "serial_ids": [passage_ids.get(text) for text in serial],
+        "serial_match": timings["retrieved"] == serial,
+        "raw_hit": answer in raw,
+        "serial_hit": answer in serial,
+    })
+    return row
+
+
+def speculation_summary(rows: List[dict], top_k: int) -> dict:
+    """Share of speculative hits and how often they matched serial
+    retrieval, and the recall each overlap threshold would have given."""
+    rows = [row for row in rows if row["speculation"] is not None]
+    if not rows:
+        return {}
+    hits = [row for row in rows if row["speculation"] == "hit"]
+    summary = {
+        "speculation_turns": len(rows),
+        "speculation_hit_rate": len(hits) / len(rows),
+        "speculation_hit_serial_match": (
+            sum(row["serial_match"] for row in hits) / len(hits) if hits else 0.0
+        ),
+        f"serial_recall@{top_k}": sum(row["serial_hit"] for row in rows) / len(rows),
+    }
+    for threshold in SPECULATION_THRESHOLDS:
+        kept = [row["raw_hit"] if row["term_overlap"] >= threshold else row["serial_hit"]
+                for row in rows]
+        summary[f"recall@{top_k}_overlap_{threshold:g}"] = sum(kept) / len(kept)
+    return summary
+
+
+def bench_controller(args, qa: List[Tuple[str, str]]) -> List[str]:
+    import aws_clients
+    from bedrock_controller import BedrockController
+    from stub_clients import StubBedrockRuntime, StubKnowledgeBase
+
+    passages = [answer for _, answer in qa]
+    aws_clients.set_client_factory(
+        lambda service_name: StubBedrockRuntime(
+            first_token_latency=args.llm_latency, token_latency=0.0,
+            rewrite_latency=args.llm_latency
+        ) if service_name == "bedrock-runtime"
+        else StubKnowledgeBase(passages=passages, latency=args.kb_latency)
+    )
+    controller = BedrockController(
+        rewrite_mode=args.rewrite_mode, speculation_overlap=args.speculation_overlap
+    )
+    passage_ids = {passage: i for i, passage in enumerate(passages)}
+
+    rows, latencies = [], []
+    with PeakMemory() as memory:
+        for i, (question, answer) in enumerate(qa):
+            thread_id = f"bench-{i // args.turns}"
+            started = time.perf_counter()
+            controller.converse(question, thread_id)
+            latencies.append(time.perf_counter() - started)
+
+            # Scored on the passages the turn itself retrieved
+            timings = controller.last_timings
+            rows.append({
+                "user_input": question,
+                "latency_ms": latencies[-1] * 1000,
+                f"hit@{controller.top_k}": answer in timings["retrieved"],
+                "context_tokens_saved": timings["context"]["tokens_saved"],
+                "history_tokens_saved": timings["history"]["tokens_saved"],
+                **speculation_row(controller, question, answer, timings, passage_ids),
+            })
+    aws_clients.set_client_factory(None)
+
+    hit_key = f"hit@{controller.top_k}"
+    results = {
+        "turns": len(rows),
+        "peak_mib": memory.peak_mib,
+        f"recall@{controller.top_k}": sum(r[hit_key] for r in rows) / len(rows),
+        "context_tokens_saved": sum(r["context_tokens_saved"] for r in rows),
+        "history_tokens_saved": sum(r["history_tokens_saved"] for r in rows),
+        **latency_summary(latencies),
+        **speculation_summary(rows, controller.top_k),
+    }
+    parameters = {
+        "retriever_name": "bedrock_kb_stub",
+        "rewrite_mode": args.rewrite_mode,
+        "speculation_overlap": args.speculation_overlap,
+        "turns_per_thread": args.turns,
+        "llm_latency": args.llm_latency,
+        "kb_latency": args.kb_latency,
+    }
+    return [report("controller_bench", results, parameters, rows, args)]
+
+
+def report(exp_name: str, results: dict, parameters: dict, rows: List[dict], args) -> str:
+    print(f"\n{exp_name}")
+    for key, value in results.items():
+        print(f"  {key:>24}: {value:.4f}" if isinstance(value, float) else f"  {key:>24}: {value}")
+    if args.no_write:
+        return ""
+    path = write_results(exp_name, results, parameters, rows, args.output_dir)
+    print(f"  written to {path}")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--suite", choices=("retriever", "controller", "all"), default="all")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1],
+                        help="corpus sizes as multiples of the QA dataset")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--child-chunk-size", type=int, default=500)
+    parser.add_argument("--child-overlap", type=int, default=100)
+    parser.add_argument("--ivf-lists", type=int, default=0)
+    parser.add_argument("--quantization", choices=("int8", "binary"), default=None,
+                        help="quantized local index; also reports exact float recall")
+    parser.add_argument("--slim-metadata", action="store_true",
+                        help="keep child text out of the index metadata")
+    parser.add_argument("--hybrid", action="store_true", help="also benchmark BM25 fusion")
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--kb-latency", type=float, default=0.0)
+    parser.add_argument("--rewrite-mode", default="serial")
+    parser.add_argument("--speculation-overlap", type=float, default=0.6,
+                        help="term overlap above which a speculative retrieval is kept")
+    parser.add_argument("--turns", type=int, default=3, help="questions per controller thread")
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--no-write", action="store_true")
+    parser.add_argument("--trace", action="store_true", help="print per-stage span totals")
+    args = parser.parse_args()
+    if args.output_dir is None:
+        from common import RESULTS_DIR
+        args.output_dir = RESULTS_DIR
+
+    sink = tracing.InMemorySink()
+    if args.trace:
+        tracing.configure(enabled=True, sinks=[sink])
+
+    qa = load_qa()
+    if args.suite in ("retriever", "all"):
+        for scale in args.scales:
+            bench_retriever(args, qa, scale)
+    if args.suite in ("controller", "all"):
+        bench_controller(args, qa)
+
+    if args.trace:
+        print("\nspans")
+        for name, entry in sink.summary().items():
+            counters = ", ".join(
+                f"{key} {value}" for key, value in entry.items()
+                if key not in ("count", "total_ms", "mean_ms")
+            )
+            print(f"  {name:>16}: {entry['count']:>6} x {entry['mean_ms']:8.2f} ms  {counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Throughput of the concurrent HTTP server under N concurrent chat threads.
+
+Starts ``lambda_files/server.py`` in-process with the stub Bedrock and
+Knowledge Base clients, then runs N client threads, each holding one
+conversation of ``--turns`` sequential questions, for every concurrency
+level. Reports turns per second, latency percentiles and 503 rejections.
+
+    python benchmarks/serve.py --concurrency 1 8 32 --llm-latency 0.3
+"""
+
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from typing import List, Tuple
+
+from common import latency_summary, load_qa, write_results
+
+import server
+from server import ConcurrentController
+
+
+def run_clients(url: str, qa: List[Tuple[str, str]], clients: int, turns: int,
+                stream: bool) -> Tuple[List[dict], float]:
+    """Each client thread sends ``turns`` questions on its own chat thread."""
+    rows, lock = [], threading.Lock()
+
+    def client(index: int):
+        for turn in range(turns):
+            question = qa[(index * turns + turn) % len(qa)][0]
+            body = json.dumps({"input": question, "thread_id": f"serve-{index}",
+                               "stream": stream}).encode("utf-8")
+            request = urllib.request.Request(
+                url, data=body, headers={"Content-Type": "application/json"}
+            )
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            with lock:
+                rows.append({"client": index, "turn": turn, "status": status,
+                             "latency_ms": (time.perf_counter() - started) * 1000})
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return rows, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=3, help="questions per client thread")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--kb-latency", type=float, default=0.15)
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="stub delay per streamed answer token")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--output-dir", default=None)
+    parser.add_argument("--no-write", action="store_true")
+    args = parser.parse_args()
+
+    qa = load_qa()
+    server.use_stub_clients(args.llm_latency, args.kb_latency, args.token_latency)
+    for clients in args.concurrency:
+        controller = ConcurrentController(
+            max_concurrency=args.max_concurrency, max_queue=args.max_queue
+        )
+        httpd = server.serve(controller, port=0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{httpd.server_address[1]}/"
+        try:
+            rows, elapsed = run_clients(url, qa, clients, args.turns, args.stream)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+        ok = [row["latency_ms"] / 1000 for row in rows if row["status"] == 200]
+        results = {
+            "turns": len(rows),
+            "seconds": elapsed,
+            "turns_per_second": len(ok) / elapsed,
+            "rejected": sum(row["status"] == 503 for row in rows),
+            "errors": sum(row["status"] not in (200, 503) for row in rows),
+            **latency_summary(ok),
+        }
+        print(f"\nserve_bench_c{clients}")
+        for key, value in results.items():
+            print(f"  {key:>18}: {value:.4f}" if isinstance(value, float) else f"  {key:>18}: {value}")
+
+        if not args.no_write:
+            parameters = {
+                "retriever_name": "bedrock_kb_stub",
+                "clients": clients,
+                "turns_per_thread": args.turns,
+                "max_concurrency": args.max_concurrency,
+                "max_queue": args.max_queue,
+                "llm_latency": args.llm_latency,
+                "kb_latency": args.kb_latency,
+                "token_latency": args.token_latency,
+                "stream": args.stream,
+            }
+            kwargs = {"output_dir": args.output_dir} if args.output_dir else {}
+            path = write_results(f"serve_bench_c{clients}", results, parameters, rows, **kwargs)
+            print(f"  written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+from pathlib import Path
+
+import numpy as np
+
+from ingestion import ChildRecord
+from vector_index import _save_npy, _top_k
+
+logger = logging.Logger(__name__)
+
+
+def get_tokenizer(name: str = "regex") -> Callable[[str], List[str]]:
+    """Tokenizers of the BM25 experiments: ``regex`` (lowercased words),
+    ``word_tokenize`` (NLTK) or a tiktoken encoding such as ``o200k_base``."""
+    if name == "regex":
+        return lambda text: re.findall(r"\w+", text.lower())
+    if name == "word_tokenize":
+        from nltk.tokenize import word_tokenize
+        return lambda text: word_tokenize(text.lower())
+
+    import tiktoken
+    encoding = tiktoken.get_encoding(name)
+    return lambda text: [str(t) for t in encoding.encode(text, disallowed_special=())]
+
+
+class BM25Index():
+    """Okapi BM25 over child chunks, with array-backed postings.
+
+    Postings are stored term-major (CSR: ``indptr``, ``post_docs``,
+    ``post_tf``) and each posting's BM25 weight is precomputed, so a query
+    is a gather plus a ``bincount`` over the postings of its terms. IDF
+    follows rank_bm25's BM25Okapi: negative IDFs are floored to
+    ``epsilon`` times the mean IDF, matching the parameters tuned in
+    ``results/bm25_gridsearch``.
+
+    Added and deleted documents are buffered and the arrays rebuilt on the
+    next query. ``persist`` writes ``.npy`` files to ``path``, which are
+    memory-mapped on load.
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            k1: float = 1.5,
+            b: float = 0.75,
+            epsilon: float = 0.25,
+            tokenizer: str = "regex"
+        ):
+        self.path = Path(path) if path else None
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.tokenizer_name = tokenizer
+        self.tokenize = get_tokenizer(tokenizer)
+
+        self.vocab: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.parent_ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tf = np.zeros(0, dtype=np.float32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.float32)
+
+        self._alive = np.zeros(0, dtype=bool)
+        self._pending = []  # (row, term ids, term frequencies) of new documents
+        self._pending_len: List[float] = []
+        self._dirty = False
+        self._lock = threading.RLock()
+
+        if self.path is not None and (self.path / "bm25.json").exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add(self, records: Iterable[ChildRecord]):
+        """Index ``(child id, text, metadata)`` records; re-adding an id
+        replaces its previous text."""
+        with self._lock:
+            for child_id, text, metadata in records:
+                if child_id in self.rows:
+                    self._delete_row(self.rows[child_id])
+
+                counts = Counter(self.tokenize(text))
+                term_ids = np.fromiter(
+                    (self.vocab.setdefault(t, len(self.vocab)) for t in counts),
+                    dtype=np.int64, count=len(counts)
+                )
+                row = len(self.ids)
+                self.ids.append(child_id)
+                self.parent_ids.append(metadata.get("original_parent_id", ""))
+                self.rows[child_id] = row
+                self._pending.append(
+                    (row, term_ids, np.fromiter(counts.values(), dtype=np.float32))
+                )
+                self._pending_len.append(float(sum(counts.values())))
+                self._dirty = True
+
+    def delete(self, ids: List[str] = None, prefix: str = None):
+        """Delete documents by id or by id prefix (e.g. all children of a parent)."""
+        with self._lock:
+            if prefix is not None:
+                ids = [child_id for child_id in self.rows if child_id.startswith(prefix)]
+            for child_id in ids or []:
+                row = self.rows.get(child_id)
+                if row is not None:
+                    self._delete_row(row)
+
+    def _delete_row(self, row: int):
+        del self.rows[self.ids[row]]
+        if row < len(self._alive):
+            self._alive[row] = False
+        else:
+            # Still pending: dropped when the postings are rebuilt
+            self._pending = [p for p in self._pending if p[0] != row]
+        self._dirty = True
+
+    def _build(self):
+        """Merge pending documents, drop deleted ones and recompute the
+        CSR postings, IDF and posting weights."""
+        n_old = len(self._alive)
+        terms = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        docs = self.post_docs.astype(np.int64)
+        tfs = self.post_tf
+        if self._pending:
+            terms = np.concatenate([terms] + [p[1] for p in self._pending])
+            docs = np.concatenate([docs] + [np.full(len(p[1]), p[0]) for p in self._pending])
+            tfs = np.concatenate([tfs] + [p[2] for p in self._pending])
+
+        alive = np.ones(len(self.ids), dtype=bool)
+        alive[:n_old] = self._alive
+        pending_rows = {p[0] for p in self._pending}
+        alive[n_old:] = [row in pending_rows for row in range(n_old, len(self.ids))]
+        doc_len = np.concatenate([self.doc_len, np.asarray(self._pending_len, dtype=np.float32)])
+
+        # Compact away deleted documents
+        new_row = np.cumsum(alive) - 1
+        keep = alive[docs]
+        terms, docs, tfs = terms[keep], new_row[docs[keep]], tfs[keep]
+        self.ids = [i for i, a in zip(self.ids, alive) if a]
+        self.parent_ids = [p for p, a in zip(self.parent_ids, alive) if a]
+        self.rows = {child_id: row for row, child_id in enumerate(self.ids)}
+        self.doc_len = doc_len[alive]
+
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        n_terms = len(self.vocab)
+        df = np.bincount(terms, minlength=n_terms)
+        self.indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        self.post_docs = docs.astype(np.int32)
+        self.post_tf = tfs.astype(np.float32)
+
+        n_docs = len(self.ids)
+        avgdl = float(self.doc_len.mean()) if n_docs else 1.0
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        present = df > 0
+        if present.any():
+            idf[idf < 0] = self.epsilon * idf[present].mean()
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / (avgdl or 1.0))
+        self.weights = (idf[terms] * tfs * (self.k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        self._alive = np.ones(n_docs, dtype=bool)
+        self._pending, self._pending_len = [], []
+        self._dirty = False
+
+    def query(self, query: str, top_k: int = 5, **kwargs) -> dict:
+        """Top ``top_k`` children by BM25 score, in the vector index's
+        response format (parent id under ``original_parent_id``)."""
+        counts = Counter(self.tokenize(query))
+        with self._lock:
+            if self._dirty:
+                self._build()
+            indptr, post_docs, weights = self.indptr, self.post_docs, self.weights
+            ids, parent_ids = self.ids, self.parent_ids
+            # Resolved with the arrays: a concurrent add may extend the vocab
+            term_ids = [(self.vocab.get(t), qtf) for t, qtf in counts.items()]
+
+        n_terms = len(indptr) - 1
+        term_ids = [(term_id, qtf) for term_id, qtf in term_ids
+                    if term_id is not None and term_id < n_terms]
+        if not term_ids or not ids:
+            return {"matches": []}
+
+        spans = [(indptr[term_id], indptr[term_id + 1], qtf) for term_id, qtf in term_ids]
+        docs = np.concatenate([post_docs[s:e] for s, e, _ in spans])
+        contrib = np.concatenate([weights[s:e] * qtf for s, e, qtf in spans])
+        scores = np.bincount(docs, weights=contrib, minlength=len(ids))
+
+        best = _top_k(scores, top_k)
+        return {"matches": [
+            {"id": ids[row], "score": float(scores[row]),
+             "metadata": {"original_parent_id": parent_ids[row]}}
+            for row in best if scores[row] > 0
+        ]}
+
+    def persist(self):
+        if self.path is None:
+            return
+        with self._lock:
+            if self._dirty:
+                self._build()
+            self.path.mkdir(parents=True, exist_ok=True)
+            for name in ("indptr", "post_docs", "post_tf", "weights", "doc_len"):
+                _save_npy(self.path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+            terms = sorted(self.vocab, key=self.vocab.get)
+            with open(self.path / "bm25.json.tmp", "w", encoding="utf8") as f:
+                json.dump({
+                    "params": {"k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+                               "tokenizer": self.tokenizer_name},
+                    "terms": terms, "ids": self.ids, "parent_ids": self.parent_ids,
+                }, f)
+            os.replace(self.path / "bm25.json.tmp", self.path / "bm25.json")
+        logger.info("BM25 index persisted to %s.", self.path)
+
+    def _load(self):
+        with open(self.path / "bm25.json", "r", encoding="utf8") as f:
+            data = json.load(f)
+        params = data["params"]
+        if (params["k1"], params["b"], params["epsilon"], params["tokenizer"]) != (
+                self.k1, self.b, self.epsilon, self.tokenizer_name):
+            logger.warning(f"BM25 index at {self.path} was built with {params}; using them.")
+            self.k1, self.b, self.epsilon = params["k1"], params["b"], params["epsilon"]
+            self.tokenizer_name = params["tokenizer"]
+            self.tokenize = get_tokenizer(self.tokenizer_name)
+
+        self.vocab = {term: i for i, term in enumerate(data["terms"])}
+        self.ids = data["ids"]
+        self.parent_ids = data["parent_ids"]
+        self.rows = {child_id: row for row, child_id in enumerate(self.ids)}
+        for name in ("indptr", "post_docs", "post_tf", "weights", "doc_len"):
+            setattr(self, name, np.load(self.path / f"{name}.npy", mmap_mode="r"))
+        self._alive = np.ones(len(self.ids), dtype=bool)
+        logger.info("BM25 index loaded from %s.", self.path)
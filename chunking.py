@@ -0,0 +1,138 @@
+import time
+import logging
+import multiprocessing
+from typing import Dict, Iterable, Iterator, List, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from ingestion import ChildRecord, batched, estimate_batch_size
+
+logger = logging.Logger(__name__)
+
+
+# (page content, metadata, parent id)
+ChunkTask = Tuple[str, dict, str]
+# (parent chunk id, text, metadata) entries and the child records of one document
+ChunkResult = Tuple[List[Tuple[str, str, dict]], List[ChildRecord]]
+
+_SPLITTERS: Dict[tuple, RecursiveCharacterTextSplitter] = {}
+
+
+def parent_chunk_id(parent_id: str, chunk_index: int) -> str:
+    return f"{parent_id}-pchunk-{chunk_index}"
+
+
+def child_id(parent_unit_id: str, chunk_index: int) -> str:
+    return f"{parent_unit_id}-child-{chunk_index}"
+
+
+def _splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Splitters are cached per process, so each worker builds them once."""
+    key = (chunk_size, chunk_overlap)
+    if key not in _SPLITTERS:
+        _SPLITTERS[key] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+    return _SPLITTERS[key]
+
+
+def split_document(task: ChunkTask, config: dict) -> ChunkResult:
+    """Split one document into its parent chunks (if ``chunk_parents``) and
+    its child records. Pure function of its inputs, so it can run in any
+    process and always yields the same ids."""
+    page_content, metadata, parent_id = task
+    child_splitter = _splitter(config["child_chunk_size"], config["child_overlap"])
+
+    parent_chunks = []
+    if not config["chunk_parents"]:
+        parent_units = [(parent_id, page_content)]
+    else:
+        parent_splitter = _splitter(
+            config["parent_chunk_size"], config["parent_overlap"]
+        )
+        for i, chunk in enumerate(parent_splitter.split_text(page_content)):
+            parent_chunks.append((
+                parent_chunk_id(parent_id, i),
+                chunk,
+                {**metadata, "parent_id": parent_id, "is_parent_chunk": True,
+                 "chunk_index": i}
+            ))
+        parent_units = [(chunk_id, chunk) for chunk_id, chunk, _ in parent_chunks]
+
+    children = []
+    for parent_unit_id, parent_unit in parent_units:
+        for i, ch_chunk_text in enumerate(child_splitter.split_text(parent_unit)):
+            child_metadata = {
+                "text": ch_chunk_text,
+                "parent_unit_id": parent_unit_id, # ID of immediate parent (whole doc or chunk)
+                "original_parent_id": parent_id, # ID of original parent document
+                "is_chunked_parent": config["chunk_parents"],
+                "chunk_index": i,
+                **metadata
+            }
+            children.append((child_id(parent_unit_id, i), ch_chunk_text, child_metadata))
+
+    return parent_chunks, children
+
+
+def _split_many(tasks: List[ChunkTask], config: dict) -> Tuple[List[ChunkResult], float]:
+    """Split a group of documents; also returns the seconds spent, measured
+    where the split ran (possibly a worker process)."""
+    started = time.perf_counter()
+    results = [split_document(task, config) for task in tasks]
+    return results, time.perf_counter() - started
+
+
+def _trace_split(tracer, tasks: List[ChunkTask], results: List[ChunkResult], seconds: float):
+    if tracer is None or not tracer.enabled:
+        return
+    tracer.record("chunk", seconds * 1000, {
+        "documents": len(tasks),
+        "children": sum(len(children) for _, children in results),
+        "bytes": (estimate_batch_size([task[0] for task in tasks]), "Bytes"),
+    })
+
+
+def iter_split(
+        tasks: Iterable[ChunkTask],
+        config: dict,
+        workers: int = 1,
+        task_size: int = 64,
+        max_pending: int = None,
+        tracer=None
+    ) -> Iterator[ChunkResult]:
+    """Split documents, in input order, optionally across a process pool.
+
+    Tasks are submitted in groups of ``task_size`` documents to amortize
+    pickling, and at most ``max_pending`` groups (default: twice the worker
+    count) are in flight, so the input is consumed lazily. Each group is
+    recorded as a ``chunk`` span on ``tracer`` (see lambda_files/tracing.py).
+    Workers are spawned rather than forked: the pool may be created in a
+    thread (e.g. the producer of ``stream_ingest``) while other threads
+    hold locks a forked child would inherit locked.
+    """
+    if workers <= 1:
+        for group in batched(tasks, task_size):
+            results, seconds = _split_many(group, config)
+            _trace_split(tracer, group, results, seconds)
+            yield from results
+        return
+
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for group in batched(tasks, task_size):
+            pending.append((group, pool.submit(_split_many, group, config)))
+            if len(pending) >= max_pending:
+                group, future = pending.popleft()
+                results, seconds = future.result()
+                _trace_split(tracer, group, results, seconds)
+                yield from results
+        while pending:
+            group, future = pending.popleft()
+            results, seconds = future.result()
+            _trace_split(tracer, group, results, seconds)
+            yield from results
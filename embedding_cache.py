@@ -0,0 +1,204 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+from pathlib import Path
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.Logger(__name__)
+
+
+class CachedEmbeddings():
+    """Caching wrapper around a LangChain embedding model.
+
+    Vectors are keyed by a hash of (model id, dimension, kind, text), where
+    the kind separates query from document embeddings (some models embed
+    them differently), and stored as raw float32 blobs in SQLite, bounded
+    to ``max_entries`` with LRU eviction. Query embeddings additionally go through an in-memory hot
+    tier. Batch calls only send the cache misses to the wrapped model, so
+    the cache can be shared between ingestion runs, grid-search configs and
+    the query path.
+    """
+
+    def __init__(
+            self,
+            embeddings,
+            cache_dir: str,
+            dimension: int,
+            model_id: Optional[str] = None,
+            max_entries: int = 1_000_000,
+            query_cache_size: int = 4096
+        ):
+        self.embeddings = embeddings
+        self.dimension = dimension
+        self.model_id = model_id or _model_id(embeddings)
+        self.max_entries = max_entries
+        self.query_cache_size = query_cache_size
+
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(Path(cache_dir) / "embeddings.sqlite"), check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        # Running row count, so stores only query SQLite to evict
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+        self._hot: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str, kind: str = "document") -> str:
+        return hashlib.sha256(
+            f"{self.model_id}\x00{self.dimension}\x00{kind}\x00{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Fetch the cached vectors of the given keys and bump their recency."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                chunk = unique[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time_ns()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, entries: Dict[str, List[float]]):
+        if not entries:
+            return
+        now = time.time_ns()
+        with self._lock:
+            # A key stored meanwhile by another caller holds the same vector
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                 for key, vector in entries.items()]
+            ).rowcount
+            self._count += inserted
+            if self._count > self.max_entries:
+                self._count -= self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings "
+                    "ORDER BY last_used LIMIT ?)", (self._count - self.max_entries,)
+                ).rowcount
+            self._conn.commit()
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        # Unique missing texts, so duplicates in a batch are embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key not in found)
+        self.misses += len(missing)
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._store(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._split(texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self._store(new)
+            found.update(new)
+        return [found[key] for key in keys]
+
+    def _hot_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._hot.get(key)
+            if vector is not None:
+                self._hot.move_to_end(key)
+            return vector
+
+    def _hot_put(self, key: str, vector: List[float]):
+        with self._lock:
+            self._hot[key] = vector
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.query_cache_size:
+                self._hot.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        vector = self._hot_get(key)
+        if vector is None:
+            vector = self._lookup([key]).get(key)
+        if vector is None:
+            self.misses += 1
+            vector = self.embeddings.embed_query(text)
+            self._store({key: vector})
+        else:
+            self.hits += 1
+        self._hot_put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        vector = self._hot_get(key)
+        if vector is None:
+            vector = self._lookup([key]).get(key)
+        if vector is None:
+            self.misses += 1
+            vector = await self.embeddings.aembed_query(text)
+            self._store({key: vector})
+        else:
+            self.hits += 1
+        self._hot_put(key, vector)
+        return vector
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+            "hot_entries": len(self._hot),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _model_id(embeddings) -> str:
+    """Best-effort model identifier of a LangChain embedding model."""
+    for attr in ("model_id", "model", "model_name"):
+        value = getattr(embeddings, attr, None)
+        if isinstance(value, str) and value:
+            return value
+    return type(embeddings).__name__
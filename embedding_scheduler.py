@@ -0,0 +1,223 @@
+import time
+import logging
+import threading
+from typing import List, Tuple
+
+import asyncio
+
+from ingestion import estimate_batch_size
+from retry import backoff_delay, is_retryable_error, is_throttling_error
+
+logger = logging.Logger(__name__)
+
+
+class EmbeddingBatchError(Exception):
+    """An embedding batch still failed after all retries."""
+
+
+class AdaptiveLimiter():
+    """Asyncio concurrency limit adjusted AIMD-style: halved on throttling,
+    raised by one after a run of ``limit`` successful requests."""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 16):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = None
+        self._loop = None
+
+    def _condition(self) -> asyncio.Condition:
+        # A Condition is bound to one event loop; each asyncio.run starts
+        # a new one, so it is rebuilt whenever the running loop changes
+        loop = asyncio.get_running_loop()
+        if self._cond is None or self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def on_throttle(self):
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+
+
+class EmbeddingScheduler():
+    """Token-aware, throttling-adaptive front end to an embedding model.
+
+    Texts are packed into batches bounded by ``max_batch_items`` and an
+    estimated token budget (UTF-8 bytes / ``bytes_per_token``), so no request
+    exceeds the model's limits. Async requests share an ``AdaptiveLimiter``;
+    failed batches are retried with jittered exponential backoff and raise
+    ``EmbeddingBatchError`` once ``max_retries`` is exhausted instead of
+    being dropped. ``stats()`` exposes throughput and retry counters.
+    """
+
+    def __init__(
+            self,
+            embedding_model,
+            max_batch_items: int = 100,
+            max_batch_tokens: int = 16000,
+            bytes_per_token: float = 4.0,
+            initial_concurrency: int = 4,
+            max_concurrency: int = 16,
+            max_retries: int = 5,
+            base_delay: float = 0.5,
+            max_delay: float = 30.0,
+            tracer=None
+        ):
+        self.embedding_model = embedding_model
+        self.max_batch_items = max_batch_items
+        self.max_batch_tokens = max_batch_tokens
+        self.bytes_per_token = bytes_per_token
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AdaptiveLimiter(initial_concurrency, maximum=max_concurrency)
+        # Optional lambda_files/tracing.py tracer for per-batch records
+        self.tracer = tracer
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0, "texts": 0, "estimated_tokens": 0,
+            "retries": 0, "throttles": 0, "failures": 0,
+        }
+        self._busy_seconds = 0.0
+        self._started = None
+
+    def estimate_tokens(self, texts: List[str]) -> int:
+        return int(estimate_batch_size(texts) / self.bytes_per_token) + 1
+
+    def plan_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Greedy ``(start, end)`` ranges within the item and token limits."""
+        batches = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            text_tokens = self.estimate_tokens([text])
+            if i > start and (i - start >= self.max_batch_items
+                              or tokens + text_tokens > self.max_batch_tokens):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _count(self, **increments):
+        with self._lock:
+            if self._started is None:
+                self._started = time.perf_counter()
+            for name, value in increments.items():
+                self._counters[name] += value
+
+    def _on_error(self, exc: Exception, attempt: int, size: int) -> float:
+        """Count a failed attempt; return the delay before the next one or
+        raise when the batch is out of retries."""
+        throttled = is_throttling_error(exc)
+        if throttled:
+            self.limiter.on_throttle()
+            self._count(throttles=1)
+
+        if attempt >= self.max_retries or not is_retryable_error(exc):
+            self._count(failures=1)
+            raise EmbeddingBatchError(
+                f"Embedding batch of {size} texts failed after {attempt + 1} attempts: {exc}"
+            ) from exc
+
+        self._count(retries=1)
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        logger.warning(
+            f"Embedding batch failed ({'throttled' if throttled else exc}), "
+            f"retrying in {delay:.2f}s."
+        )
+        return delay
+
+    def _on_success(self, texts: List[str], seconds: float, retries: int):
+        self.limiter.on_success()
+        estimated_tokens = self.estimate_tokens(texts)
+        self._count(requests=1, texts=len(texts), estimated_tokens=estimated_tokens)
+        with self._lock:
+            self._busy_seconds += seconds
+        if self.tracer is not None and self.tracer.enabled:
+            # Times the successful attempt; failed ones show up as retries
+            self.tracer.record("embed_batch", seconds * 1000, {
+                "texts": len(texts),
+                "estimated_tokens": estimated_tokens,
+                "bytes": (estimate_batch_size(texts), "Bytes"),
+                "retries": retries,
+            })
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed sequentially, one planned batch at a time."""
+        embeddings = []
+        for start, end in self.plan_batches(texts):
+            batch = texts[start:end]
+            attempt = 0
+            while True:
+                began = time.perf_counter()
+                try:
+                    result = self.embedding_model.embed_documents(batch)
+                    break
+                except Exception as e:
+                    time.sleep(self._on_error(e, attempt, len(batch)))
+                    attempt += 1
+            self._on_success(batch, time.perf_counter() - began, attempt)
+            embeddings.extend(result)
+        return embeddings
+
+    async def _aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            began = time.perf_counter()
+            try:
+                result = await self.embedding_model.aembed_documents(batch)
+            except Exception as e:
+                delay = self._on_error(e, attempt, len(batch))
+            else:
+                self._on_success(batch, time.perf_counter() - began, attempt)
+                return result
+            finally:
+                await self.limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed the planned batches concurrently under the adaptive limit."""
+        results = await asyncio.gather(*(
+            self._aembed_batch(texts[start:end])
+            for start, end in self.plan_batches(texts)
+        ))
+        return [embedding for batch in results for embedding in batch]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            busy = self._busy_seconds
+        return {
+            **counters,
+            "concurrency_limit": self.limiter.limit,
+            "elapsed_seconds": elapsed,
+            "texts_per_second": counters["texts"] / elapsed if elapsed else 0.0,
+            "tokens_per_second": counters["estimated_tokens"] / elapsed if elapsed else 0.0,
+            "mean_request_seconds": busy / counters["requests"] if counters["requests"] else 0.0,
+        }
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Callable, Dict, List
+
+from langchain.schema import Document
+
+from parent_child import ParentChildRetriever
+from embedding_cache import CachedEmbeddings
+
+logger = logging.Logger(__name__)
+
+
+class ParentChildGridSearch():
+    """Grid search over Parent-Child chunking configurations.
+
+    Configs are grouped by the index they need: configs without parent
+    chunking share one child index per child splitter setting
+    (``child_chunk_size``, ``child_overlap``), and each parent chunking
+    setting gets its own, built exactly as ``ParentChildRetriever`` builds
+    it. All indexes embed through a persistent cache keyed by (chunk text,
+    model, dimension), so children repeated across settings are embedded
+    once.
+
+    ``evaluate(retriever, config)`` returns the metrics of one config. With
+    ``results_dir``, each result is written like the existing runs:
+    ``<results_dir>/<hash>/parent_child_grid_<hash>.json``.
+    """
+
+    def __init__(
+            self,
+            embedding_model,
+            documents: List[Document],
+            embedding_dimension: int = 512,
+            cache_dir: str = "embedding_cache",
+            index_backend: str = "local",
+            index_name: str = "parentchild-langchain-document-index",
+            results_dir: str = None,
+            **retriever_kwargs
+        ):
+        if cache_dir:
+            embedding_model = CachedEmbeddings(
+                embedding_model, cache_dir, dimension=embedding_dimension
+            )
+        self.embedding_model = embedding_model
+        self.documents = list(documents)
+        self.embedding_dimension = embedding_dimension
+        self.index_backend = index_backend
+        self.index_name = index_name
+        self.results_dir = results_dir
+        self.retriever_kwargs = retriever_kwargs
+        self.child_indexes_built = 0
+
+    @staticmethod
+    def _index_key(config: dict) -> tuple:
+        """The chunking settings that determine a config's child index."""
+        if config.get("chunk_parents"):
+            return (config["child_chunk_size"], config["child_overlap"],
+                    config["parent_chunk_size"], config["parent_overlap"])
+        return (config["child_chunk_size"], config["child_overlap"], None, None)
+
+    def _build_retriever(self, index_key: tuple) -> ParentChildRetriever:
+        """Ingests the documents into the child index of one setting."""
+        child_chunk_size, child_overlap, parent_chunk_size, parent_overlap = index_key
+        namespace = f"grid-child-{child_chunk_size}-{child_overlap}"
+        kwargs = {"chunk_parents": False}
+        if parent_chunk_size is not None:
+            namespace += f"-parent-{parent_chunk_size}-{parent_overlap}"
+            kwargs = {"chunk_parents": True, "parent_chunk_size": parent_chunk_size,
+                      "parent_overlap": parent_overlap}
+
+        retriever = ParentChildRetriever(
+            self.embedding_model,
+            index_name=self.index_name,
+            child_chunk_size=child_chunk_size,
+            child_overlap=child_overlap,
+            embedding_dimension=self.embedding_dimension,
+            namespace=namespace,
+            index_backend=self.index_backend,
+            **kwargs,
+            **self.retriever_kwargs
+        )
+        retriever.add_documents(self.documents)
+        self.child_indexes_built += 1
+        return retriever
+
+    def run(
+            self, configs: List[dict],
+            evaluate: Callable[[ParentChildRetriever, dict], dict]
+    ) -> List[dict]:
+        """Evaluate every config; returns ``{"parameters", "results"}`` entries
+        in the order of ``configs``."""
+        groups: Dict[tuple, List[int]] = {}
+        for i, config in enumerate(configs):
+            groups.setdefault(self._index_key(config), []).append(i)
+
+        results = [None] * len(configs)
+        for index_key, indices in groups.items():
+            started = time.perf_counter()
+            retriever = self._build_retriever(index_key)
+            logger.info(
+                f"Child index {index_key} built in "
+                f"{time.perf_counter() - started:.1f}s for {len(indices)} configs."
+            )
+
+            for i in indices:
+                config = configs[i]
+                parameters = {
+                    "retriever_name": "parent_child",
+                    **config,
+                    "embedding_dimension": self.embedding_dimension,
+                }
+                results[i] = {"parameters": parameters, "results": evaluate(retriever, config)}
+                if self.results_dir:
+                    self._write(results[i])
+        return results
+
+    def _write(self, entry: dict):
+        digest = hashlib.sha256(
+            json.dumps(entry["parameters"], sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        exp_name = f"parent_child_grid_{digest}"
+        run_dir = os.path.join(self.results_dir, digest)
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, f"{exp_name}.json"), "w") as f:
+            json.dump({"exp_name": exp_name, **entry}, f, indent=4)
+
+    def stats(self) -> dict:
+        stats = {"child_indexes_built": self.child_indexes_built}
+        if isinstance(self.embedding_model, CachedEmbeddings):
+            stats["embedding_cache"] = self.embedding_model.stats()
+        return stats
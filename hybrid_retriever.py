@@ -0,0 +1,98 @@
+import logging
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncio
+
+from langchain.schema import Document
+
+from parent_child import ParentChildRetriever
+
+logger = logging.Logger(__name__)
+
+
+def reciprocal_rank_fusion(
+        rankings: List[List[tuple]], weights: List[float] = None, k: int = 60
+) -> List[tuple]:
+    """Fuse ``(id, score)`` rankings: each list adds ``weight / (k + rank)``
+    to its ids. Returns ``(id, fused score)`` sorted by fused score."""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])
+
+
+class HybridRetriever():
+    """Dense parent-child retrieval fused with BM25 over the same children.
+
+    The query embedding (the only network call) runs in a worker thread
+    while BM25 scores locally, then both parent rankings, each
+    ``candidate_factor`` times deeper than ``top_k``, are combined with
+    weighted reciprocal-rank fusion. ``close`` (or leaving a ``with``
+    block) shuts the worker pool down.
+    """
+
+    def __init__(
+            self,
+            retriever: ParentChildRetriever,
+            rrf_k: int = 60,
+            dense_weight: float = 1.0,
+            sparse_weight: float = 1.0,
+            candidate_factor: int = 2
+        ):
+        if retriever.sparse_index is None:
+            raise ValueError("The retriever has no sparse index.")
+        self.retriever = retriever
+        self.rrf_k = rrf_k
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.candidate_factor = candidate_factor
+        self._executor = None
+
+    def _dense(self, query: str, candidates: int) -> List[tuple]:
+        vector = self.retriever.embedding_model.embed_query(query)
+        return self.retriever.rank_parents(vector, candidates)
+
+    def _fuse(self, dense: List[tuple], sparse: List[tuple], top_k: int,
+              return_scores: bool) -> List[Document]:
+        fused = reciprocal_rank_fusion(
+            [dense, sparse], [self.dense_weight, self.sparse_weight], self.rrf_k
+        )[:top_k]
+        parent_docs = self.retriever.parent_docs
+        if return_scores:
+            return [(parent_docs[parent_id], score) for parent_id, score in fused]
+        return [parent_docs[parent_id] for parent_id, _ in fused]
+
+    def invoke(
+            self, query: str, top_k: int = 5, return_scores: bool = False
+    ) -> List[Document]:
+        """Up to ``top_k`` parent documents ranked by fused score."""
+        candidates = top_k * self.candidate_factor
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=4)
+        dense = self._executor.submit(self._dense, query, candidates)
+        sparse = self.retriever.rank_parents_sparse(query, candidates)
+        return self._fuse(dense.result(), sparse, top_k, return_scores)
+
+    async def ainvoke(
+            self, query: str, top_k: int = 5, return_scores: bool = False
+    ) -> List[Document]:
+        candidates = top_k * self.candidate_factor
+        vector = asyncio.ensure_future(self.retriever.embedding_model.aembed_query(query))
+        sparse = await asyncio.to_thread(self.retriever.rank_parents_sparse, query, candidates)
+        dense = await asyncio.to_thread(self.retriever.rank_parents, await vector, candidates)
+        return self._fuse(dense, sparse, top_k, return_scores)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
@@ -0,0 +1,58 @@
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional
+from pathlib import Path
+
+logger = logging.Logger(__name__)
+
+
+class IngestManifest():
+    """Record of what a namespace already holds: for each document key, the
+    content-hash parent id that is indexed and a fingerprint of the
+    chunking configuration its children were built with.
+
+    A document whose key maps to the same parent id under the same
+    configuration is unchanged and can be skipped on re-ingestion.
+    """
+
+    def __init__(self, path: str, config: dict):
+        self.path = Path(path)
+        self.config_hash = hashlib.sha256(
+            json.dumps(config, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        self.documents: Dict[str, List[str]] = {}
+
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf8") as f:
+                self.documents = json.load(f)["documents"]
+
+    def is_current(self, doc_key: str, parent_id: str) -> bool:
+        """Whether the document is indexed as-is with the current settings."""
+        return self.documents.get(doc_key) == [parent_id, self.config_hash]
+
+    def indexed_parent(self, doc_key: str) -> Optional[str]:
+        """Parent id currently in the index for a key, if any."""
+        entry = self.documents.get(doc_key)
+        return entry[0] if entry else None
+
+    def set(self, doc_key: str, parent_id: str):
+        self.documents[doc_key] = [parent_id, self.config_hash]
+
+    def remove(self, doc_key: str):
+        self.documents.pop(doc_key, None)
+
+    def clear(self):
+        self.documents = {}
+
+    def keys(self) -> List[str]:
+        return list(self.documents.keys())
+
+    def save(self):
+        """Atomically rewrite the manifest file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump({"documents": self.documents}, f)
+        os.replace(tmp_path, self.path)
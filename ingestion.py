@@ -0,0 +1,241 @@
+import queue
+import logging
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import asyncio
+from tqdm import tqdm
+
+logger = logging.Logger(__name__)
+
+
+# (child id, text to embed, vector metadata)
+ChildRecord = Tuple[str, str, dict]
+
+_DONE = object()
+
+
+def estimate_batch_size(batch: List[str]) -> int:
+    """Estimate the size of the batch in bytes."""
+    return sum(len(item.encode('utf-8')) for item in batch)
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield lists of at most ``size`` consecutive items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestionStats():
+    """Counters of one pipeline run."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.embedded = 0
+        self.upserted = 0
+        self.failed_ids: List[str] = []
+
+    def as_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "failed": len(self.failed_ids),
+        }
+
+
+def _to_vectors(batch: List[ChildRecord], embeddings) -> List[dict]:
+    return [
+        {"id": child_id, "values": values, "metadata": metadata}
+        for (child_id, _, metadata), values in zip(batch, embeddings)
+    ]
+
+
+def stream_ingest(
+        records: Iterable[ChildRecord],
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        upsert_fn: Callable[[List[dict]], Optional[List[str]]],
+        embed_batch_size: int = 100,
+        upsert_batch_size: int = 512,
+        queue_size: int = 4
+    ) -> IngestionStats:
+    """Chunk, embed and upsert in three overlapping stages.
+
+    Chunking runs in a producer thread, embedding in the calling thread and
+    upserting in a consumer thread. The stages are connected by bounded
+    queues, so at most ``queue_size`` batches are in flight per stage and
+    memory stays constant regardless of corpus size. ``upsert_fn`` may
+    return the ids it failed to upsert; they are added to ``failed_ids``.
+    """
+    stats = IngestionStats()
+    to_embed = queue.Queue(maxsize=queue_size)
+    to_upsert = queue.Queue(maxsize=queue_size)
+    errors = []
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for batch in batched(records, embed_batch_size):
+                if stop.is_set():
+                    return
+                to_embed.put(batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            to_embed.put(_DONE)
+
+    def consume():
+        try:
+            for vectors in _rebatch(_drain(to_upsert), upsert_batch_size):
+                _record_upsert(stats, vectors, upsert_fn(vectors))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            # Keep draining so the embedding stage never blocks
+            for _ in _drain(to_upsert):
+                pass
+
+    producer = threading.Thread(target=produce, daemon=True)
+    consumer = threading.Thread(target=consume, daemon=True)
+    producer.start()
+    consumer.start()
+
+    with tqdm(desc="Ingesting chunks", unit="chunk") as progress:
+        for batch in _drain(to_embed):
+            stats.chunks += len(batch)
+            if stop.is_set():
+                continue
+            try:
+                embeddings = embed_fn([text for _, text, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding batch: {e}")
+                stats.failed_ids.extend(child_id for child_id, _, _ in batch)
+                continue
+            stats.embedded += len(batch)
+            to_upsert.put(_to_vectors(batch, embeddings))
+            progress.update(len(batch))
+
+    to_upsert.put(_DONE)
+    producer.join()
+    consumer.join()
+
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def _record_upsert(stats: IngestionStats, vectors: List[dict], failed: Optional[List[str]]):
+    failed = failed or []
+    stats.upserted += len(vectors) - len(failed)
+    stats.failed_ids.extend(failed)
+
+
+def _rebatch(batches: Iterable[list], size: int) -> Iterator[list]:
+    """Regroup a stream of lists into lists of ``size`` items."""
+    pending = []
+    for batch in batches:
+        pending.extend(batch)
+        while len(pending) >= size:
+            yield pending[:size]
+            pending = pending[size:]
+    if pending:
+        yield pending
+
+
+def _drain(q: queue.Queue) -> Iterator:
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        yield item
+
+
+async def astream_ingest(
+        records: Iterable[ChildRecord],
+        aembed_fn,
+        upsert_fn: Callable[[List[dict]], Optional[List[str]]],
+        embed_batch_size: int = 100,
+        upsert_batch_size: int = 512,
+        concurrency: int = 5,
+        queue_size: int = 8
+    ) -> IngestionStats:
+    """Async variant of ``stream_ingest``.
+
+    Chunking is pulled from ``records`` in a worker thread so it does not
+    block the event loop, ``concurrency`` tasks embed batches concurrently
+    and a single task upserts, again in a worker thread. All stages are
+    connected by bounded ``asyncio.Queue`` objects.
+    """
+    stats = IngestionStats()
+    to_embed = asyncio.Queue(maxsize=queue_size)
+    to_upsert = asyncio.Queue(maxsize=queue_size)
+    batches = batched(records, embed_batch_size)
+    progress = tqdm(desc="Ingesting chunks", unit="chunk")
+
+    async def produce():
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                stats.chunks += len(batch)
+                await to_embed.put(batch)
+        finally:
+            for _ in range(concurrency):
+                await to_embed.put(_DONE)
+
+    async def embed_worker():
+        while True:
+            batch = await to_embed.get()
+            if batch is _DONE:
+                return
+            try:
+                embeddings = await aembed_fn([text for _, text, _ in batch])
+            except Exception as e:
+                logger.error(f"Error embedding batch: {e}")
+                stats.failed_ids.extend(child_id for child_id, _, _ in batch)
+                continue
+            stats.embedded += len(batch)
+            progress.update(len(batch))
+            await to_upsert.put(_to_vectors(batch, embeddings))
+
+    async def upsert_worker():
+        pending = []
+        while True:
+            vectors = await to_upsert.get()
+            done = vectors is _DONE
+            if not done:
+                pending.extend(vectors)
+            while len(pending) >= upsert_batch_size or (done and pending):
+                chunk = pending[:upsert_batch_size]
+                pending = pending[upsert_batch_size:]
+                _record_upsert(stats, chunk, await asyncio.to_thread(upsert_fn, chunk))
+            if done:
+                return
+
+    workers = asyncio.gather(
+        produce(), *(embed_worker() for _ in range(concurrency))
+    )
+    upserter = asyncio.create_task(upsert_worker())
+    try:
+        # A failing upserter must not leave the embed workers blocked on a full queue
+        await asyncio.wait(
+            {workers, upserter}, return_when=asyncio.FIRST_COMPLETED
+        )
+        if upserter.done():
+            upserter.result()
+        await workers
+        await to_upsert.put(_DONE)
+        await upserter
+    finally:
+        workers.cancel()
+        upserter.cancel()
+        progress.close()
+
+    return stats
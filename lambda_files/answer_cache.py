@@ -0,0 +1,268 @@
+"""Answer cache for history-independent turns.
+
+Answers are keyed by the normalized search query together with a
+fingerprint of the retrieved passages, so a cached answer is only reused
+when the model would see the same context. Within a fingerprint, a query
+whose embedding is close enough to a cached one also counts as a hit.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.Logger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and order the words, since rewritten
+    queries are keyword lists whose order carries no meaning."""
+    return " ".join(sorted(set(re.findall(r"\w+", query.lower()))))
+
+
+def context_fingerprint(passages: List[str]) -> str:
+    digest = hashlib.sha256()
+    for passage in sorted(passages):
+        digest.update(passage.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def titan_embedder(bedrock_client, model_id: str = "amazon.titan-embed-text-v2:0"):
+    """Embedding function for near-match lookups backed by a Bedrock Titan model."""
+    def embed(text: str) -> List[float]:
+        response = bedrock_client.invoke_model(
+            modelId=model_id, body=json.dumps({"inputText": text})
+        )
+        return json.loads(response["body"].read())["embedding"]
+    return embed
+
+
+class InMemoryBackend():
+    """Process-local LRU store; entries survive across warm invocations."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._by_fingerprint: Dict[str, set] = {}
+
+    def get(self, key: str, fingerprint: Optional[str] = None) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._by_fingerprint.setdefault(entry["fingerprint"], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.delete(next(iter(self._entries)))
+
+    def delete(self, key: str, fingerprint: Optional[str] = None):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_fingerprint.get(entry["fingerprint"], set())
+            keys.discard(key)
+            if not keys:
+                self._by_fingerprint.pop(entry["fingerprint"], None)
+
+    def scan(self, fingerprint: str) -> List[Tuple[str, dict]]:
+        return [(key, self._entries[key]) for key in self._by_fingerprint.get(fingerprint, ())]
+
+
+class FileBackend():
+    """Directory-backed store, a local stand-in for a shared cache such as
+    Redis or DynamoDB: one JSON file per entry, grouped by fingerprint,
+    with least recently used files evicted beyond ``max_entries``. Lookups
+    take the fingerprint, so they open one file directly."""
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(path, exist_ok=True)
+        self._count = sum(len(files) for _, _, files in os.walk(path))
+
+    def _file(self, key: str, fingerprint: str) -> str:
+        return os.path.join(self.path, fingerprint, f"{key}.json")
+
+    def _read(self, file: str) -> Optional[dict]:
+        try:
+            with open(file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str, fingerprint: str) -> Optional[dict]:
+        file = self._file(key, fingerprint)
+        entry = self._read(file)
+        if entry is not None:
+            os.utime(file)  # mtime doubles as the LRU clock
+        return entry
+
+    def set(self, key: str, entry: dict):
+        file = self._file(key, entry["fingerprint"])
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        existed = os.path.exists(file)
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, file)
+        if not existed:
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        files = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(self.path) for name in names
+        ]
+        files.sort(key=os.path.getmtime)
+        for file in files[:max(0, len(files) - self.max_entries)]:
+            os.remove(file)
+        self._count = min(len(files), self.max_entries)
+
+    def delete(self, key: str, fingerprint: str):
+        try:
+            os.remove(self._file(key, fingerprint))
+        except FileNotFoundError:
+            return
+        self._count -= 1
+
+    def scan(self, fingerprint: str) -> List[Tuple[str, dict]]:
+        directory = os.path.join(self.path, fingerprint)
+        if not os.path.isdir(directory):
+            return []
+        entries = []
+        for name in os.listdir(directory):
+            entry = self._read(os.path.join(directory, name))
+            if entry is not None:
+                entries.append((name[:-len(".json")], entry))
+        return entries
+
+
+class AnswerCache():
+    """TTL-bounded answer cache with exact and embedding near-match lookups.
+
+    ``embed_fn`` is optional; without it only exact (normalized) queries
+    hit. Near matches must share the context fingerprint and reach a
+    cosine similarity of ``similarity_threshold``.
+    """
+
+    def __init__(
+            self,
+            backend=None,
+            ttl_seconds: float = 3600.0,
+            embed_fn: Optional[Callable[[str], List[float]]] = None,
+            similarity_threshold: float = 0.92
+        ):
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "near_hits": 0, "misses": 0, "skipped": 0, "stores": 0}
+
+    @staticmethod
+    def make_key(query: str, passages: List[str]) -> Tuple[str, str, str]:
+        """(key, normalized query, context fingerprint) of a lookup."""
+        normalized = normalize_query(query)
+        fingerprint = context_fingerprint(passages)
+        key = hashlib.sha256(f"{fingerprint}|{normalized}".encode("utf-8")).hexdigest()[:32]
+        return key, normalized, fingerprint
+
+    def _expired(self, entry: dict) -> bool:
+        return time.time() - entry["created"] > self.ttl_seconds
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        """Unit-normalized embedding, so similarity is a dot product."""
+        if self.embed_fn is None:
+            return None
+        try:
+            vector = [float(x) for x in self.embed_fn(text)]
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed, exact matches only: {e}")
+            return None
+        norm = math.sqrt(sum(x * x for x in vector))
+        return [x / norm for x in vector] if norm else vector
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def skip(self):
+        """Record a turn that was not eligible for caching."""
+        self._count("skipped")
+
+    def get(self, query: str, passages: List[str]) -> Optional[str]:
+        key, normalized, fingerprint = self.make_key(query, passages)
+        with self._lock:
+            entry = self.backend.get(key, fingerprint)
+            if entry is not None and self._expired(entry):
+                self.backend.delete(key, fingerprint)
+                entry = None
+        if entry is not None:
+            self._count("hits")
+            return entry["answer"]
+
+        near = self._near_match(normalized, fingerprint)
+        if near is not None:
+            self._count("near_hits")
+            return near
+
+        self._count("misses")
+        return None
+
+    def _near_match(self, normalized: str, fingerprint: str) -> Optional[str]:
+        if self.embed_fn is None:
+            return None
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self.backend.scan(fingerprint)
+                if entry.get("embedding") is not None
+            ]
+        if not candidates:
+            return None
+
+        vector = self._embed(normalized)
+        if vector is None:
+            return None
+
+        best, best_score = None, self.similarity_threshold
+        for key, entry in candidates:
+            if self._expired(entry):
+                continue
+            score = sum(a * b for a, b in zip(vector, entry["embedding"]))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best["answer"] if best is not None else None
+
+    def put(self, query: str, passages: List[str], answer: str):
+        key, normalized, fingerprint = self.make_key(query, passages)
+        vector = self._embed(normalized)
+        entry = {
+            "query": normalized,
+            "fingerprint": fingerprint,
+            "answer": answer,
+            "embedding": vector,
+            "created": time.time(),
+        }
+        with self._lock:
+            self.backend.set(key, entry)
+        self._count("stores")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["near_hits"] + counters["misses"]
+        counters["hit_rate"] = (
+            (counters["hits"] + counters["near_hits"]) / lookups if lookups else 0.0
+        )
+        return counters
@@ -0,0 +1,50 @@
+"""Shared, lazily created AWS clients.
+
+boto3 is only imported when the first client is needed, and each client is
+built once per process with connection pooling, TCP keep-alive and
+adaptive retries, then reused by every controller and request.
+"""
+
+import os
+import threading
+from typing import Callable, Optional
+
+_client_factory: Optional[Callable[[str], object]] = None
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "16")),
+        tcp_keepalive=True,
+        connect_timeout=float(os.environ.get("AWS_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.environ.get("AWS_READ_TIMEOUT", "60")),
+        retries={"mode": "adaptive", "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "4"))},
+    )
+
+
+def _boto3_client(service_name: str):
+    import boto3
+
+    return boto3.client(service_name, config=client_config())
+
+
+def set_client_factory(factory: Optional[Callable[[str], object]]):
+    """Overrides how clients are built (e.g. with stubs); ``None`` restores
+    boto3. Clients built so far are discarded."""
+    global _client_factory
+    with _lock:
+        _client_factory = factory
+        _clients.clear()
+
+
+def get_client(service_name: str):
+    with _lock:
+        client = _clients.get(service_name)
+        if client is None:
+            client = (_client_factory or _boto3_client)(service_name)
+            _clients[service_name] = client
+        return client
@@ -1,7 +1,18 @@
+import os
+import re
+import time
 import logging
-from typing import List
+import threading
+from typing import Callable, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import tracing
+from answer_cache import AnswerCache
+from aws_clients import get_client
+from context_packing import ContextPacker
+from history import HistoryManager
+from retrieval_cache import RetrievalCache
+from thread_store import LocalFileBackend, S3Backend, ThreadStore
 
 logger = logging.Logger(__name__)
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -23,6 +34,13 @@ class BedrockController:
     </context>
     """
 
+    SUMMARY_TEMPLATE = """
+    Summary of the earlier conversation:
+    <summary>
+    {summary}
+    </summary>
+    """
+
     QUERY_TRANSFORMER_SYSTEM_PROMPT = """
     You are a search query generator. Your ONLY function is to output 2-10 words that will be used as search terms.
     
@@ -47,7 +65,24 @@ class BedrockController:
     - "langchain RAG implementation guide"
     """
 
-    def __init__(self):
+    # Rewrite modes: "serial" rewrites then retrieves, "speculative" retrieves 
+    # on the raw input while rewriting, "skip" retrieves on the raw input only
+    REWRITE_MODES = ("serial", "speculative", "skip")
+
+    def __init__(
+            self,
+            rewrite_mode: Optional[str] = None,
+            rewrite_policy: Optional[Callable[[str, List[dict]], str]] = None,
+            speculation_overlap: float = 0.6,
+            skip_first_turn_rewrite: bool = False,
+            answer_cache: Optional[AnswerCache] = None,
+            retrieval_cache: Optional[RetrievalCache] = None,
+            top_k: int = 5,
+            history_manager: Optional[HistoryManager] = None,
+            thread_store: Optional[ThreadStore] = None,
+            context_packer: Optional[ContextPacker] = None,
+            executor_workers: int = 4
+        ):
         # LLM Hyperparameters
         self.model_id = "amazon.nova-micro-v1:0"
         self.query_rewriter_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
@@ -62,55 +97,299 @@ class BedrockController:
             "topP": 0.1,
         }  # Inference configuration for low creativity
 
-        self.bedrock_client = boto3.client(service_name="bedrock-runtime")
-        self.kb_client = boto3.client("bedrock-agent-runtime")
+        # Clients are created on first use and shared across the process
+        self._bedrock_client = None
+        self._kb_client = None
         self.kb_id = "2OHLYXDVLT"
-        self.message_histories = {}
+        self.top_k = top_k
+        # Dedupes, orders and budgets the retrieved passages for the prompt
+        self.context_packer = context_packer if context_packer is not None else ContextPacker(
+            token_budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500"))
+        )
+        # Recent turns stay verbatim, older ones are folded into a summary
+        self.history = history_manager if history_manager is not None else HistoryManager()
+        # Bounded thread cache over an optional persistent backend
+        # A new ThreadStore is an empty mapping, hence falsy: test for None
+        self.message_histories = (
+            thread_store if thread_store is not None else self._default_thread_store()
+        )
+        if self.message_histories.on_evict is None:
+            self.message_histories.on_evict = self.history.forget
+
+        # Query rewrite strategy, overridable per request
+        self.rewrite_mode = (
+            rewrite_mode if rewrite_mode is not None else os.environ.get("REWRITE_MODE", "serial")
+        )
+        if self.rewrite_mode not in BedrockController.REWRITE_MODES:
+            raise ValueError(f"Unknown rewrite mode: {self.rewrite_mode}")
+        self.rewrite_policy = (
+            rewrite_policy if rewrite_policy is not None else self._default_rewrite_policy
+        )
+        self.speculation_overlap = speculation_overlap
+        self.skip_first_turn_rewrite = skip_first_turn_rewrite
+        # Speculative retrievals; size it to the number of concurrent turns
+        self._executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self._rewrite_seconds = None  # moving average, to estimate skipped rewrites
+        # Per calling thread, so concurrent turns do not see each other's timings
+        self._local = threading.local()
+
+        # Answers of history-independent turns, keyed by query and context
+        self.answer_cache = answer_cache
+
+        # Knowledge Base results, shared across threads and warm invocations;
+        # RETRIEVAL_CACHE_TTL=0 disables the default cache
+        if retrieval_cache is None:
+            ttl = float(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))
+            retrieval_cache = RetrievalCache(ttl_seconds=ttl) if ttl > 0 else None
+        self.retrieval_cache = retrieval_cache
+
+    @property
+    def last_timings(self) -> dict:
+        """Stage timings of the last turn served by the calling thread."""
+        return getattr(self._local, "timings", {})
+
+    @last_timings.setter
+    def last_timings(self, timings: dict):
+        self._local.timings = timings
+
+    @property
+    def bedrock_client(self):
+        if self._bedrock_client is None:
+            self._bedrock_client = get_client("bedrock-runtime")
+        return self._bedrock_client
+
+    @bedrock_client.setter
+    def bedrock_client(self, client):
+        self._bedrock_client = client
+
+    @property
+    def kb_client(self):
+        if self._kb_client is None:
+            self._kb_client = get_client("bedrock-agent-runtime")
+        return self._kb_client
+
+    @kb_client.setter
+    def kb_client(self, client):
+        self._kb_client = client
+
+    def warm(self, prime: bool = False) -> dict:
+        """Creates the AWS clients ahead of the first request; with 
+        ``prime``, also opens the Knowledge Base connection with a retrieval."""
+        started = time.perf_counter()
+        self.bedrock_client, self.kb_client
+        if prime:
+            self._retrieve("langchain")
+        return {"warm": True, "primed": prime, "seconds": time.perf_counter() - started}
+
+    def _default_thread_store(self) -> ThreadStore:
+        """Threads persist to S3 if THREAD_STORE_BUCKET is set, to a local 
+        directory if THREAD_STORE_DIR is set, otherwise only in memory."""
+        backend = None
+        if os.environ.get("THREAD_STORE_BUCKET"):
+            backend = S3Backend(os.environ["THREAD_STORE_BUCKET"])
+        elif os.environ.get("THREAD_STORE_DIR"):
+            backend = LocalFileBackend(os.environ["THREAD_STORE_DIR"])
+        return ThreadStore(
+            backend,
+            max_threads=int(os.environ.get("THREAD_STORE_MAX_THREADS", "1000")),
+            idle_ttl=float(os.environ.get("THREAD_STORE_IDLE_TTL", "3600")),
+        )
+
+    def flush(self, thread_id: Optional[str] = None):
+        """Writes pending updates of one thread (default: all) to the 
+        persistent backend."""
+        self.message_histories.flush(thread_id)
+
+    def _system_prompt(self, retrieved_context: str, thread_id: str) -> str:
+        prompt = BedrockController.SYSTEM_TEMPLATE.format(context=retrieved_context)
+        summary = self.history.summary(thread_id)
+        if summary:
+            prompt += BedrockController.SUMMARY_TEMPLATE.format(summary=summary)
+        return prompt
+
+    def _estimate_input_tokens(self, system_prompt: str, thread_id: str) -> int:
+        return self.history.tokens(system_prompt) + self.history.message_tokens(
+            self.message_histories[thread_id]
+        )
 
     def _invoke_llm(self, retrieved_context, thread_id):
         """Queries a Bedrock LLM with contexts and chat history."""
 
-        system_prompt_with_context = BedrockController.SYSTEM_TEMPLATE.format(
-            context=[cont for cont in retrieved_context]
-        )
+        system_prompt_with_context = self._system_prompt(retrieved_context, thread_id)
+        estimated_tokens = self._estimate_input_tokens(system_prompt_with_context, thread_id)
 
         logger.info("Generating message with model %s", self.model_id)
 
-        response = self.bedrock_client.converse(
-            modelId=self.model_id,
-            messages=self.message_histories[thread_id],
-            system=[{"text": system_prompt_with_context}],
-            inferenceConfig=self.answer_gen_inference_config,
-            # additionalModelRequestFields=additional_model_fields
-        )
-        logger.info("LLM response generated.")
+        with tracing.span("generate", model=self.model_id) as span:
+            response = self.bedrock_client.converse(
+                modelId=self.model_id,
+                messages=self.message_histories[thread_id],
+                system=[{"text": system_prompt_with_context}],
+                inferenceConfig=self.answer_gen_inference_config,
+                # additionalModelRequestFields=additional_model_fields
+            )
+            logger.info("LLM response generated.")
 
-        token_usage = response["usage"]
-        logger.info("Input tokens: %s", token_usage["inputTokens"])
-        logger.info("Output tokens: %s", token_usage["outputTokens"])
-        logger.info("Total tokens: %s", token_usage["totalTokens"])
-        logger.info("Stop reason: %s", response["stopReason"])
+            self._log_usage(response["usage"], response["stopReason"], estimated_tokens, span)
 
         return response
 
-    def _retrieve(self, query_term: str, top_k: int = 5) -> List:
+    def _invoke_llm_stream(self, retrieved_context, thread_id) -> Iterator[str]:
+        """Streams the answer of a Bedrock LLM as text deltas; usage and 
+        stop reason are logged once the stream is finished."""
+
+        system_prompt_with_context = self._system_prompt(retrieved_context, thread_id)
+        estimated_tokens = self._estimate_input_tokens(system_prompt_with_context, thread_id)
+
+        logger.info("Streaming message with model %s", self.model_id)
+
+        # Not entered as a context manager: the generator may be resumed
+        # from another context by the consumer
+        span = tracing.span("generate", model=self.model_id, stream=True)
+        try:
+            response = self.bedrock_client.converse_stream(
+                modelId=self.model_id,
+                messages=self.message_histories[thread_id],
+                system=[{"text": system_prompt_with_context}],
+                inferenceConfig=self.answer_gen_inference_config,
+            )
+
+            token_usage, stop_reason = None, None
+            for event in response["stream"]:
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text")
+                    if text:
+                        yield text
+                elif "messageStop" in event:
+                    stop_reason = event["messageStop"]["stopReason"]
+                elif "metadata" in event:
+                    token_usage = event["metadata"].get("usage")
+            logger.info("LLM response streamed.")
+
+            self._log_usage(token_usage, stop_reason, estimated_tokens, span)
+        finally:
+            span.finish()
+
+    def _log_usage(self, token_usage, stop_reason, estimated_tokens: int = 0,
+                   span=tracing.NOOP_SPAN):
+        if token_usage:
+            self.history.observe_usage(estimated_tokens, token_usage["inputTokens"])
+            span.count("input_tokens", token_usage["inputTokens"])
+            span.count("output_tokens", token_usage["outputTokens"])
+            span.count("estimated_input_tokens", estimated_tokens)
+            logger.info("Input tokens: %s", token_usage["inputTokens"])
+            logger.info("Output tokens: %s", token_usage["outputTokens"])
+            logger.info("Total tokens: %s", token_usage["totalTokens"])
+        logger.info("Stop reason: %s", stop_reason)
+
+    def _retrieve(self, query_term: str, top_k: Optional[int] = None) -> List:
         """Queries a predefined AWS Knowledge Base."""
-        context = self.kb_client.retrieve(
-            knowledgeBaseId=self.kb_id,
-            retrievalConfiguration={
-                "vectorSearchConfiguration": {
-                    "numberOfResults": 5,
-                }
-            },
-            retrievalQuery={"text": query_term},
-        )
-        context = [chunk["content"]["text"] for chunk in context["retrievalResults"]]
+        return [result["text"] for result in self._retrieve_results(query_term, top_k)]
 
-        return context
+    def _retrieve_results(self, query_term: str, top_k: Optional[int] = None) -> List[dict]:
+        """Retrieved passages with their relevance scores, served from the 
+        retrieval cache when the same query term was seen recently."""
+        top_k = top_k or self.top_k
+        with tracing.span("retrieve", top_k=top_k) as span:
+            if self.retrieval_cache is None:
+                results = self._query_kb(query_term, top_k)
+            else:
+                key = RetrievalCache.make_key(self.kb_id, query_term, top_k)
+                results = self.retrieval_cache.get_or_load(
+                    key, lambda: self._query_kb(query_term, top_k)
+                )
+            span.count("passages", len(results))
+        return results
 
-    def converse(self, user_input: str, thread_id: str) -> str:
+    def _query_kb(self, query_term: str, top_k: int) -> List[dict]:
+        with tracing.span("kb_query"):
+            context = self.kb_client.retrieve(
+                knowledgeBaseId=self.kb_id,
+                retrievalConfiguration={
+                    "vectorSearchConfiguration": {
+                        "numberOfResults": top_k,
+                    }
+                },
+                retrievalQuery={"text": query_term},
+            )
+        return [
+            {"text": chunk["content"]["text"], "score": chunk.get("score")}
+            for chunk in context["retrievalResults"]
+        ]
+
+    def converse(
+            self, user_input: str, thread_id: str, rewrite_mode: Optional[str] = None
+    ) -> str:
         """Controls Query Rewriting, Retrieval, Chat History management 
         and LLM inference."""
+        started = time.perf_counter()
+        try:
+            context, timings = self._start_turn(user_input, thread_id, rewrite_mode)
+
+            cached = self._cached_answer(thread_id, context, timings)
+            if cached is not None:
+                message = {"role": "assistant", "content": [{"text": cached}]}
+                self._end_turn(thread_id, message, timings, started)
+                return cached
+
+            stage = time.perf_counter()
+            response = self._invoke_llm(context, thread_id)
+        except Exception:
+            self._abort_turn(thread_id)
+            raise
+        timings["generate_s"] = time.perf_counter() - stage
+        logger.info("LLM response: " + str(response))
+
+        answer = response["output"]["message"]["content"][0]["text"]
+        self._store_answer(context, timings, answer)
+        self._end_turn(thread_id, response["output"]["message"], timings, started)
+
+        return answer
+
+    def converse_stream(
+            self, user_input: str, thread_id: str, rewrite_mode: Optional[str] = None
+    ) -> Iterator[str]:
+        """Streaming variant of ``converse``: yields the answer as text 
+        deltas. The answer is added to the history when the stream ends; 
+        if the consumer stops early, the partial answer is kept."""
+        started = time.perf_counter()
+        try:
+            context, timings = self._start_turn(user_input, thread_id, rewrite_mode)
+            cached = self._cached_answer(thread_id, context, timings)
+        except Exception:
+            self._abort_turn(thread_id)
+            raise
+        if cached is not None:
+            timings["first_token_s"] = time.perf_counter() - started
+            message = {"role": "assistant", "content": [{"text": cached}]}
+            self._end_turn(thread_id, message, timings, started)
+            yield cached
+            return
+
+        stage = time.perf_counter()
+        chunks = []
+        completed = False
+        try:
+            for text in self._invoke_llm_stream(context, thread_id):
+                if not chunks:
+                    timings["first_token_s"] = time.perf_counter() - started
+                chunks.append(text)
+                yield text
+            completed = True
+        finally:
+            timings["generate_s"] = time.perf_counter() - stage
+            if chunks:
+                message = {"role": "assistant", "content": [{"text": "".join(chunks)}]}
+                if completed:
+                    self._store_answer(context, timings, "".join(chunks))
+                self._end_turn(thread_id, message, timings, started)
+            else:
+                self._abort_turn(thread_id)
+
+    def _start_turn(
+            self, user_input: str, thread_id: str, rewrite_mode: Optional[str]
+    ):
+        """Adds the user message to the thread, then rewrites and retrieves."""
         if thread_id not in self.message_histories:
             self.message_histories[thread_id] = [
                 {"role": "user", "content": [{"text": user_input}]}
@@ -120,35 +399,184 @@ class BedrockController:
                 {"role": "user", "content": [{"text": user_input}]}
             )
         cur_thread = self.message_histories[thread_id]
+        if not self.history.summary(thread_id):
+            # Restore the summary of a thread loaded from the backend
+            stored_summary = self.message_histories.summary(thread_id)
+            if stored_summary:
+                self.history.summaries[thread_id] = stored_summary
+
+        # The policy sees the uncompacted thread, so a single message
+        # still means a first turn
+        mode = rewrite_mode or self.rewrite_policy(user_input, cur_thread)
+        timings = {"mode": mode}
+        with tracing.span("history") as span:
+            self.history.compact(thread_id, cur_thread)
+            timings["history"] = self.history.report(
+                thread_id, cur_thread, self.history.rewrite_view(cur_thread)
+            )
+            span.count("tokens_saved", timings["history"]["tokens_saved"])
+        results = self._rewrite_and_retrieve(user_input, thread_id, mode, timings)
+        logger.info("Contexts retrieved: " + str(results))
+        # Kept for offline scoring of the turn's retrieval (benchmarks/run.py)
+        timings["retrieved"] = [result["text"] for result in results]
+        with tracing.span("context_pack") as span:
+            context, timings["context"] = self.context_packer.pack(results)
+            span.count("packed_tokens", timings["context"]["packed_tokens"])
+            span.count("tokens_saved", timings["context"]["tokens_saved"])
+
+        return context, timings
+
+    def _end_turn(self, thread_id: str, message: dict, timings: dict, started: float):
+        """Adds the answer to the thread; the history manager compacts it 
+        at the start of the next turn."""
+        self.message_histories[thread_id].append(message)
+        self.message_histories.set_summary(thread_id, self.history.summary(thread_id))
+        self.message_histories.mark_dirty(thread_id)
 
+        timings["total_s"] = time.perf_counter() - started
+        self.last_timings = timings
+        tracing.record(
+            "turn", timings["total_s"] * 1000,
+            {"saved_ms": (timings.get("saved_s", 0.0) * 1000, "Milliseconds")},
+            mode=timings["mode"], answer_cache=timings.get("answer_cache"),
+            speculation=timings.get("speculation"),
+        )
+        logger.info(
+            "Stage timings: %s", {k: v for k, v in timings.items() if k != "retrieved"}
+        )
+        if self.answer_cache is not None:
+            logger.info("Answer cache stats: %s", self.answer_cache.stats())
+        if self.retrieval_cache is not None:
+            logger.info("Retrieval cache stats: %s", self.retrieval_cache.stats())
+
+    def _abort_turn(self, thread_id: str):
+        """Removes the user message of a turn that failed before its answer, 
+        keeping user/assistant turns alternating for the Converse API."""
+        if thread_id not in self.message_histories:
+            return
+        cur_thread = self.message_histories[thread_id]
+        if cur_thread and cur_thread[-1]["role"] == "user":
+            cur_thread.pop()
+            self.message_histories.mark_dirty(thread_id)
+
+    def _cached_answer(self, thread_id: str, context: str, timings: dict) -> Optional[str]:
+        """Looks up the answer of a history-independent (first) turn."""
+        if self.answer_cache is None:
+            return None
+        if len(self.message_histories[thread_id]) != 1 or self.history.summary(thread_id):
+            self.answer_cache.skip()
+            timings["answer_cache"] = "skip"
+            return None
+
+        answer = self.answer_cache.get(timings["query"], [context])
+        timings["answer_cache"] = "hit" if answer is not None else "miss"
+        return answer
+
+    def _store_answer(self, context: str, timings: dict, answer: str):
+        if self.answer_cache is not None and timings.get("answer_cache") == "miss":
+            self.answer_cache.put(timings["query"], [context], answer)
+
+    def _default_rewrite_policy(self, user_input: str, history: List[dict]) -> str:
+        """Skip the rewrite on the first turn of a thread if configured, 
+        where the raw question carries no conversational references."""
+        if self.skip_first_turn_rewrite and len(history) == 1:
+            return "skip"
+        return self.rewrite_mode
+
+    def _rewrite_and_retrieve(
+            self, user_input: str, thread_id: str, mode: str, timings: dict
+    ) -> List[dict]:
+        """Runs query rewriting and retrieval according to the rewrite mode, 
+        recording per-stage timings and the estimated latency saved."""
+        if mode not in BedrockController.REWRITE_MODES:
+            raise ValueError(f"Unknown rewrite mode: {mode}")
+
+        if mode == "skip":
+            timings["query"] = user_input
+            stage = time.perf_counter()
+            context = self._retrieve_results(user_input)
+            timings["retrieve_s"] = time.perf_counter() - stage
+            timings["saved_s"] = self._rewrite_seconds or 0.0
+            return context
+
+        if mode == "serial":
+            stage = time.perf_counter()
+            query_term = self._transform_query(thread_id)
+            timings["rewrite_s"] = self._record_rewrite(time.perf_counter() - stage)
+            logger.info("Query rewriting done, with result of: " + query_term)
+            timings["query"] = query_term
+
+            stage = time.perf_counter()
+            context = self._retrieve_results(query_term)
+            timings["retrieve_s"] = time.perf_counter() - stage
+            timings["saved_s"] = 0.0
+            return context
+
+        # Speculative: retrieve on the raw input while the rewrite runs
+        stage = time.perf_counter()
+        speculative = self._executor.submit(
+            tracing.bind(self._timed), self._retrieve_results, user_input
+        )
         query_term = self._transform_query(thread_id)
+        timings["rewrite_s"] = self._record_rewrite(time.perf_counter() - stage)
         logger.info("Query rewriting done, with result of: " + query_term)
+        timings["query"] = query_term
+        context, timings["speculative_retrieve_s"] = speculative.result()
+        parallel_s = time.perf_counter() - stage
 
-        context = self._retrieve(query_term)
-        logger.info("Contexts retrieved: " + str(context))
+        overlap = self._term_overlap(query_term, user_input)
+        timings["term_overlap"] = overlap
+        if overlap >= self.speculation_overlap:
+            # The rewrite adds little over the raw input: keep the speculative result
+            timings["speculation"] = "hit"
+            timings["saved_s"] = (
+                timings["rewrite_s"] + timings["speculative_retrieve_s"] - parallel_s
+            )
+            return context
 
-        response = self._invoke_llm(context, thread_id)
-        logger.info("LLM response: " + str(response))
+        timings["speculation"] = "miss"
+        stage = time.perf_counter()
+        context = self._retrieve_results(query_term)
+        timings["retrieve_s"] = time.perf_counter() - stage
+        # Negative: the wasted wait on the speculative call, if it outlasted the rewrite
+        timings["saved_s"] = timings["rewrite_s"] - parallel_s
+        return context
 
-        cur_thread.append(response["output"]["message"])
+    @staticmethod
+    def _timed(fn, *args):
+        stage = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - stage
 
-        # Forgetting
-        if len(cur_thread) > 20:
-            while cur_thread[0]["role"] != "user" and len(cur_thread) > 20:
-                logger.info("Message history truncated.")
-                cur_thread.pop(0)
+    def _record_rewrite(self, seconds: float) -> float:
+        if self._rewrite_seconds is None:
+            self._rewrite_seconds = seconds
+        else:
+            self._rewrite_seconds = 0.8 * self._rewrite_seconds + 0.2 * seconds
+        return seconds
 
-        return response["output"]["message"]["content"][0]["text"]
+    @staticmethod
+    def _term_overlap(query_term: str, user_input: str) -> float:
+        """Share of the rewritten keywords that already occur in the raw input."""
+        terms = set(re.findall(r"\w+", query_term.lower()))
+        if not terms:
+            return 1.0
+        words = set(re.findall(r"\w+", user_input.lower()))
+        return len(terms & words) / len(terms)
 
     def _transform_query(self, thread_id: str) -> str:
         """
         Transform user query into search terms for retrieval.
         """
-        query = self.bedrock_client.converse(
-            modelId=self.query_rewriter_id,
-            messages=self.message_histories[thread_id],
-            system=[{"text": BedrockController.QUERY_TRANSFORMER_SYSTEM_PROMPT}],
-            inferenceConfig=self.q_rewrite_inference_config,
-        )
+        with tracing.span("rewrite", model=self.query_rewriter_id) as span:
+            query = self.bedrock_client.converse(
+                modelId=self.query_rewriter_id,
+                messages=self.history.rewrite_view(self.message_histories[thread_id]),
+                system=[{"text": BedrockController.QUERY_TRANSFORMER_SYSTEM_PROMPT}],
+                inferenceConfig=self.q_rewrite_inference_config,
+            )
+            if "usage" in query:
+                span.count("input_tokens", query["usage"]["inputTokens"])
+                span.count("output_tokens", query["usage"]["outputTokens"])
 
         return query["output"]["message"]["content"][0]["text"]
@@ -0,0 +1,105 @@
+"""Packs retrieved passages into the answer prompt.
+
+Passages are deduplicated by word-shingle containment (overlapping chunks
+and near-duplicates), ordered by relevance score, trimmed to a token budget
+and rendered as compact numbered blocks.
+"""
+
+import re
+import zlib
+import logging
+from typing import List, Set, Tuple
+
+from history import count_tokens
+
+logger = logging.Logger(__name__)
+
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))} if words else set()
+    return {
+        zlib.crc32(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(len(words) - size + 1)
+    }
+
+
+def _trim(text: str, max_tokens: int) -> str:
+    """Cuts ``text`` at a word boundary to about ``max_tokens`` tokens."""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low]) + " ..."
+
+
+class ContextPacker():
+    """Deduplicates, orders and budgets retrieved passages.
+
+    A passage is dropped when at least ``duplicate_threshold`` of its
+    shingles already occur in a kept, higher-scored passage.
+    """
+
+    def __init__(
+            self,
+            token_budget: int = 1500,
+            shingle_size: int = 5,
+            duplicate_threshold: float = 0.8,
+            min_passage_tokens: int = 40
+        ):
+        self.token_budget = token_budget
+        self.shingle_size = shingle_size
+        self.duplicate_threshold = duplicate_threshold
+        self.min_passage_tokens = min_passage_tokens
+
+    def pack(self, results: List[dict]) -> Tuple[str, dict]:
+        """Renders ``{"text", "score"}`` results; returns the context and a
+        report of the tokens saved against the raw list rendering."""
+        # Stable sort: unscored results keep the retrieval order
+        ordered = sorted(
+            (r for r in results if r["text"].strip()),
+            key=lambda r: -(r.get("score") or 0.0)
+        )
+
+        kept, seen = [], set()
+        duplicates = 0
+        for result in ordered:
+            text = " ".join(result["text"].split())
+            result_shingles = shingles(text, self.shingle_size)
+            if result_shingles and len(result_shingles & seen) >= (
+                    self.duplicate_threshold * len(result_shingles)):
+                duplicates += 1
+                continue
+            seen |= result_shingles
+            kept.append(text)
+
+        passages, used, truncated = [], 0, 0
+        for text in kept:
+            tokens = count_tokens(text)
+            remaining = self.token_budget - used
+            if tokens > remaining:
+                if remaining < self.min_passage_tokens:
+                    break
+                text, tokens = _trim(text, remaining), remaining
+                truncated += 1
+            passages.append(f"[{len(passages) + 1}] {text}")
+            used += tokens
+
+        context = "\n\n".join(passages)
+        raw_tokens = count_tokens(str([r["text"] for r in results]))
+        packed_tokens = count_tokens(context)
+        report = {
+            "passages": len(passages),
+            "duplicates": duplicates,
+            "truncated": truncated,
+            "dropped": len(kept) - len(passages),
+            "raw_tokens": raw_tokens,
+            "packed_tokens": packed_tokens,
+            "tokens_saved": max(0, raw_tokens - packed_tokens),
+        }
+        return context, report
@@ -0,0 +1,158 @@
+"""Token-budgeted conversation history.
+
+The last ``keep_turns`` turns of a thread are sent verbatim; older turns
+are folded into a rolling summary that goes into the system prompt. The
+query rewriter only sees the most recent ``rewrite_turns`` turns.
+"""
+
+import re
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.Logger(__name__)
+
+_ENCODING = None
+
+
+def _encoding():
+    """tiktoken encoding if available (it is not part of the Lambda package)."""
+    global _ENCODING
+    if _ENCODING is None:
+        try:
+            import tiktoken
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _ENCODING = False
+    return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def message_text(message: dict) -> str:
+    return " ".join(block.get("text", "") for block in message["content"])
+
+
+def extractive_summary(previous: str, folded: List[dict], max_chars: int = 240) -> str:
+    """Appends one line per folded turn: the question and the first
+    sentence of the answer."""
+    lines = [previous] if previous else []
+    for i in range(0, len(folded), 2):
+        question = message_text(folded[i]).strip()[:max_chars]
+        line = f"User asked: {question}"
+        if i + 1 < len(folded):
+            answer = message_text(folded[i + 1]).strip()
+            first_sentence = re.split(r"(?<=[.!?])\s", answer, maxsplit=1)[0]
+            line += f" | Assistant: {first_sentence[:max_chars]}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class HistoryManager():
+    """Compacts chat threads to a token budget and reports the savings.
+
+    Token counts use tiktoken when installed, else ~4 characters per token;
+    both are scaled by a ratio learned from Bedrock's reported input tokens
+    (``observe_usage``). ``summarize_fn(previous_summary, folded_messages)``
+    can replace the default extractive summary, e.g. with an LLM call.
+    """
+
+    def __init__(
+            self,
+            answer_token_budget: int = 2000,
+            rewrite_token_budget: int = 300,
+            keep_turns: int = 3,
+            rewrite_turns: int = 1,
+            summary_token_budget: int = 300,
+            summarize_fn: Optional[Callable[[str, List[dict]], str]] = None,
+            baseline_messages: int = 20
+        ):
+        self.answer_token_budget = answer_token_budget
+        self.rewrite_token_budget = rewrite_token_budget
+        self.keep_turns = keep_turns
+        self.rewrite_turns = rewrite_turns
+        self.summary_token_budget = summary_token_budget
+        self.summarize_fn = summarize_fn or extractive_summary
+        # Savings are measured against sending the last `baseline_messages`
+        # raw messages, as the controller did before compaction
+        self.baseline_messages = baseline_messages
+        self.summaries: Dict[str, str] = {}
+        self._folded_tokens: Dict[str, List[int]] = {}
+        self._usage_ratio = 1.0
+
+    def tokens(self, text: str) -> int:
+        return int(count_tokens(text) * self._usage_ratio)
+
+    def message_tokens(self, messages: List[dict]) -> int:
+        return sum(self.tokens(message_text(message)) for message in messages)
+
+    def observe_usage(self, estimated_tokens: int, input_tokens: int):
+        """Calibrates the estimates against Bedrock's reported input tokens."""
+        if estimated_tokens > 0 and input_tokens:
+            raw = estimated_tokens / self._usage_ratio
+            self._usage_ratio = 0.8 * self._usage_ratio + 0.2 * (input_tokens / raw)
+
+    def summary(self, thread_id: str) -> str:
+        return self.summaries.get(thread_id, "")
+
+    def compact(self, thread_id: str, messages: List[dict]):
+        """Folds the oldest turns of ``messages`` (in place) into the thread
+        summary until at most ``keep_turns`` turns before the current user
+        message remain and they fit the answer budget."""
+        folded = []
+        while len(messages) > 1 and messages[0]["role"] == "user" and (
+                len(messages) > 2 * self.keep_turns + 1
+                or self.message_tokens(messages) > self.answer_token_budget):
+            # Fold whole turns so the thread still starts with a user message
+            turn = [messages.pop(0)]
+            if messages and messages[0]["role"] == "assistant":
+                turn.append(messages.pop(0))
+            folded.extend(turn)
+        if not folded:
+            return
+
+        summary = self.summarize_fn(self.summary(thread_id), folded)
+        lines = summary.split("\n")
+        while len(lines) > 1 and self.tokens("\n".join(lines)) > self.summary_token_budget:
+            lines.pop(0)
+        self.summaries[thread_id] = "\n".join(lines)
+
+        folded_tokens = self._folded_tokens.setdefault(thread_id, [])
+        folded_tokens.extend(self.tokens(message_text(message)) for message in folded)
+        del folded_tokens[:-self.baseline_messages]
+        logger.info(f"Folded {len(folded)} messages of thread {thread_id} into its summary.")
+
+    def rewrite_view(self, messages: List[dict]) -> List[dict]:
+        """The recent slice sent to the query rewriter, within its budget."""
+        view = messages[-(2 * self.rewrite_turns + 1):]
+        while len(view) > 1 and (view[0]["role"] != "user"
+                                 or self.message_tokens(view) > self.rewrite_token_budget):
+            view = view[1:]
+        return view
+
+    def report(self, thread_id: str, messages: List[dict], rewrite_messages: List[dict]) -> dict:
+        """Token counts of the compacted requests and the tokens saved
+        against the uncompacted history."""
+        answer_tokens = self.message_tokens(messages)
+        summary_tokens = self.tokens(self.summary(thread_id)) if self.summary(thread_id) else 0
+        rewrite_tokens = self.message_tokens(rewrite_messages)
+
+        room = max(0, self.baseline_messages - len(messages))
+        folded = self._folded_tokens.get(thread_id, [])
+        baseline = answer_tokens + (sum(folded[-room:]) if room else 0)
+        saved = (baseline - answer_tokens - summary_tokens) + (baseline - rewrite_tokens)
+        return {
+            "answer_history_tokens": answer_tokens,
+            "summary_tokens": summary_tokens,
+            "rewrite_history_tokens": rewrite_tokens,
+            "baseline_history_tokens": baseline,
+            "tokens_saved": max(0, saved),
+        }
+
+    def forget(self, thread_id: str):
+        self.summaries.pop(thread_id, None)
+        self._folded_tokens.pop(thread_id, None)
@@ -1,3 +1,4 @@
+import os
 import logging
 import json
 
@@ -6,31 +7,131 @@ from parser import parse_input
 
 logger = logging.Logger(__name__)
 
-brc = BedrockController()
+_controller = None
 
 
-def lambda_handler(event, context):
-    logger.info("Received event: " + json.dumps(event, indent=2))
+def get_controller() -> BedrockController:
+    """The controller of this container, built on first use so cold starts
+    do not pay for client setup before the request is parsed."""
+    global _controller
+    if _controller is None:
+        _controller = BedrockController()
+    return _controller
+
+
+def set_controller(controller):
+    """Replaces the controller used by the handlers, e.g. with a
+    ``ConcurrentController`` when one process serves many threads
+    (see server.py)."""
+    global _controller
+    _controller = controller
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
+}
 
+
+def _parse_event(event):
+    """Extracts the input text, thread id and request options from a
+    Function URL (``body``) or direct invocation event."""
     input_text = None
     thread_id = None
+    options = {}
+
+    if "body" in event:
+        try:
+            body = json.loads(event["body"])
+            input_json = body.get("input")
+            thread_id = body.get("thread_id")
+            options = body
+            input_text = parse_input(input_json)
+
+        except json.JSONDecodeError:
+            logger.error("Failed to parse request body as JSON")
+
+    # If no input found in body, try to find it directly in the event
+    if not input_text:
+        input_json = event.get("input")
+        thread_id = event.get("thread_id")
+        options = event
+        input_text = parse_input(input_json)
+
+    return input_text, thread_id, {
+        "rewrite_mode": options.get("rewrite_mode"),
+        "stream": bool(options.get("stream", False)),
+    }
 
+
+def _sse(event_name, data):
+    """Formats one server-sent event."""
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
+
+
+def _stream_events(event):
+    """Yields the ``(name, data)`` events of a streamed turn. An ``error``
+    raised before the first token carries the HTTP ``status`` to answer with."""
+    input_text, thread_id, options = _parse_event(event)
+
+    if not input_text or not thread_id:
+        yield "error", {"error": "Missing input parameter.", "status": 400}
+        return
+
+    started = False
     try:
-        if "body" in event:
-            try:
-                body = json.loads(event["body"])
-                input_json = body.get("input")
-                thread_id = body.get("thread_id")
-                input_text = parse_input(input_json)
-
-            except json.JSONDecodeError:
-                logger.error("Failed to parse request body as JSON")
-
-        # If no input found in body, try to find it directly in the event
-        if not input_text:
-            input_json = event.get("input")
-            thread_id = event.get("thread_id")
-            input_text = parse_input(input_json)
+        brc = get_controller()
+        for text in brc.converse_stream(
+                input_text, thread_id, rewrite_mode=options["rewrite_mode"]):
+            started = True
+            yield "token", {"delta": text}
+        brc.flush(thread_id)
+        yield "done", {"thread_id": thread_id, "timings": brc.last_timings}
+    except Exception as e:
+        logger.exception(f"Error: {str(e)}")
+        error = {"error": str(e)}
+        if not started:
+            error["status"] = getattr(e, "status_code", 500)
+        yield "error", error
+
+
+def stream_handler(event, context):
+    """Streaming entry point: yields the answer as server-sent events
+    (``token`` deltas, then ``done`` or ``error``) for hosts that can
+    forward a chunked response body."""
+    for name, data in _stream_events(event):
+        yield _sse(name, data)
+
+
+def open_stream(event, context):
+    """Runs a streamed turn up to its first event and returns the HTTP
+    status with the server-sent events: a failure before the first token
+    gets an error status instead of 200."""
+    events = _stream_events(event)
+    name, data = next(events)
+    status = data.get("status", 500) if name == "error" else 200
+
+    def chunks():
+        try:
+            yield _sse(name, data)
+            for next_name, next_data in events:
+                yield _sse(next_name, next_data)
+        finally:
+            events.close()
+
+    return status, chunks()
+
+
+def lambda_handler(event, context):
+    if event.get("warmup"):
+        # Scheduled warm-up ping: build the controller and its clients only
+        prime = event.get("prime", os.environ.get("WARMUP_PRIME") == "1")
+        return get_controller().warm(prime=bool(prime))
+
+    logger.info("Received event: " + json.dumps(event, indent=2))
+
+    try:
+        input_text, thread_id, options = _parse_event(event)
 
         logger.info(f"Received input: {input_text}")
 
@@ -41,7 +142,28 @@ def lambda_handler(event, context):
                 "body": json.dumps({"error": "Missing input parameter."}),
             }
 
-        llm_response = brc.converse(input_text, thread_id)
+        if options["stream"]:
+            # The managed Python runtime buffers the body, so the events
+            # arrive together here. Incremental delivery needs Lambda
+            # response streaming (a custom runtime, or server.py behind the
+            # Lambda Web Adapter)
+            status, chunks = open_stream(event, context)
+            return {
+                "statusCode": status,
+                "headers": {
+                    **CORS_HEADERS,
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache",
+                },
+                "body": "".join(chunks),
+            }
+
+        brc = get_controller()
+        llm_response = brc.converse(
+            input_text, thread_id, rewrite_mode=options["rewrite_mode"]
+        )
+        # Persist the thread before the container can be frozen
+        brc.flush(thread_id)
 
         logger.info("LLM called successfully")
 
@@ -50,9 +172,7 @@ def lambda_handler(event, context):
             return {
                 "statusCode": 200,
                 "headers": {
-                    "Access-Control-Allow-Headers": "*",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
+                    **CORS_HEADERS,
                     "Content-Type": "application/json",
                 },
                 "body": json.dumps({"Answer": llm_response}),
@@ -66,7 +186,8 @@ def lambda_handler(event, context):
 
         if "body" in event:
             return {
-                "statusCode": 500,
+                # e.g. 503 when a server rejects the request under load
+                "statusCode": getattr(e, "status_code", 500),
                 "headers": {"Content-Type": "application/json"},
                 "body": json.dumps(error_response),
             }
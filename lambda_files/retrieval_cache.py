@@ -0,0 +1,95 @@
+"""Cache of Knowledge Base retrieval results.
+
+The query rewriter maps many phrasings onto the same few keywords, so
+identical retrievals are common. Results are kept for ``ttl_seconds`` in a
+size-bounded LRU, and concurrent lookups of the same key share a single
+Knowledge Base call.
+"""
+
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Hashable, List
+
+logger = logging.Logger(__name__)
+
+
+def normalize_term(query_term: str) -> str:
+    """Lowercase and collapse punctuation and whitespace, keeping word order."""
+    return " ".join(re.findall(r"\w+", query_term.lower()))
+
+
+class RetrievalCache():
+    """TTL'd LRU cache with single-flight loading."""
+
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 512):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    @staticmethod
+    def make_key(kb_id: str, query_term: str, top_k: int) -> tuple:
+        return (kb_id, normalize_term(query_term), top_k)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], List]) -> List:
+        """Cached value of ``key``, or the result of ``loader()``. Callers
+        arriving while a load is running wait for it instead of loading."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = loader()
+        except Exception as e:
+            # Failures are not cached; waiting callers see the same error
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self._counters["errors"] += 1
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._in_flight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["entries"] = len(self._entries)
+        lookups = counters["hits"] + counters["misses"] + counters["coalesced"]
+        counters["hit_rate"] = (
+            (counters["hits"] + counters["coalesced"]) / lookups if lookups else 0.0
+        )
+        return counters
@@ -0,0 +1,301 @@
+"""Long-lived, concurrent serving of many chat threads from one process.
+
+``ConcurrentController`` wraps a ``BedrockController`` for concurrent use:
+turns of the same thread run one at a time in arrival order, at most
+``max_concurrency`` turns run at once, and requests beyond
+``max_queue`` waiting ones are rejected with ``Overloaded`` (HTTP 503)
+instead of piling up. The Bedrock clients are shared by all turns, with
+their connection pool sized to the concurrency.
+
+``serve`` exposes it over HTTP with the request and response contract of
+``lambda_handler`` (and ``stream_handler`` for ``"stream": true``), so the
+same clients work against a container as against the Function URL:
+
+    python server.py --port 8080 --max-concurrency 32
+    python server.py --stub   # stubbed Bedrock clients, for local testing
+"""
+
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lambda_function
+from lambda_function import CORS_HEADERS, _parse_event, lambda_handler, open_stream
+
+logger = logging.Logger(__name__)
+
+
+class Overloaded(Exception):
+    """The server is at its admission limit; retry later."""
+
+    status_code = 503
+
+
+class _TurnQueue():
+    """FIFO turn order of one thread: tickets are served in issue order."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.issued = 0
+        self.serving = 0
+
+
+class ConcurrentController():
+    """Thread-safe front of a ``BedrockController``, with per-thread turn
+    ordering, a bound on running turns and admission control.
+
+    It offers the controller methods used by the Lambda handlers, so it
+    can replace the controller there (``lambda_function.set_controller``).
+    """
+
+    def __init__(
+            self,
+            controller=None,
+            max_concurrency: int = 16,
+            max_queue: int = 64,
+            queue_timeout: float = 30.0
+        ):
+        if controller is None:
+            # Connections per client: one per running turn, plus the
+            # speculative retrievals; clients are created lazily
+            os.environ.setdefault("AWS_MAX_POOL_CONNECTIONS", str(2 * max_concurrency))
+            from bedrock_controller import BedrockController
+            controller = BedrockController(executor_workers=max_concurrency)
+        self.controller = controller
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._turns: Dict[str, _TurnQueue] = {}
+        self._admitted = 0
+        self._counters = {"served": 0, "rejected": 0, "timed_out": 0, "failed": 0}
+
+    @contextmanager
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.max_concurrency + self.max_queue:
+                self._counters["rejected"] += 1
+                raise Overloaded(
+                    f"Server busy: {self._admitted} requests in progress or queued."
+                )
+            self._admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    @contextmanager
+    def _turn(self, thread_id: str):
+        """Waits for the earlier turns of the thread, then for a free slot."""
+        with self._lock:
+            queue = self._turns.setdefault(thread_id, _TurnQueue())
+            ticket = queue.issued
+            queue.issued += 1
+        try:
+            with queue.condition:
+                # The ticket must be served even on timeout, so it waits
+                # for its predecessors without a deadline
+                queue.condition.wait_for(lambda: queue.serving == ticket)
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                with self._lock:
+                    self._counters["timed_out"] += 1
+                raise Overloaded(f"No free slot within {self.queue_timeout}s.")
+            try:
+                yield
+            finally:
+                self._slots.release()
+        finally:
+            with queue.condition:
+                queue.serving += 1
+                queue.condition.notify_all()
+            with self._lock:
+                if queue.serving == queue.issued:
+                    self._turns.pop(thread_id, None)
+
+    def converse(
+            self, user_input: str, thread_id: str, rewrite_mode: Optional[str] = None
+    ) -> str:
+        with self._admit(), self._turn(thread_id):
+            try:
+                answer = self.controller.converse(user_input, thread_id, rewrite_mode)
+            except Exception:
+                self._count("failed")
+                raise
+        self._count("served")
+        return answer
+
+    def converse_stream(
+            self, user_input: str, thread_id: str, rewrite_mode: Optional[str] = None
+    ) -> Iterator[str]:
+        """Holds the thread's turn and a slot until the stream is consumed
+        or closed."""
+        with self._admit(), self._turn(thread_id):
+            try:
+                yield from self.controller.converse_stream(user_input, thread_id, rewrite_mode)
+            except Exception:
+                self._count("failed")
+                raise
+        self._count("served")
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    @property
+    def last_timings(self) -> dict:
+        return self.controller.last_timings
+
+    def flush(self, thread_id: Optional[str] = None):
+        self.controller.flush(thread_id)
+
+    def warm(self, prime: bool = False) -> dict:
+        return self.controller.warm(prime=prime)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "in_progress": self._admitted,
+                "threads_active": len(self._turns),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+            }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Translates HTTP requests to Function URL events for the handlers."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        event = {"body": self.rfile.read(length).decode("utf-8")}
+        _, _, options = _parse_event(event)
+
+        if options["stream"]:
+            self._stream(event)
+            return
+
+        response = lambda_handler(event, None)
+        self._send(response["statusCode"], response["headers"], response["body"])
+
+    def do_GET(self):
+        headers = {"Content-Type": "application/json"}
+        if self.path.rstrip("/") != "/health":
+            self._send(404, headers, json.dumps({"error": "Not found."}))
+            return
+        self._send(200, headers, json.dumps({"status": "ok", **self.server.controller.stats()}))
+
+    def do_OPTIONS(self):
+        self._send(204, CORS_HEADERS, "")
+
+    def _stream(self, event: dict):
+        """Server-sent events, written as they are produced. The status is
+        sent with the first event, so failures before it get an error status."""
+        status, chunks = open_stream(event, None)
+        self.send_response(status)
+        for name, value in {**CORS_HEADERS, "Content-Type": "text/event-stream",
+                            "Cache-Control": "no-cache", "Connection": "close"}.items():
+            self.send_header(name, value)
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk.encode("utf-8"))
+                self.wfile.flush()
+        finally:
+            chunks.close()
+
+    def _send(self, status: int, headers: dict, body: str):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info("%s - " + format, self.address_string(), *args)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Connections beyond the admission limit are accepted and answered 503
+    request_queue_size = 128
+
+
+def serve(
+        controller: Optional[ConcurrentController] = None,
+        host: str = "127.0.0.1",
+        port: int = 8080
+    ) -> ThreadingHTTPServer:
+    """Builds the HTTP server (port 0 picks a free port); the caller runs
+    ``serve_forever`` and ``shutdown``."""
+    controller = controller or ConcurrentController()
+    lambda_function.set_controller(controller)
+    server = _Server((host, port), _Handler)
+    server.controller = controller
+    return server
+
+
+def use_stub_clients(llm_latency: float = 0.3, kb_latency: float = 0.15,
+                     token_latency: float = 0.0):
+    """Serves with the stub Bedrock and Knowledge Base clients;
+    ``token_latency`` is the delay per streamed answer token."""
+    import aws_clients
+    from stub_clients import StubBedrockRuntime, StubKnowledgeBase
+
+    aws_clients.set_client_factory(
+        lambda service_name: StubBedrockRuntime(
+            first_token_latency=llm_latency, token_latency=token_latency,
+            rewrite_latency=llm_latency
+        ) if service_name == "bedrock-runtime"
+        else StubKnowledgeBase(latency=kb_latency)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--stub", action="store_true", help="use stubbed AWS clients")
+    args = parser.parse_args()
+
+    if args.stub:
+        use_stub_clients()
+    controller = ConcurrentController(
+        max_concurrency=args.max_concurrency, max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout
+    )
+    server = serve(controller, args.host, args.port)
+    print(f"Serving on http://{server.server_address[0]}:{server.server_address[1]}")
+    started = time.perf_counter()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        controller.flush()
+        print(f"Stopped after {time.perf_counter() - started:.0f}s: {controller.stats()}")
+
+
+if __name__ == "__main__":
+    main()
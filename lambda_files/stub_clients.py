@@ -0,0 +1,137 @@
+"""Local stand-ins for the Bedrock runtime and Knowledge Base clients.
+
+They answer the calls ``BedrockController`` makes with deterministic
+content and configurable latencies, for benchmarks and offline runs.
+"""
+
+import io
+import re
+import json
+import math
+import time
+import hashlib
+from typing import Iterator, List
+
+
+class StubBedrockRuntime:
+    """Mimics ``converse``, ``converse_stream`` and (Titan embedding)
+    ``invoke_model`` of the bedrock-runtime client."""
+
+    def __init__(
+            self,
+            first_token_latency: float = 0.3,
+            token_latency: float = 0.01,
+            rewrite_latency: float = 0.4,
+            answer_tokens: int = 60
+        ):
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.rewrite_latency = rewrite_latency
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+
+    def _is_rewrite(self, modelId: str, inferenceConfig: dict) -> bool:
+        return modelId.startswith("anthropic.") or inferenceConfig.get("maxTokens", 0) <= 20
+
+    def _last_user_text(self, messages: List[dict]) -> str:
+        for message in reversed(messages):
+            if message["role"] == "user":
+                return message["content"][0]["text"]
+        return ""
+
+    def _answer_tokens(self, messages: List[dict]) -> List[str]:
+        words = re.findall(r"\w+", self._last_user_text(messages).lower()) or ["answer"]
+        return [f"{words[i % len(words)]} " for i in range(self.answer_tokens)]
+
+    def _usage(self, messages: List[dict], system: List[dict], output_tokens: int) -> dict:
+        input_chars = sum(len(block["text"]) for block in system) + sum(
+            len(block.get("text", "")) for m in messages for block in m["content"]
+        )
+        input_tokens = input_chars // 4
+        return {
+            "inputTokens": input_tokens,
+            "outputTokens": output_tokens,
+            "totalTokens": input_tokens + output_tokens,
+        }
+
+    def converse(self, modelId, messages, system, inferenceConfig, **kwargs) -> dict:
+        self.calls += 1
+        if self._is_rewrite(modelId, inferenceConfig):
+            time.sleep(self.rewrite_latency)
+            words = re.findall(r"\w+", self._last_user_text(messages).lower())
+            text = " ".join(words[:6]) or "langchain"
+        else:
+            tokens = self._answer_tokens(messages)
+            time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+            text = "".join(tokens).strip()
+
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "usage": self._usage(messages, system, len(text.split())),
+            "stopReason": "end_turn",
+        }
+
+    def converse_stream(self, modelId, messages, system, inferenceConfig, **kwargs) -> dict:
+        self.calls += 1
+        tokens = self._answer_tokens(messages)
+        return {"stream": self._events(tokens, self._usage(messages, system, len(tokens)))}
+
+    def _events(self, tokens: List[str], usage: dict) -> Iterator[dict]:
+        yield {"messageStart": {"role": "assistant"}}
+        time.sleep(self.first_token_latency)
+        for token in tokens:
+            yield {"contentBlockDelta": {"delta": {"text": token}, "contentBlockIndex": 0}}
+            time.sleep(self.token_latency)
+        yield {"contentBlockStop": {"contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {"metadata": {"usage": usage, "metrics": {"latencyMs": 0}}}
+
+    def invoke_model(self, modelId, body, **kwargs) -> dict:
+        """Titan-style embedding of ``inputText``: a unit-normalized hashed
+        bag of words, so rephrasings sharing most words embed close."""
+        self.calls += 1
+        request = json.loads(body)
+        dimension = request.get("dimensions", 256)
+        words = re.findall(r"\w+", request["inputText"].lower())
+        vector = [0.0] * dimension
+        for word in words:
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % dimension] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        payload = {"embedding": [x / norm for x in vector], "inputTextTokenCount": len(words)}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")),
+                "contentType": "application/json"}
+
+
+class StubKnowledgeBase:
+    """Mimics ``retrieve`` of the bedrock-agent-runtime client over a small
+    in-memory corpus, ranking passages by word overlap."""
+
+    def __init__(self, passages: List[str] = None, latency: float = 0.15):
+        self.passages = passages or [
+            f"Passage {i} about LangChain chains, agents, retrievers and memory."
+            for i in range(20)
+        ]
+        self.latency = latency
+        self.calls = 0
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration=None, **kwargs) -> dict:
+        self.calls += 1
+        time.sleep(self.latency)
+        top_k = (retrievalConfiguration or {}).get(
+            "vectorSearchConfiguration", {}).get("numberOfResults", 5)
+
+        query = set(re.findall(r"\w+", retrievalQuery["text"].lower()))
+        scored = []
+        for i, passage in enumerate(self.passages):
+            words = set(re.findall(r"\w+", passage.lower()))
+            overlap = len(query & words) / (len(query) or 1)
+            # Deterministic tie-break so equal overlaps keep a stable order
+            tie = int(hashlib.md5(passage.encode("utf-8")).hexdigest()[:4], 16) / 65536
+            scored.append((overlap + tie * 1e-3, i, passage))
+        scored.sort(reverse=True)
+
+        return {"retrievalResults": [
+            {"content": {"text": passage}, "score": score,
+             "location": {"type": "S3", "s3Location": {"uri": f"s3://stub/{i}.txt"}}}
+            for score, i, passage in scored[:top_k]
+        ]}
@@ -0,0 +1,344 @@
+"""Bounded, persistent store for conversation threads.
+
+Threads are cached in an in-process LRU tier (``max_threads``, idle TTL)
+over a pluggable persistent backend, loaded lazily on first access and
+written back in batches. Writes are conditional on the version that was
+read, so two containers serving the same thread cannot silently
+overwrite each other: on a conflict the turns added locally are appended
+to the stored thread (tail merge) and the write is retried.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.Logger(__name__)
+
+
+class StaleWriteError(Exception):
+    """The stored thread changed since it was read."""
+
+
+class LocalFileBackend():
+    """One JSON file per thread, a local stand-in for S3 or DynamoDB.
+    Versions are counters checked under an exclusive file lock."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, thread_id: str) -> str:
+        safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in thread_id)
+        return os.path.join(self.path, f"{safe_id}.json")
+
+    def _read_file(self, file: str) -> Tuple[Optional[dict], Optional[str]]:
+        try:
+            with open(file, encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None, None
+        return record, str(record.pop("version"))
+
+    def read(self, thread_id: str) -> Tuple[Optional[dict], Optional[str]]:
+        return self._read_file(self._file(thread_id))
+
+    def write(self, thread_id: str, record: dict, expected_version: Optional[str]) -> str:
+        import fcntl
+
+        file = self._file(thread_id)
+        with open(f"{file}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            _, version = self._read_file(file)
+            if version != expected_version:
+                raise StaleWriteError(thread_id)
+            new_version = str(int(version or 0) + 1)
+            tmp_file = f"{file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({**record, "version": new_version}, f)
+            os.replace(tmp_file, file)
+        return new_version
+
+    def delete(self, thread_id: str):
+        for file in (self._file(thread_id), f"{self._file(thread_id)}.lock"):
+            if os.path.exists(file):
+                os.remove(file)
+
+
+class S3Backend():
+    """Threads as S3 objects, guarded by conditional writes on the ETag."""
+
+    def __init__(self, bucket: str, prefix: str = "threads/", client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from aws_clients import get_client
+            self._client = get_client("s3")
+        return self._client
+
+    def read(self, thread_id: str) -> Tuple[Optional[dict], Optional[str]]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + thread_id)
+        except self.client.exceptions.NoSuchKey:
+            return None, None
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    def write(self, thread_id: str, record: dict, expected_version: Optional[str]) -> str:
+        from botocore.exceptions import ClientError
+
+        condition = {"IfMatch": expected_version} if expected_version else {"IfNoneMatch": "*"}
+        try:
+            response = self.client.put_object(
+                Bucket=self.bucket, Key=self.prefix + thread_id,
+                Body=json.dumps(record).encode("utf-8"), **condition
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise StaleWriteError(thread_id) from e
+            raise
+        return response["ETag"]
+
+    def delete(self, thread_id: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + thread_id)
+
+
+class _Thread():
+    __slots__ = ("messages", "summary", "version", "base", "last_access", "dirty")
+
+    def __init__(self, messages: List[dict], summary: str = "", version: Optional[str] = None):
+        self.messages = messages
+        self.summary = summary
+        self.version = version
+        self.base = list(messages)  # messages as of the last sync, for tail merges
+        self.last_access = time.monotonic()
+        self.dirty = False
+
+
+class ThreadStore(MutableMapping):
+    """Mapping of thread id to its (live) message list.
+
+    Messages are mutated in place by the caller, who then calls
+    ``mark_dirty``. Without a backend the store is a bounded in-memory
+    LRU. With one, dirty threads are written behind: by ``flush()`` (of
+    one thread or all of them), by a background flusher every ``flush_interval`` seconds (0 disables it),
+    or once ``flush_batch_size`` threads are dirty. ``on_evict`` is called
+    with the id of each thread dropped from memory.
+    """
+
+    def __init__(
+            self,
+            backend=None,
+            max_threads: int = 1000,
+            idle_ttl: float = 3600.0,
+            flush_interval: float = 0.0,
+            flush_batch_size: int = 32,
+            max_merge_attempts: int = 3,
+            on_evict: Optional[Callable[[str], None]] = None
+        ):
+        self.backend = backend
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self.flush_batch_size = flush_batch_size
+        self.max_merge_attempts = max_merge_attempts
+        self.on_evict = on_evict
+
+        self._threads: "OrderedDict[str, _Thread]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._counters = {"loads": 0, "writes": 0, "conflicts": 0, "evictions": 0}
+
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = None
+        if backend is not None and flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, args=(flush_interval,), daemon=True
+            )
+            self._flusher.start()
+
+    def _entry(self, thread_id: str) -> Optional[_Thread]:
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is not None:
+                self._threads.move_to_end(thread_id)
+                entry.last_access = time.monotonic()
+                return entry
+
+        if self.backend is None:
+            return None
+        record, version = self.backend.read(thread_id)
+        if record is None:
+            return None
+
+        with self._lock:
+            # Another caller may have loaded it meanwhile
+            entry = self._threads.get(thread_id)
+            if entry is None:
+                entry = _Thread(record["messages"], record.get("summary", ""), version)
+                self._threads[thread_id] = entry
+                self._counters["loads"] += 1
+            evicted = self._evict()
+        self._release(evicted)
+        return entry
+
+    def __getitem__(self, thread_id: str) -> List[dict]:
+        entry = self._entry(thread_id)
+        if entry is None:
+            raise KeyError(thread_id)
+        return entry.messages
+
+    def __setitem__(self, thread_id: str, messages: List[dict]):
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            if entry is None:
+                entry = _Thread(messages)
+                self._threads[thread_id] = entry
+            else:
+                entry.messages = messages
+        self.mark_dirty(thread_id)
+
+    def __delitem__(self, thread_id: str):
+        with self._lock:
+            entry = self._threads.pop(thread_id, None)
+        if self.backend is not None:
+            self.backend.delete(thread_id)
+        elif entry is None:
+            raise KeyError(thread_id)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._threads))
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    def summary(self, thread_id: str) -> str:
+        entry = self._entry(thread_id)
+        return entry.summary if entry is not None else ""
+
+    def set_summary(self, thread_id: str, summary: str):
+        with self._lock:
+            self._threads[thread_id].summary = summary
+
+    def mark_dirty(self, thread_id: str):
+        with self._lock:
+            entry = self._threads[thread_id]
+            entry.dirty = True
+            entry.last_access = time.monotonic()
+            self._threads.move_to_end(thread_id)
+            dirty = sum(t.dirty for t in self._threads.values())
+            evicted = self._evict()
+        self._release(evicted)
+        if self.backend is not None and dirty >= self.flush_batch_size:
+            if self._flusher is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def _evict(self) -> List[Tuple[str, _Thread]]:
+        """Drops idle and least recently used threads from memory (caller
+        holds the lock) and returns them for ``_release``."""
+        now = time.monotonic()
+        evicted = []
+        while self._threads:
+            thread_id, entry = next(iter(self._threads.items()))
+            if len(self._threads) <= self.max_threads and now - entry.last_access <= self.idle_ttl:
+                break
+            del self._threads[thread_id]
+            self._counters["evictions"] += 1
+            evicted.append((thread_id, entry))
+        return evicted
+
+    def _release(self, evicted: List[Tuple[str, _Thread]]):
+        """Writes the dirty evicted threads, outside the store lock so
+        other threads are not blocked on the backend."""
+        for thread_id, entry in evicted:
+            if entry.dirty and self.backend is not None:
+                self._write(thread_id, entry)
+            if self.on_evict is not None:
+                self.on_evict(thread_id)
+
+    def _write(self, thread_id: str, entry: _Thread):
+        """Conditional write, merging with the stored thread on conflicts."""
+        for _ in range(self.max_merge_attempts):
+            with self._lock:
+                messages = list(entry.messages)
+                record = {"messages": messages, "summary": entry.summary}
+                version = entry.version
+            try:
+                new_version = self.backend.write(thread_id, record, version)
+            except StaleWriteError:
+                self._counters["conflicts"] += 1
+                self._merge(thread_id, entry)
+                continue
+            with self._lock:
+                entry.version = new_version
+                entry.base = messages
+                # Still dirty if the thread changed while it was written
+                entry.dirty = len(entry.messages) != len(messages) or any(
+                    a is not b for a, b in zip(entry.messages, messages)
+                )
+                self._counters["writes"] += 1
+            return
+        logger.error(f"Thread {thread_id} could not be saved after {self.max_merge_attempts} conflicts.")
+
+    def _merge(self, thread_id: str, entry: _Thread):
+        """Tail merge: the stored thread plus the messages added locally
+        since the last sync."""
+        record, version = self.backend.read(thread_id)
+        with self._lock:
+            base_ids = {id(message) for message in entry.base}
+            tail = [message for message in entry.messages if id(message) not in base_ids]
+            stored = record["messages"] if record else []
+            entry.messages[:] = stored + tail  # in place: callers hold this list
+            entry.base = list(stored)
+            entry.summary = entry.summary or (record or {}).get("summary", "")
+            entry.version = version
+        logger.warning(f"Thread {thread_id} was modified concurrently, merged {len(tail)} new messages.")
+
+    def flush(self, thread_id: Optional[str] = None):
+        """Writes the dirty threads, or only ``thread_id``, to the backend."""
+        if self.backend is None:
+            return
+        with self._flush_lock:
+            with self._lock:
+                dirty = [(tid, entry) for tid, entry in self._threads.items()
+                         if entry.dirty and thread_id in (None, tid)]
+            if len(dirty) == 1:
+                self._write(*dirty[0])
+            elif dirty:
+                with ThreadPoolExecutor(max_workers=min(8, len(dirty))) as pool:
+                    list(pool.map(lambda item: self._write(*item), dirty))
+
+    def _flush_loop(self, interval: float):
+        while not self._closed:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Background thread flush failed: {e}")
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "cached_threads": len(self._threads),
+                "dirty_threads": sum(t.dirty for t in self._threads.values()),
+            }
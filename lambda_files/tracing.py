@@ -0,0 +1,262 @@
+"""Lightweight tracing and metrics.
+
+Spans time a block of work and carry counters (tokens, bytes, items);
+finished spans are passed to the configured sinks. ``EMFSink`` writes
+CloudWatch Embedded Metric Format JSON lines, which CloudWatch turns into
+metrics when they appear in Lambda logs; ``InMemorySink`` keeps the
+records for tests and benchmarks.
+
+Tracing is off unless ``TRACING=1`` is set or ``configure`` is called.
+While off, ``span()`` returns a shared no-op object, so instrumented code
+pays a single attribute check.
+
+Modules outside the Lambda package take the tracer as an argument, e.g.
+``ParentChildRetriever(..., tracer=tracing.tracer)``, and report through
+``Tracer.record``.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import contextvars
+import functools
+from typing import Callable, Dict, List, Optional
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span():
+    """A timed unit of work; use as a context manager, or call ``finish``
+    for work that cannot be wrapped in one block (e.g. a generator)."""
+
+    __slots__ = ("tracer", "name", "trace_id", "parent", "attributes", "counters",
+                 "started", "duration_ms", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        parent = _current.get()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.parent = parent.name if parent is not None else None
+        self.attributes = attributes
+        self.counters: Dict[str, list] = {}
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.finish()
+        return False
+
+    def count(self, name: str, value: float, unit: str = "Count"):
+        if name in self.counters:
+            self.counters[name][0] += value
+        else:
+            self.counters[name] = [value, unit]
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self.started) * 1000
+            self.tracer._emit(self)
+
+
+class _NoopSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def count(self, name: str, value: float, unit: str = "Count"):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySink():
+    """Keeps span records in memory."""
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+
+    def spans(self, name: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            return [r for r in self.records if name is None or r["name"] == name]
+
+    def summary(self) -> Dict[str, dict]:
+        """Count, total and mean duration, and summed counters per span name."""
+        summary = {}
+        for record in self.spans():
+            entry = summary.setdefault(record["name"], {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"] or 0.0
+            for name, (value, _) in record["counters"].items():
+                entry[name] = entry.get(name, 0) + value
+        for entry in summary.values():
+            entry["mean_ms"] = entry["total_ms"] / entry["count"]
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+
+class EMFSink():
+    """CloudWatch Embedded Metric Format: one JSON line per span, with the
+    duration and counters as metrics under the ``Stage`` dimension."""
+
+    def __init__(self, namespace: str = "RAGCustomerAssistant", stream=None):
+        self.namespace = namespace
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        metrics = [{"Name": name, "Unit": unit} for name, (_, unit) in record["counters"].items()]
+        line = {
+            "_aws": {
+                "Timestamp": int(record["timestamp"] * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Stage"]],
+                    "Metrics": [{"Name": "Duration", "Unit": "Milliseconds"}] + metrics,
+                }],
+            },
+            "Stage": record["name"],
+            "Duration": record["duration_ms"],
+            **{name: value for name, (value, _) in record["counters"].items()},
+            "TraceId": record["trace_id"],
+            "Parent": record["parent"],
+            **record["attributes"],
+        }
+        with self._lock:
+            self.stream.write(json.dumps(line, default=str) + "\n")
+            self.stream.flush()
+
+
+class Tracer():
+
+    def __init__(self):
+        self.enabled = False
+        self.sinks = []
+
+    def configure(self, enabled: bool = True, sinks: Optional[list] = None):
+        self.sinks = list(sinks) if sinks is not None else [EMFSink()]
+        self.enabled = enabled
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def count(self, name: str, value: float, unit: str = "Count"):
+        """Adds to a counter of the current span (or emits it on its own)."""
+        if not self.enabled:
+            return
+        span = _current.get()
+        if span is not None:
+            span.count(name, value, unit)
+        else:
+            self.record(name, 0.0, {name: (value, unit)})
+
+    def record(self, name: str, duration_ms: float, counters: Optional[dict] = None,
+               **attributes):
+        """Emits a span measured elsewhere; ``counters`` maps names to
+        ``value`` or ``(value, unit)``."""
+        if not self.enabled:
+            return
+        span = Span(self, name, attributes)
+        for counter, value in (counters or {}).items():
+            if isinstance(value, tuple):
+                span.count(counter, *value)
+            else:
+                span.count(counter, value)
+        span.duration_ms = duration_ms
+        self._emit(span)
+
+    def _emit(self, span: Span):
+        record = {
+            "name": span.name,
+            "trace_id": span.trace_id,
+            "parent": span.parent,
+            "duration_ms": span.duration_ms,
+            "timestamp": time.time(),
+            "counters": span.counters,
+            "attributes": span.attributes,
+        }
+        for sink in self.sinks:
+            try:
+                sink.emit(record)
+            except Exception:
+                pass  # metrics must never fail a request
+
+
+tracer = Tracer()
+if os.environ.get("TRACING") == "1":
+    tracer.configure(enabled=True)
+
+
+def configure(enabled: bool = True, sinks: Optional[list] = None):
+    tracer.configure(enabled, sinks)
+
+
+def enabled() -> bool:
+    return tracer.enabled
+
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def count(name: str, value: float, unit: str = "Count"):
+    tracer.count(name, value, unit)
+
+
+def record(name: str, duration_ms: float, counters: Optional[dict] = None, **attributes):
+    tracer.record(name, duration_ms, counters, **attributes)
+
+
+def traced(name: str) -> Callable:
+    """Decorator wrapping every call of a function in a span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return fn(*args, **kwargs)
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn: Callable) -> Callable:
+    """``fn`` bound to the current context, so spans it opens in an executor
+    thread keep the caller's trace."""
+    return functools.partial(contextvars.copy_context().run, fn)
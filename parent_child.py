@@ -1,25 +1,34 @@
 import os
 import time
 import logging
-import uuid
+import hashlib
 import json
-from typing import List
+from typing import Iterable, Iterator, List
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import asyncio
-from tqdm.asyncio import tqdm
 
-import pandas as pd
 from pinecone import Pinecone, ServerlessSpec
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from vector_index import LocalVectorIndex
+from parent_store import ShardedParentStore
+from ingest_manifest import IngestManifest
+from embedding_cache import CachedEmbeddings
+from ingestion import ChildRecord, astream_ingest, stream_ingest
+from embedding_scheduler import EmbeddingScheduler
+from upsert import BulkUpserter
+from chunking import child_id, iter_split, parent_chunk_id, split_document
+from bm25 import BM25Index
 
 logger = logging.Logger(__name__)
 
 
 class ParentChildRetriever():
     """Implementation of a Parent - Child style RAG retriever, 
-    with Pinecone."""
+    with Pinecone or a local in-process vector index."""
 
     def __init__(
             self,
@@ -33,16 +42,67 @@ class ParentChildRetriever():
             embedding_dimension: int = 512,
             namespace: str = "",
             build_persistent: bool = False,
-            build_from_json: bool = False
+            build_from_json: bool = False,
+            index_backend: str = "pinecone",
+            index_path: str = None,
+            ivf_lists: int = 0,
+            quantization: str = None,
+            parent_store_dir: str = None,
+            parent_cache_size: int = 1024,
+            manifest_path: str = None,
+            document_key: str = "source",
+            embedding_cache_dir: str = None,
+            chunk_workers: int = 1,
+            chunk_task_size: int = 64,
+            max_embedding_batch_tokens: int = 16000,
+            max_embedding_concurrency: int = 16,
+            parent_aggregation: str = "max",
+            overfetch_factor: int = 3,
+            max_fetch_k: int = 200,
+            rrf_k: int = 60,
+            sparse_index: BM25Index = None,
+            slim_metadata: bool = False,
+            filter_fields: tuple = ("source",),
+            child_store_dir: str = None,
+            upsert_workers: int = 4,
+            max_upsert_bytes: int = 2 * 1024 * 1024,
+            tracer=None
         ):
         self.index_name = index_name
         self.namespace = namespace
 
-        # Initialize Pinecone
-        self.pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+        # "pinecone" or "local" (in-process NumPy index, see vector_index.py)
+        if index_backend not in ("pinecone", "local"):
+            raise ValueError(f"Unknown index backend: {index_backend}")
+        self.index_backend = index_backend
+        self.index_path = index_path
+        self.ivf_lists = ivf_lists
+        # Local index only: None, "int8" or "binary" codes with exact rescoring
+        self.quantization = quantization
+
+        # Sharded on-disk parent store (see parent_store.py); 
+        # parents are kept in a plain dict when not set
+        self.parent_store_dir = parent_store_dir
+        self.parent_cache_size = parent_cache_size
+
+        # Optional tracer (see lambda_files/tracing.py) recording chunking, 
+        # embedding batches, upserts and index queries
+        self.tracer = tracer
 
         self.embedding_model = embedding_model
         self.embedding_dimension = embedding_dimension
+        # Persistent cache shared by ingestion and queries (see embedding_cache.py)
+        if embedding_cache_dir:
+            self.embedding_model = CachedEmbeddings(
+                embedding_model, embedding_cache_dir, dimension=embedding_dimension
+            )
+        # Token-aware batching, adaptive concurrency and retries for ingestion
+        self.embedding_scheduler = EmbeddingScheduler(
+            self.embedding_model,
+            max_batch_tokens=max_embedding_batch_tokens,
+            max_concurrency=max_embedding_concurrency,
+            tracer=tracer
+        )
 
         # The storage layer for the parent documents
         self.chunk_parents = chunk_parents
@@ -51,28 +111,121 @@ class ParentChildRetriever():
         self.child_chunk_size = child_chunk_size
         self.child_overlap = child_overlap
         self.build_persistent = build_persistent
+        # Process pool size and documents per task for splitting
+        self.chunk_workers = chunk_workers
+        self.chunk_task_size = chunk_task_size
+
+        # Ranking of parents from their children's scores in invoke
+        if parent_aggregation not in ("max", "sum", "rrf"):
+            raise ValueError(f"Unknown parent aggregation: {parent_aggregation}")
+        self.parent_aggregation = parent_aggregation
+        self.overfetch_factor = max(2, overfetch_factor)
+        self.max_fetch_k = max_fetch_k
+        self.rrf_k = rrf_k
+
+        # Optional BM25 index over the same child chunks (see bm25.py), 
+        # kept in sync by ingestion and deletes
+        self.sparse_index = sparse_index
+
+        # Slim metadata: the index keeps only the parent ids and the 
+        # ``filter_fields`` of each child; the child text and full metadata 
+        # go to a side store keyed by child id (sharded on disk with 
+        # ``child_store_dir``, in memory otherwise), see get_children
+        self.slim_metadata = slim_metadata
+        self.filter_fields = tuple(filter_fields)
+        self.child_store_dir = child_store_dir
+        self.child_docs = None
+
+        # Parallel, size-bounded upserts with retries (see upsert.py)
+        self.upsert_workers = upsert_workers
+        self.max_upsert_bytes = max_upsert_bytes
+
+        # Incremental re-ingestion: documents are identified by 
+        # metadata[document_key] (or a tuple of metadata fields, e.g. 
+        # ("source", "page")) and tracked in the manifest
+        self.document_key = document_key
+        self.manifest = None
+        if manifest_path:
+            # Unchanged documents are skipped, so everything they left in 
+            # the stores must survive the process
+            if not parent_store_dir:
+                raise ValueError("manifest_path requires a parent_store_dir.")
+            if index_backend == "local" and not index_path:
+                raise ValueError("manifest_path requires an index_path for the local index.")
+            if sparse_index is not None and sparse_index.path is None:
+                raise ValueError("manifest_path requires a sparse index with a path.")
+            if slim_metadata and not child_store_dir:
+                raise ValueError("manifest_path requires a child_store_dir with slim_metadata.")
+            self.manifest = IngestManifest(manifest_path, config={
+                **self._chunk_config(),
+                "embedding_dimension": embedding_dimension,
+            })
 
         logger.info("Parent-Child Initialization ran.")
 
         # Constructing the vectorstore
         self._build_vector_store(build_from_json)
      
-    def _generate_parent_id(self) -> str:
-        """Generate a unique ID for a parent document."""
-        return f"parent-{str(uuid.uuid4())}"
+    def _generate_parent_id(self, doc: Document) -> str:
+        """Generate a content-addressed ID for a parent document."""
+        content = json.dumps(
+            {"page_content": doc.page_content, "metadata": doc.metadata},
+            sort_keys=True, default=str
+        )
+        return f"parent-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]}"
     
     def _generate_parent_chunk_id(self, parent_id: str, chunk_index: int) -> str:
         """Generate a unique ID for a parent chunk."""
-        return f"{parent_id}-pchunk-{chunk_index}"
+        return parent_chunk_id(parent_id, chunk_index)
     
     def _generate_child_id(self, parent_id: str, chunk_index: int) -> str:
         """Generate a unique ID for a child chunk."""
-        return f"{parent_id}-child-{chunk_index}"
+        return child_id(parent_id, chunk_index)
 
 
     def _build_vector_store(self, build_from_json: bool):
-        """Initializes the Pinecone Index 
-        (connects to or constructs based on the index name)."""
+        """Initializes the child index: the Pinecone Index 
+        (connects to or constructs based on the index name), 
+        or a local index (loaded from ``index_path`` if it exists)."""
+
+        if self.index_backend == "local":
+            self.child_index = LocalVectorIndex(
+                dimension=self.embedding_dimension,
+                path=self.index_path,
+                n_lists=self.ivf_lists,
+                quantization=self.quantization
+            )
+        else:
+            self._connect_pinecone()
+        self.upserter = BulkUpserter(
+            self.child_index, namespace=self.namespace,
+            max_batch_bytes=self.max_upsert_bytes, max_workers=self.upsert_workers,
+            tracer=self.tracer
+        )
+
+        if self.parent_store_dir:
+            self.parent_docs = ShardedParentStore(
+                self.parent_store_dir, cache_size=self.parent_cache_size
+            )
+            # One-off migration of a legacy JSON dump into an empty store
+            if build_from_json and not len(self.parent_docs):
+                self.parent_docs.import_json('parent_store/parents.json')
+        else:
+            self.parent_docs = {}
+            if build_from_json:
+                self._ingest_parents()
+
+        if self.slim_metadata:
+            self.child_docs = (
+                ShardedParentStore(self.child_store_dir, cache_size=self.parent_cache_size)
+                if self.child_store_dir else {}
+            )
+            
+        logger.info("VS built.")
+
+    def _connect_pinecone(self):
+        """Connects to or creates the Pinecone Index."""
+        self.pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
 
         existing_indexes = [index_info["name"] for index_info in self.pc.list_indexes()]
 
@@ -91,12 +244,111 @@ class ParentChildRetriever():
 
         self.child_index = self.pc.Index(self.index_name)
 
-        self.parent_docs = {}
-        if build_from_json:
-            self._ingest_parents()
-            
-        logger.info("VS built.")
-
+    def _persist_index(self):
+        """Flush the local index and the on-disk stores; Pinecone persists 
+        on its own."""
+        if self.index_backend == "local":
+            self.child_index.persist()
+        if self.sparse_index is not None:
+            self.sparse_index.persist()
+        if isinstance(self.parent_docs, ShardedParentStore):
+            self.parent_docs.flush()
+        if isinstance(self.child_docs, ShardedParentStore):
+            self.child_docs.flush()
+
+    def _select_changed(self, documents: Iterable[Document], parent_ids: List[str],
+                        changed: List[tuple], seen_keys: set):
+        """Lazily compare the documents against the manifest.
+
+        Records the parent id of every document in ``parent_ids`` and the 
+        keys seen in ``seen_keys``, deletes the children of changed documents 
+        and yields ``(doc, parent_id)`` for the documents that need to be 
+        (re-)ingested, noting them in ``changed``.
+
+        Documents sharing a key (e.g. the pages of one file) are told apart 
+        by their order in the input, so they do not replace each other.
+        """
+        occurrences = {}
+        for doc in documents:
+            parent_id = self._generate_parent_id(doc)
+            parent_ids.append(parent_id)
+            doc_key = self._document_key(doc, parent_id)
+            occurrences[doc_key] = occurrences.get(doc_key, 0) + 1
+            if occurrences[doc_key] > 1:
+                if occurrences[doc_key] == 2:
+                    logger.warning(
+                        f"Several documents share the key {doc_key!r}; consider a "
+                        f"more specific document_key than {self.document_key}."
+                    )
+                doc_key = f"{doc_key}#{occurrences[doc_key]}"
+            seen_keys.add(doc_key)
+
+            if self.manifest is not None:
+                if self.manifest.is_current(doc_key, parent_id):
+                    continue
+                old_parent_id = self.manifest.indexed_parent(doc_key)
+                if old_parent_id is not None:
+                    self._delete_parent(old_parent_id)
+                    self.manifest.remove(doc_key)
+
+            changed.append((doc_key, parent_id))
+            yield doc, parent_id
+
+    def _document_key(self, doc: Document, parent_id: str) -> str:
+        fields = (self.document_key,) if isinstance(self.document_key, str) else self.document_key
+        values = [doc.metadata.get(field) for field in fields]
+        if all(value is None for value in values):
+            return parent_id
+        return "|".join("" if value is None else str(value) for value in values)
+
+    def _prune(self, seen_keys: set):
+        """Delete the manifest documents that were not seen in this ingest."""
+        for doc_key in self.manifest.keys():
+            if doc_key not in seen_keys:
+                self._delete_parent(self.manifest.indexed_parent(doc_key))
+                self.manifest.remove(doc_key)
+
+    def _record_ingested(self, changed: List[tuple], failed_ids: List[str], 
+                         seen_keys: set, prune: bool):
+        """Mark the fully ingested documents as current in the manifest. 
+        Documents with failed children stay unrecorded and are retried 
+        on the next ingest.
+
+        The stores are persisted first and the manifest saved last, so a 
+        crash in between re-ingests documents rather than skipping them."""
+        if self.manifest is None:
+            self._persist_index()
+            return
+        failed_parents = {cid.split("-pchunk-")[0].split("-child-")[0] 
+                          for cid in failed_ids}
+        for doc_key, parent_id in changed:
+            if parent_id not in failed_parents:
+                self.manifest.set(doc_key, parent_id)
+        if prune:
+            self._prune(seen_keys)
+        self._persist_index()
+        self.manifest.save()
+
+    def _delete_parent(self, parent_id: str):
+        """Delete a parent, its parent chunks and all of its children 
+        (every ID starts with the parent ID)."""
+        prefix = f"{parent_id}-"
+        for ids in self.child_index.list(prefix=prefix, namespace=self.namespace):
+            if ids:
+                self.child_index.delete(ids=list(ids), namespace=self.namespace)
+        if self.sparse_index is not None:
+            self.sparse_index.delete(prefix=prefix)
+
+        # Chunks are numbered from 0, so their ids are probed in order 
+        # instead of scanning the stores
+        units = [parent_id] + _delete_numbered(
+            self.parent_docs, lambda i: parent_chunk_id(parent_id, i)
+        )
+        if parent_id in self.parent_docs:
+            del self.parent_docs[parent_id]
+        if self.child_docs is not None:
+            for unit_id in units:
+                _delete_numbered(self.child_docs, lambda i: child_id(unit_id, i))
 
     def _ingest_parents(self):
         """Load parent documents from disk."""
@@ -109,336 +361,380 @@ class ParentChildRetriever():
                 self.parent_docs[id] = Document(
                         page_content=data["page_content"],
                         metadata=data["metadata"])
-    
+
+    def _iter_children(self, documents) -> Iterator[ChildRecord]:
+        """Split ``(doc, parent_id)`` pairs into child records, storing the 
+        parents (and parent chunks) along the way. Splitting runs in a 
+        process pool when ``chunk_workers`` > 1 (see chunking.py)."""
+        in_flight = deque()
+
+        def tasks():
+            for doc, parent_id in documents:
+                in_flight.append((doc, parent_id))
+                yield doc.page_content, doc.metadata, parent_id
+
+        for parent_chunks, children in iter_split(
+                tasks(), self._chunk_config(), 
+                workers=self.chunk_workers, task_size=self.chunk_task_size,
+                tracer=self.tracer):
+            doc, parent_id = in_flight.popleft()
+            self.parent_docs[parent_id] = doc
+
+            # Store the mapping of parent chunks to parent ID
+            for chunk_id, chunk, metadata in parent_chunks:
+                self.parent_docs[chunk_id] = Document(
+                    page_content=chunk, metadata=metadata
+                )
+
+            if self.sparse_index is not None:
+                self.sparse_index.add(children)
+            if self.slim_metadata:
+                children = self._slim(children)
+            yield from children
+
+    def _slim(self, children: List[ChildRecord]) -> List[ChildRecord]:
+        """Moves the text and metadata of the children to the side store, 
+        keeping the parent ids and filterable fields for the index."""
+        slim = []
+        for cid, text, metadata in children:
+            self.child_docs[cid] = Document(page_content=text, metadata=metadata)
+            index_metadata = {
+                "original_parent_id": metadata["original_parent_id"],
+                "parent_unit_id": metadata["parent_unit_id"],
+            }
+            for field in self.filter_fields:
+                if isinstance(metadata.get(field), (str, int, float, bool)):
+                    index_metadata[field] = metadata[field]
+            slim.append((cid, text, index_metadata))
+        return slim
+
+    def get_children(self, child_ids: List[str]) -> List[Document]:
+        """Child chunks with their full metadata, read from the side store 
+        (slim metadata mode); unknown ids are skipped."""
+        if self.child_docs is None:
+            raise ValueError("Child documents are only stored with slim_metadata.")
+        return [self.child_docs[cid] for cid in child_ids
+                if cid in self.child_docs]
+
+    def build_sparse_index(self):
+        """(Re)build the sparse index from the stored parents, re-splitting 
+        them into the same child chunks (and ids) as the dense index."""
+        if self.sparse_index is None:
+            raise ValueError("No sparse index configured.")
+        config = self._chunk_config()
+        for parent_id, doc in self.parent_docs.items():
+            if "-pchunk-" in parent_id:
+                continue
+            _, children = split_document((doc.page_content, doc.metadata, parent_id), config)
+            self.sparse_index.add(children)
+        self.sparse_index.persist()
+
+    def _chunk_config(self) -> dict:
+        return {
+            "chunk_parents": self.chunk_parents,
+            "parent_chunk_size": self.parent_chunk_size,
+            "parent_overlap": self.parent_overlap,
+            "child_chunk_size": self.child_chunk_size,
+            "child_overlap": self.child_overlap,
+        }
+
+    def _upsert_batch(self, vectors: List[dict]) -> List[str]:
+        """Upsert the vectors handed over by the ingestion pipeline in 
+        parallel requests; returns the ids that could not be upserted."""
+        report = self.upserter.upsert(vectors)
+        if report.failed_ids:
+            logger.error(f"{len(report.failed_ids)} vector(s) failed to upsert.")
+        return report.failed_ids
+
+    def _save_parents(self, parent_store_path: str = "parent_store"):
+        """Persist the parent documents after an ingest."""
+        if isinstance(self.parent_docs, ShardedParentStore):
+            # Parents were appended to the store as they were processed
+            self.parent_docs.flush()
+        else:
+            Path(parent_store_path).mkdir(parents=True, exist_ok=True)
+            with open(f'{parent_store_path}/parents_{self.namespace}.json', 'w', 
+                      encoding ='utf8') as f:
+                json.dump(
+                    {k: {"metadata": v.metadata,
+                         "page_content": v.page_content} 
+                         for k, v in self.parent_docs.items()},
+                    fp=f, 
+                    indent = 4
+                )
+        logger.info("Saved parent documents.")
 
     def add_documents(
-            self, documents: List[Document], save_parents: bool = False
+            self, documents: Iterable[Document], save_parents: bool = False,
+            prune: bool = False, embedding_batch_size: int = 100, 
+            upsert_batch_size: int = 512
     ) -> List[str]:
         """
         Pre-process and add documents to the vectorstore, 
         maintaining parent-child relationships.
+
+        Documents are streamed through chunking, embedding and upserting 
+        (see ingestion.py), so ``documents`` may be any iterable and memory 
+        does not grow with the corpus.
+
+        With a manifest, only new or changed documents are embedded and 
+        upserted; ``prune`` also deletes the documents missing from this call.
         """
         logger.info("Starting document addition.")
 
-        parent_ids = []
-        all_ids = []
-        all_embeddings = []
-        all_metadata = []
-        all_texts_to_embed = []
-        all_metadata_map = {}
-        current_child_i = 0
-        embedding_batch_size = 100
-
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.child_chunk_size, chunk_overlap=self.child_overlap
+        parent_ids, changed, seen_keys = [], [], set()
+        records = self._iter_children(
+            self._select_changed(documents, parent_ids, changed, seen_keys)
         )
-        parent_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.parent_chunk_size, chunk_overlap=self.parent_overlap
-        )
-        
-        logger.info("Processing documents and extracting chunks...")
-        for doc in documents:
-            parent_id = self._generate_parent_id()
-            parent_ids.append(parent_id)
-            
-            self.parent_docs[parent_id] = doc
 
-            if not self.chunk_parents:
-                parent_units = [doc.page_content]
-                parent_unit_ids = [parent_id]
-            else:
-                # Chunk the parent document
-                parent_chunks = parent_splitter.split_text(doc.page_content)
-                parent_units = parent_chunks
-                parent_unit_ids = [self._generate_parent_chunk_id(parent_id, i) for i in range(len(parent_chunks))]
-                
-                # Store the mapping of parent chunks to parent ID
-                for i, chunk in enumerate(parent_chunks):
-                    chunk_id = parent_unit_ids[i]
-                    self.parent_docs[chunk_id] = Document(
-                        page_content=chunk,
-                        metadata={**doc.metadata, 
-                                  "parent_id": parent_id, 
-                                  "is_parent_chunk": True, 
-                                  "chunk_index": i}
-                        )
-            
-            # Process each parent unit (whole doc or parent chunk)
-            for parent_unit, parent_unit_id in zip(parent_units, parent_unit_ids):
-                ch_chunks = child_splitter.split_text(parent_unit)
-                
-                # Create child documents with embeddings
-                for i, ch_chunk_text in enumerate(ch_chunks):
-                    child_id = self._generate_child_id(parent_unit_id, i)
-                    
-                    child_metadata = {
-                        "text": ch_chunk_text,  
-                        "parent_unit_id": parent_unit_id, # ID of immediate parent (whole doc or chunk)
-                        "original_parent_id": parent_id, # ID of original parent document
-                        "is_chunked_parent": self.chunk_parents,
-                        "chunk_index": i,
-                        **doc.metadata
-                    }
-
-                    all_ids.append(child_id)
-                    all_texts_to_embed.append(ch_chunk_text)
-                    all_metadata_map[current_child_i] = child_metadata
-                    current_child_i += 1
-        
-        logger.info(f"Creating embeddings for {len(all_texts_to_embed)} chunks...")
-
-        if not all_ids:
-            return parent_ids
-        
-        # Embed documents
-        for i in tqdm(
-            range(0, len(all_texts_to_embed), embedding_batch_size), 
-            desc="Creating embeddings"):
-            batch_texts = all_texts_to_embed[i:i+embedding_batch_size]
-            batch_embeddings = self.embedding_model.embed_documents(batch_texts)
-            all_embeddings.extend(batch_embeddings)
-    
-        all_metadata = [all_metadata_map[i] for i in range(len(all_metadata_map))]
+        stats = stream_ingest(
+            records,
+            embed_fn=self.embedding_scheduler.embed_documents,
+            upsert_fn=self._upsert_batch,
+            embed_batch_size=embedding_batch_size,
+            upsert_batch_size=upsert_batch_size
+        )
+        self._record_ingested(changed, stats.failed_ids, seen_keys, prune)
 
-        df = pd.DataFrame({
-            'id': all_ids,
-            'values': all_embeddings,
-            'metadata': all_metadata
-        })
-        
-        self.child_index.upsert_from_dataframe(
-            df=df,
-            namespace=self.namespace,
-            batch_size=512,
-            show_progress=True
+        if stats.failed_ids:
+            logger.error(f"{len(stats.failed_ids)} chunk(s) failed to embed.")
+        logger.info(f"Embedding stats: {self.embedding_scheduler.stats()}")
+        logger.info(
+            f"Upserted {stats.upserted} chunks from {len(changed)} new or changed "
+            f"of {len(parent_ids)} documents."
         )
-        logger.info("Done upserting DataFrame.")
 
         if save_parents:
-            with open(f'parent_store/parents_{self.namespace}.json', 'w', 
-                      encoding ='utf8') as f:
-                json.dump(
-                    {k: {"metadata": v.metadata,
-                         "page_content": v.page_content} 
-                         for k, v in self.parent_docs.items()},
-                    fp=f, 
-                    indent = 4
-                )
-            logger.info("Saved parent documents.")
+            self._save_parents()
 
         return parent_ids
     
     async def aadd_documents(
         self, 
-        documents: List[Document], 
+        documents: Iterable[Document], 
         save_parents: bool = False,
-        parent_store_path: str = "parent_store"
+        parent_store_path: str = "parent_store",
+        prune: bool = False,
+        embedding_batch_size: int = 100,
+        upsert_batch_size: int = 512,
+        concurrency_limit: int = None
     ) -> List[str]:
         """
         Process and add documents to the vector store, 
         maintaining parent-child relationships, using asynchronous embedding calls.
-        """
-        logger.info("Starting async ingestion.")
-        parent_ids = []
-        all_ids = []
-        all_embeddings = []
-        all_metadata = []
-        all_texts_to_embed = []
-
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.child_chunk_size, chunk_overlap=self.child_overlap
-        )
-        parent_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.parent_chunk_size, chunk_overlap=self.parent_overlap
-        )
-        
-        logger.info("Processing documents and extracting chunks...")
-        for doc in documents:
-            parent_id = self._generate_parent_id()
-            parent_ids.append(parent_id)
-            
-            self.parent_docs[parent_id] = doc
 
-            if not self.chunk_parents:
-                parent_units = [doc.page_content]
-                parent_unit_ids = [parent_id]
-            else:
-                # Chunk the parent document
-                parent_chunks = parent_splitter.split_text(doc.page_content)
-                parent_units = parent_chunks
-                parent_unit_ids = [self._generate_parent_chunk_id(parent_id, i) 
-                                   for i in range(len(parent_chunks))]
-                
-                # Store the mapping of parent chunks to parent ID
-                for i, chunk in enumerate(parent_chunks):
-                    chunk_id = parent_unit_ids[i]
-                    self.parent_docs[chunk_id] = Document(
-                        page_content=chunk,
-                        metadata={**doc.metadata, 
-                                  "parent_id": parent_id, 
-                                  "is_parent_chunk": True, 
-                                  "chunk_index": i}
-                        )
-            
-            # Process each parent unit (whole doc or parent chunk)
-            for parent_unit, parent_unit_id in zip(parent_units, parent_unit_ids):
-                ch_chunks = child_splitter.split_text(parent_unit)
-                
-                # Create child documents with embeddings
-                for i, ch_chunk_text in enumerate(ch_chunks):
-                    child_id = self._generate_child_id(parent_unit_id, i)
-                    
-                    child_metadata = {
-                        "text": ch_chunk_text,  
-                        "parent_unit_id": parent_unit_id, # ID of immediate parent (whole doc or chunk)
-                        "original_parent_id": parent_id, # ID of original parent document
-                        "is_chunked_parent": self.chunk_parents,
-                        "chunk_index": i,
-                        **doc.metadata
-                    }
-
-                    all_ids.append(child_id)
-                    all_texts_to_embed.append(ch_chunk_text)
-                    all_metadata.append(child_metadata)
-        
-        if not all_ids:
-            logger.error("No document could be processed.")
-            return parent_ids
-
-        logger.info(f"Creating embeddings for {len(all_texts_to_embed)} chunks...")
-
-        embedding_batch_size = 100
-        concurrency_limit = 5
-        semaphore = asyncio.Semaphore(concurrency_limit)
-        all_embeddings = [None] * len(all_texts_to_embed)
-
-        # @retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-        async def embed_batch(batch_idx, start_idx):
-            # Calculate batch boundaries
-            end_idx = min(start_idx + embedding_batch_size, len(all_texts_to_embed))
-            batch_texts = all_texts_to_embed[start_idx:end_idx]
-            
-            # Use semaphore to limit concurrent API calls
-            async with semaphore:
-                try:
-                    batch_embeddings = await self.embedding_model.aembed_documents(
-                        batch_texts
-                    )
-                    for i, embedding in enumerate(batch_embeddings):
-                        all_embeddings[start_idx + i] = embedding
-                    
-                    return batch_idx, True
-                except Exception as e:
-                    print(f"Error embedding batch {batch_idx}: {e}")
-                    return batch_idx, False
-
-        # Create embedding tasks for all batches
-        tasks = []
-        for batch_idx, start_idx in enumerate(range(
-            0, len(all_texts_to_embed), embedding_batch_size)
-        ):
-            tasks.append(embed_batch(batch_idx, start_idx))
-        
-        # Execute all embedding tasks concurrently with progress tracking
-        results = await tqdm.gather(*tasks, desc="Embedding batches")
-        
-        # Check for failures
-        failures = [idx for idx, success in results if not success]
-        if failures:
-            print(f"Warning: {len(failures)} batch(es) failed to embed properly.")
-
-        # Check if we have any valid embeddings
-        if not any(emb is not None for emb in all_embeddings):
-            print("No valid embeddings were created.")
-            return parent_ids
-        
-        logger.info("Creating dataframe and upserting to vector database...")
-        valid_entries = [
-            (id, embedding, metadata)
-            for id, embedding, metadata in zip(all_ids, all_embeddings, all_metadata)
-            if embedding is not None
-        ]
+        Chunking, concurrent embedding and upserting overlap through bounded 
+        queues (see ingestion.py). ``concurrency_limit`` bounds the pipeline 
+        batches in flight (default: the scheduler's maximum concurrency); the 
+        embedding scheduler adapts the number of concurrent requests below it.
 
-        valid_ids, valid_embeddings, valid_metadata = zip(*valid_entries)
+        With a manifest, only new or changed documents are embedded and 
+        upserted; ``prune`` also deletes the documents missing from this call.
+        """
+        logger.info("Starting async ingestion.")
 
-        df = pd.DataFrame(
-            {'id': valid_ids,'values': valid_embeddings, 'metadata': valid_metadata}
+        parent_ids, changed, seen_keys = [], [], set()
+        records = self._iter_children(
+            self._select_changed(documents, parent_ids, changed, seen_keys)
         )
-        
-        self.child_index.upsert_from_dataframe(
-            df=df, namespace=self.namespace, batch_size=512, show_progress=True
+
+        stats = await astream_ingest(
+            records,
+            aembed_fn=self.embedding_scheduler.aembed_documents,
+            upsert_fn=self._upsert_batch,
+            embed_batch_size=embedding_batch_size,
+            upsert_batch_size=upsert_batch_size,
+            concurrency=concurrency_limit or self.embedding_scheduler.limiter.maximum
         )
+        self._record_ingested(changed, stats.failed_ids, seen_keys, prune)
 
+        if stats.failed_ids:
+            logger.warning(
+                f"{len(stats.failed_ids)} chunk(s) failed to embed properly."
+            )
+        logger.info(f"Embedding stats: {self.embedding_scheduler.stats()}")
         logger.info(
-            f"Successfully processed {len(valid_entries)} chunks from {len(documents)} documents."
+            f"Successfully processed {stats.upserted} chunks from {len(parent_ids)} documents."
         )
 
         if save_parents:
             try:
-                Path(parent_store_path).mkdir(parents=True, exist_ok=True)
-                with open(f'{parent_store_path}/parents_{self.namespace}.json', 'w', encoding ='utf8') as f:
-                    json.dump(
-                        {k:{"metadata": v.metadata,
-                           "page_content": v.page_content}
-                           for k, v in self.parent_docs.items()},
-                        fp=f, 
-                        indent=4
-                    )
+                self._save_parents(parent_store_path)
             except ValueError as e:
                 logger.error(f"Value error: {e}")
             except FileNotFoundError as e:
                 logger.error(f"File not found.")
-
-            logger.info("Saved parents.")
                 
         return parent_ids
     
-
-    def invoke(self, query: str, top_k: int = 5) -> List[Document]:
+    def invoke(
+            self, query: str, top_k: int = 5, return_scores: bool = False
+    ) -> List[Document]:
         """
         Retrieve parent documents or chunks based on child chunk retrieval.
         
         Args:
             query: The search query
             top_k: Number of parent documents to return
+            return_scores: Return ``(document, parent score)`` tuples
             
         Returns:
-            If chunk_parents=False: List of parent documents
-            If chunk_parents=True: List of lists, where each inner list contains chunks of a parent
+            Up to top_k parent documents, ranked by their aggregated child scores
         """
-        results = self.child_index.query(
-            namespace=self.namespace,
-            vector=[self.embedding_model.embed_query(query)], 
-            top_k=top_k, # * 3,
-            include_metadata=True,
-            include_values=False
+        return self._query_parents(
+            self.embedding_model.embed_query(query), top_k, return_scores
         )
-                
-        # Extract only unique parent IDs
-        seen_parent_ids = set()
-        retrieved_docs = []
 
-        for result in results["matches"]:
+    def batch_invoke(
+            self, queries: List[str], top_k: int = 5, max_concurrency: int = 8,
+            return_scores: bool = False
+    ) -> List[List[Document]]:
+        """
+        Retrieve parents for many queries from a bounded thread pool. Each 
+        query is embedded with ``embed_query``, as in ``invoke``, since 
+        models may embed queries and documents differently.
+
+        Returns:
+            One ``invoke`` result per query, in input order.
+        """
+        if not queries:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(queries))) as pool:
+            return list(pool.map(
+                lambda query: self.invoke(query, top_k, return_scores), queries
+            ))
+
+    async def ainvoke(
+            self, query: str, top_k: int = 5, return_scores: bool = False
+    ) -> List[Document]:
+        """Async ``invoke``; the blocking index query runs in a worker thread."""
+        vector = await self.embedding_model.aembed_query(query)
+        return await asyncio.to_thread(self._query_parents, vector, top_k, return_scores)
+
+    async def abatch_invoke(
+            self, queries: List[str], top_k: int = 5, max_concurrency: int = 8,
+            return_scores: bool = False
+    ) -> List[List[Document]]:
+        """Async ``batch_invoke``, with at most ``max_concurrency`` queries 
+        in flight. Results are in input order."""
+        if not queries:
+            return []
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def query_one(query):
+            async with semaphore:
+                return await self.ainvoke(query, top_k, return_scores)
+
+        return list(await asyncio.gather(*(query_one(q) for q in queries)))
+
+    def _query_parents(
+            self, vector: List[float], top_k: int, return_scores: bool = False
+    ) -> List[Document]:
+        """Query the child index with an embedded query and rank the unique 
+        parents of the matches.
+
+        Child scores are aggregated per parent (``parent_aggregation``: max, 
+        sum or reciprocal-rank). When the children of the first ``top_k`` 
+        matches share parents, the query is repeated with 
+        ``overfetch_factor`` times more children until ``top_k`` parents are 
+        found, the namespace is exhausted or ``max_fetch_k`` is reached.
+        """
+        ranked = self.rank_parents(vector, top_k)
+        if return_scores:
+            return [(self.parent_docs[parent_id], score) for parent_id, score in ranked]
+        return [self.parent_docs[parent_id] for parent_id, _ in ranked]
+
+    def rank_parents(self, vector: List[float], top_k: int) -> List[tuple]:
+        """``(parent id, score)`` of the best ``top_k`` parents for an 
+        embedded query, see ``_query_parents``."""
+        return self._rank_parents(
+            lambda fetch_k: self.child_index.query(
+                namespace=self.namespace,
+                vector=[vector], 
+                top_k=fetch_k,
+                include_metadata=True,
+                include_values=False
+            )["matches"],
+            top_k
+        )
+
+    def rank_parents_sparse(self, query: str, top_k: int) -> List[tuple]:
+        """``(parent id, score)`` of the best ``top_k`` parents by BM25."""
+        if self.sparse_index is None:
+            raise ValueError("No sparse index configured.")
+        return self._rank_parents(
+            lambda fetch_k: self.sparse_index.query(query, top_k=fetch_k)["matches"],
+            top_k
+        )
+
+    def _rank_parents(self, search, top_k: int) -> List[tuple]:
+        """Over-fetching loop shared by the dense and sparse rankings: 
+        ``search(fetch_k)`` returns the best ``fetch_k`` child matches."""
+        started = time.perf_counter()
+        fetch_k, searches = top_k, 0
+        while True:
+            matches = search(fetch_k)
+            parent_scores = self._aggregate_parent_scores(matches)
+            searches += 1
+
+            exhausted = len(matches) < fetch_k
+            if len(parent_scores) >= top_k or exhausted or fetch_k >= self.max_fetch_k:
+                break
+            fetch_k = min(fetch_k * self.overfetch_factor, self.max_fetch_k)
+
+        if self.tracer is not None and self.tracer.enabled:
+            self.tracer.record("index_query", (time.perf_counter() - started) * 1000, {
+                "searches": searches, "fetched_children": len(matches),
+            }, top_k=top_k)
+
+        return sorted(parent_scores.items(), key=lambda item: -item[1])[:top_k]
+
+    def _aggregate_parent_scores(self, matches) -> dict:
+        """Aggregate child match scores into one score per known parent, 
+        in order of the parents' first appearance."""
+        parent_scores = {}
+        for rank, result in enumerate(matches, start=1):
             parent_id = result["metadata"]["original_parent_id"]
+            if not parent_id or parent_id not in self.parent_docs:
+                continue
 
-            if parent_id and parent_id not in seen_parent_ids:
-                if parent_id in self.parent_docs.keys():
-                    seen_parent_ids.add(parent_id)
-                    retrieved_docs.append(self.parent_docs[parent_id])
-                    
-                    # Limit to only k parents (if we query more)
-                    # if len(retrieved_docs) == top_k:
-                        # break
-        
-        return retrieved_docs
+            if self.parent_aggregation == "rrf":
+                score = 1.0 / (self.rrf_k + rank)
+            else:
+                score = result["score"]
+
+            if parent_id not in parent_scores:
+                parent_scores[parent_id] = score
+            elif self.parent_aggregation == "max":
+                parent_scores[parent_id] = max(parent_scores[parent_id], score)
+            else:
+                parent_scores[parent_id] += score
+        return parent_scores
    
     def describe(self):
         return self.child_index.describe_index_stats()
 
     def delete_namespace(self):
+        """Delete all children of the namespace, together with the parents, 
+        the sparse index and side store entries and the manifest."""
         self.child_index.delete(delete_all=True, namespace=self.namespace)
-
-
-def estimate_batch_size(batch: List[str]) -> int:
-    """Estimate the size of the batch in bytes."""
-    return sum(len(item.encode('utf-8')) for item in batch)
+        if self.sparse_index is not None:
+            self.sparse_index.delete(prefix="")
+        self.parent_docs.clear()
+        if self.child_docs is not None:
+            self.child_docs.clear()
+        self._persist_index()
+        if self.manifest is not None:
+            self.manifest.clear()
+            self.manifest.save()
+
+
+def _delete_numbered(store, make_id) -> List[str]:
+    """Delete ``make_id(0)``, ``make_id(1)``, ... from ``store`` up to the 
+    first missing id; returns the deleted ids."""
+    deleted = []
+    while make_id(len(deleted)) in store:
+        doc_id = make_id(len(deleted))
+        del store[doc_id]
+        deleted.append(doc_id)
+    return deleted
@@ -0,0 +1,277 @@
+import os
+import json
+import mmap
+import zlib
+import logging
+import threading
+from typing import Dict, Iterator, Tuple
+from pathlib import Path
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from langchain.schema import Document
+
+logger = logging.Logger(__name__)
+
+
+TOMBSTONE = -1
+
+
+class ShardedParentStore(MutableMapping):
+    """Append-only, sharded on-disk store of parent documents.
+
+    Each shard is a pair of files: ``shard-NNN.blob`` holds the UTF-8 JSON
+    records back to back and ``shard-NNN.idx`` is the offset table, one
+    ``id<TAB>offset<TAB>length`` line per write. Opening the store only reads
+    the offset tables; documents are read lazily from memory-mapped blobs
+    and kept in a bounded LRU. Writes append to both files, so adding
+    parents never rewrites existing data. Later entries of an id shadow
+    earlier ones, and deletions are written as tombstones; ``compact``
+    rewrites the shards without them.
+
+    The store behaves like a ``dict`` of ``Document`` objects, so it can
+    replace ``ParentChildRetriever.parent_docs`` directly.
+    """
+
+    def __init__(self, path: str, n_shards: int = 16, cache_size: int = 1024):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.cache_size = cache_size
+
+        # The shard count of an existing store wins over the argument
+        config_path = self.path / "store.json"
+        if config_path.exists():
+            with open(config_path, "r") as f:
+                n_shards = json.load(f)["n_shards"]
+        else:
+            with open(config_path, "w") as f:
+                json.dump({"n_shards": n_shards}, f)
+        self.n_shards = n_shards
+
+        self._offsets: Dict[str, Tuple[int, int, int]] = {}
+        self._cache: "OrderedDict[str, Document]" = OrderedDict()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._blob_files = {}
+        self._idx_files = {}
+        self._sizes: Dict[int, int] = {}
+        # Offset table lines per shard, live or not, to measure garbage
+        self._records: Dict[int, int] = {}
+        self._lock = threading.RLock()
+
+        self._load_offsets()
+
+    def _blob_path(self, shard: int) -> Path:
+        return self.path / f"shard-{shard:03d}.blob"
+
+    def _idx_path(self, shard: int) -> Path:
+        return self.path / f"shard-{shard:03d}.idx"
+
+    def _shard(self, doc_id: str) -> int:
+        return zlib.crc32(doc_id.encode("utf-8")) % self.n_shards
+
+    def _load_offsets(self):
+        for shard in range(self.n_shards):
+            self._recover(shard)
+            idx_path = self._idx_path(shard)
+            if not idx_path.exists():
+                continue
+            with open(idx_path, "r", encoding="utf8") as f:
+                for line in f:
+                    self._records[shard] = self._records.get(shard, 0) + 1
+                    doc_id, offset, length = line.rstrip("\n").split("\t")
+                    if int(length) == TOMBSTONE:
+                        self._offsets.pop(doc_id, None)
+                    else:
+                        self._offsets[doc_id] = (shard, int(offset), int(length))
+
+        logger.info("Parent store opened with %s documents.", len(self._offsets))
+
+    def _read(self, shard: int, offset: int, length: int) -> Document:
+        blob = self._maps.get(shard)
+        if blob is None or offset + length > len(blob):
+            # The shard grew since it was mapped (or was never mapped)
+            self._flush_shard(shard)
+            if blob is not None:
+                blob.close()
+            with open(self._blob_path(shard), "rb") as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = blob
+
+        data = json.loads(blob[offset:offset + length].decode("utf-8"))
+        return Document(page_content=data["page_content"], metadata=data["metadata"])
+
+    def _append(self, shard: int, doc_id: str, payload: bytes):
+        blob_file = self._blob_files.get(shard)
+        if blob_file is None:
+            blob_file = open(self._blob_path(shard), "ab")
+            self._blob_files[shard] = blob_file
+            self._idx_files[shard] = open(self._idx_path(shard), "a", encoding="utf8")
+            self._sizes[shard] = os.path.getsize(self._blob_path(shard))
+
+        offset = self._sizes[shard]
+        blob_file.write(payload)
+        self._sizes[shard] += len(payload)
+        length = len(payload) if payload else TOMBSTONE
+        self._idx_files[shard].write(f"{doc_id}\t{offset}\t{length}\n")
+        self._records[shard] = self._records.get(shard, 0) + 1
+        return offset
+
+    def __getitem__(self, doc_id: str) -> Document:
+        with self._lock:
+            doc = self._cache.get(doc_id)
+            if doc is not None:
+                self._cache.move_to_end(doc_id)
+                return doc
+
+            shard, offset, length = self._offsets[doc_id]
+            doc = self._read(shard, offset, length)
+            self._remember(doc_id, doc)
+            return doc
+
+    def __setitem__(self, doc_id: str, doc: Document):
+        if "\t" in doc_id or "\n" in doc_id:
+            raise ValueError(f"Invalid parent id: {doc_id!r}")
+
+        payload = json.dumps(
+            {"metadata": doc.metadata, "page_content": doc.page_content},
+            ensure_ascii=False
+        ).encode("utf-8")
+
+        with self._lock:
+            shard = self._shard(doc_id)
+            offset = self._append(shard, doc_id, payload)
+            self._offsets[doc_id] = (shard, offset, len(payload))
+            self._remember(doc_id, doc)
+
+    def __delitem__(self, doc_id: str):
+        with self._lock:
+            if doc_id not in self._offsets:
+                raise KeyError(doc_id)
+            self._append(self._shard(doc_id), doc_id, b"")
+            del self._offsets[doc_id]
+            self._cache.pop(doc_id, None)
+
+    def __contains__(self, doc_id) -> bool:
+        return doc_id in self._offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._offsets))
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def _remember(self, doc_id: str, doc: Document):
+        self._cache[doc_id] = doc
+        self._cache.move_to_end(doc_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _flush_shard(self, shard: int):
+        if shard in self._blob_files:
+            self._blob_files[shard].flush()
+            self._idx_files[shard].flush()
+
+    def flush(self):
+        """Flush pending appends to disk."""
+        with self._lock:
+            for shard in self._blob_files:
+                self._flush_shard(shard)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            for handle in [*self._blob_files.values(), *self._idx_files.values()]:
+                handle.close()
+            for blob in self._maps.values():
+                blob.close()
+            self._blob_files, self._idx_files, self._maps = {}, {}, {}
+
+    def clear(self):
+        """Remove every document by deleting the shard files."""
+        with self._lock:
+            self.close()
+            for shard in range(self.n_shards):
+                for path in (self._blob_path(shard), self._idx_path(shard)):
+                    if path.exists():
+                        path.unlink()
+            self._offsets.clear()
+            self._cache.clear()
+            self._sizes.clear()
+            self._records.clear()
+
+    def compact(self, min_garbage: float = 0.0) -> int:
+        """Rewrite the shards in which at least ``min_garbage`` of the
+        records are overwritten or deleted, keeping only the live documents.
+        Returns the number of records dropped."""
+        with self._lock:
+            live: Dict[int, list] = {}
+            for doc_id, (shard, offset, length) in self._offsets.items():
+                live.setdefault(shard, []).append((offset, length, doc_id))
+
+            dropped = 0
+            for shard, records in list(self._records.items()):
+                entries = sorted(live.get(shard, []))
+                garbage = records - len(entries)
+                if garbage == 0 or garbage < min_garbage * records:
+                    continue
+                self._compact_shard(shard, entries)
+                dropped += garbage
+
+        logger.info("Parent store compacted, %s records dropped.", dropped)
+        return dropped
+
+    def _compact_shard(self, shard: int, entries: list):
+        """Copy the live records to new files and swap them in: the blob
+        first, then the offset table (``_recover`` completes or discards
+        an interrupted swap)."""
+        self._flush_shard(shard)
+        for handles in (self._blob_files, self._idx_files, self._maps):
+            handle = handles.pop(shard, None)
+            if handle is not None:
+                handle.close()
+        self._sizes.pop(shard, None)
+
+        blob_path, idx_path = self._blob_path(shard), self._idx_path(shard)
+        offsets = {}
+        with open(blob_path, "rb") as source, \
+                open(_tmp(blob_path), "wb") as blob, \
+                open(_tmp(idx_path), "w", encoding="utf8") as idx:
+            position = 0
+            for offset, length, doc_id in entries:
+                source.seek(offset)
+                blob.write(source.read(length))
+                idx.write(f"{doc_id}\t{position}\t{length}\n")
+                offsets[doc_id] = (shard, position, length)
+                position += length
+            for handle in (blob, idx):
+                handle.flush()
+                os.fsync(handle.fileno())
+
+        os.replace(_tmp(blob_path), blob_path)
+        os.replace(_tmp(idx_path), idx_path)
+        self._offsets.update(offsets)
+        self._records[shard] = len(entries)
+
+    def _recover(self, shard: int):
+        """Finish a compaction that stopped after swapping the blob, or
+        drop one that stopped before."""
+        blob_tmp, idx_tmp = _tmp(self._blob_path(shard)), _tmp(self._idx_path(shard))
+        if idx_tmp.exists() and not blob_tmp.exists():
+            os.replace(idx_tmp, self._idx_path(shard))
+        for path in (blob_tmp, idx_tmp):
+            if path.exists():
+                path.unlink()
+
+    def import_json(self, json_path: str) -> int:
+        """Append the parents of a legacy ``parents.json`` dump."""
+        with open(json_path, "r", encoding="utf8") as j:
+            parents_dict = json.load(j)
+        for doc_id, data in parents_dict.items():
+            self[doc_id] = Document(
+                page_content=data["page_content"], metadata=data["metadata"])
+        self.flush()
+        return len(parents_dict)
+
+
+def _tmp(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
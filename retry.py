@@ -0,0 +1,48 @@
+import random
+
+
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+NON_RETRYABLE_CODES = {
+    "ValidationException",
+    "AccessDeniedException",
+    "ResourceNotFoundException",
+    "UnrecognizedClientException",
+}
+
+
+def _error_code(exc: Exception) -> str:
+    """Error code of a botocore ``ClientError`` (empty for other errors)."""
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code", "")
+    return ""
+
+
+def is_throttling_error(exc: Exception) -> bool:
+    """Whether an exception signals rate limiting (Bedrock, Pinecone, HTTP 429)."""
+    if _error_code(exc) in THROTTLING_CODES:
+        return True
+    if getattr(exc, "status", None) == 429:
+        return True
+    message = str(exc).lower()
+    return any(hint in message for hint in (
+        "throttl", "too many requests", "rate exceeded", "rate limit", "429"
+    ))
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """Client-side errors such as validation failures will not succeed on retry."""
+    return _error_code(exc) not in NON_RETRYABLE_CODES
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,39 @@
+"""The root modules, the Lambda files and the benchmark fakes are imported
+by module name, as in the Lambda zip and the benchmarks."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT, "benchmarks"), os.path.join(ROOT, "lambda_files"), ROOT):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import aws_clients  # noqa: E402
+import lambda_function  # noqa: E402
+from stub_clients import StubBedrockRuntime, StubKnowledgeBase  # noqa: E402
+
+
+@pytest.fixture
+def runtime():
+    return StubBedrockRuntime(first_token_latency=0.0, token_latency=0.0,
+                              rewrite_latency=0.0, answer_tokens=8)
+
+
+@pytest.fixture
+def knowledge_base():
+    return StubKnowledgeBase(latency=0.0)
+
+
+@pytest.fixture
+def stub_clients(runtime, knowledge_base):
+    """Routes the AWS clients of the controller to the stubs."""
+    aws_clients.set_client_factory(
+        lambda service_name: runtime if service_name == "bedrock-runtime" else knowledge_base
+    )
+    yield runtime, knowledge_base
+    aws_clients.set_client_factory(None)
+    lambda_function.set_controller(None)
@@ -0,0 +1,34 @@
+import time
+
+from answer_cache import AnswerCache, FileBackend, titan_embedder
+
+PASSAGES = ["Use the password reset link on the sign-in page."]
+
+
+def test_exact_hit_and_miss(tmp_path):
+    for backend in (None, FileBackend(str(tmp_path))):
+        cache = AnswerCache(backend=backend)
+        assert cache.get("How do I reset my password?", PASSAGES) is None
+
+        cache.put("How do I reset my password?", PASSAGES, "Use the reset link.")
+
+        assert cache.get("how do I reset my password", PASSAGES) == "Use the reset link."
+        assert cache.get("How do I reset my password?", ["Other context."]) is None
+        assert cache.stats()["hits"] == 1
+
+
+def test_entries_expire(tmp_path):
+    cache = AnswerCache(backend=FileBackend(str(tmp_path)), ttl_seconds=0.05)
+    cache.put("How do I reset my password?", PASSAGES, "Use the reset link.")
+    time.sleep(0.1)
+
+    assert cache.get("How do I reset my password?", PASSAGES) is None
+
+
+def test_near_match_with_stub_titan_embeddings(runtime):
+    cache = AnswerCache(embed_fn=titan_embedder(runtime))
+    cache.put("How do I reset my password?", PASSAGES, "Use the reset link.")
+
+    assert cache.get("Please, how do I reset my password?", PASSAGES) == "Use the reset link."
+    assert cache.get("How do I delete my account?", PASSAGES) is None
+    assert cache.stats()["near_hits"] == 1
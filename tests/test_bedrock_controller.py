@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+import lambda_function
+from answer_cache import AnswerCache
+from bedrock_controller import BedrockController
+
+
+def _roles(controller, thread_id):
+    return [message["role"] for message in controller.message_histories[thread_id]]
+
+
+def _fail(**kwargs):
+    raise RuntimeError("throttled")
+
+
+def test_converse_stream_yields_the_answer(stub_clients):
+    controller = BedrockController(rewrite_mode="serial")
+
+    chunks = list(controller.converse_stream("How do I reset my password?", "t1"))
+
+    assert len(chunks) == 8
+    assert _roles(controller, "t1") == ["user", "assistant"]
+    assert controller.message_histories["t1"][-1]["content"][0]["text"] == "".join(chunks)
+    timings = controller.last_timings
+    assert 0 <= timings["first_token_s"] <= timings["total_s"]
+
+
+def test_converse_stream_closed_early_keeps_the_partial_answer(stub_clients):
+    controller = BedrockController(rewrite_mode="serial")
+
+    stream = controller.converse_stream("How do I reset my password?", "t1")
+    first = next(stream)
+    stream.close()
+
+    assert _roles(controller, "t1") == ["user", "assistant"]
+    assert controller.message_histories["t1"][-1]["content"][0]["text"] == first
+
+
+def test_failed_turns_remove_the_user_message(stub_clients, monkeypatch):
+    runtime, _ = stub_clients
+    controller = BedrockController(rewrite_mode="serial")
+    controller.converse("How do I reset my password?", "t1")
+
+    monkeypatch.setattr(runtime, "converse_stream", _fail)
+    with pytest.raises(RuntimeError):
+        list(controller.converse_stream("And my username?", "t1"))
+    assert _roles(controller, "t1") == ["user", "assistant"]
+
+    # The rewrite fails before the answer is requested
+    monkeypatch.setattr(runtime, "converse", _fail)
+    with pytest.raises(RuntimeError):
+        controller.converse("And my username?", "t1")
+    assert _roles(controller, "t1") == ["user", "assistant"]
+
+
+def test_speculative_retrieval_is_kept_when_the_rewrite_adds_little(stub_clients):
+    _, knowledge_base = stub_clients
+    controller = BedrockController(rewrite_mode="speculative")
+
+    controller.converse("How do I use LangChain agents?", "t1")
+
+    # The stub rewrite echoes the input words
+    assert controller.last_timings["speculation"] == "hit"
+    assert controller.last_timings["term_overlap"] == 1.0
+    assert knowledge_base.calls == 1
+
+
+def test_speculative_retrieval_is_redone_for_a_different_rewrite(stub_clients, monkeypatch):
+    runtime, knowledge_base = stub_clients
+    controller = BedrockController(rewrite_mode="speculative")
+    monkeypatch.setattr(controller, "_transform_query", lambda thread_id: "memory retrievers")
+
+    controller.converse("How do I use LangChain agents?", "t1")
+
+    assert controller.last_timings["speculation"] == "miss"
+    assert controller.last_timings["query"] == "memory retrievers"
+    assert knowledge_base.calls == 2
+
+
+def test_skip_mode_retrieves_on_the_raw_input(stub_clients):
+    runtime, knowledge_base = stub_clients
+    controller = BedrockController(rewrite_mode="skip")
+
+    controller.converse("How do I use LangChain agents?", "t1")
+
+    assert controller.last_timings["query"] == "How do I use LangChain agents?"
+    assert runtime.calls == 1  # the answer only
+    assert knowledge_base.calls == 1
+
+
+def test_answer_cache_serves_repeated_first_turns(stub_clients):
+    runtime, _ = stub_clients
+    controller = BedrockController(rewrite_mode="skip", answer_cache=AnswerCache())
+
+    answer = controller.converse("How do I use LangChain agents?", "t1")
+    assert controller.last_timings["answer_cache"] == "miss"
+    calls = runtime.calls
+
+    assert controller.converse("How do I use LangChain agents?", "t2") == answer
+    assert controller.last_timings["answer_cache"] == "hit"
+    assert runtime.calls == calls
+
+    controller.converse("How do I add memory to a chain?", "t3")
+    assert controller.last_timings["answer_cache"] == "miss"
+    # Later turns depend on the history and are not cached
+    controller.converse("How do I use LangChain agents?", "t1")
+    assert controller.last_timings["answer_cache"] == "skip"
+
+
+def _stream_event(input_text="How do I reset my password?", thread_id="t1"):
+    return {"body": json.dumps({"input": input_text, "thread_id": thread_id, "stream": True})}
+
+
+def test_stream_handler_returns_the_events(stub_clients):
+    lambda_function.set_controller(BedrockController(rewrite_mode="serial"))
+
+    response = lambda_function.lambda_handler(_stream_event(), None)
+
+    assert response["statusCode"] == 200
+    assert response["headers"]["Content-Type"] == "text/event-stream"
+    assert response["body"].count("event: token") == 8
+    assert "event: done" in response["body"]
+
+
+def test_stream_failure_before_the_first_token_is_an_error_status(stub_clients, monkeypatch):
+    runtime, _ = stub_clients
+    controller = BedrockController(rewrite_mode="serial")
+    lambda_function.set_controller(controller)
+    monkeypatch.setattr(runtime, "converse_stream", _fail)
+
+    response = lambda_function.lambda_handler(_stream_event(), None)
+
+    assert response["statusCode"] == 500
+    assert "event: error" in response["body"]
+    assert "event: token" not in response["body"]
+    assert controller.message_histories["t1"] == []
@@ -0,0 +1,66 @@
+from langchain.schema import Document
+
+from fakes import HashingEmbeddings
+from parent_child import ParentChildRetriever
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """Counts the embedded texts."""
+
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.texts = 0
+
+    def embed_documents(self, texts):
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+
+DOCUMENTS = [
+    Document(page_content=f"Answer {i}: " + f"topic{i} details " * 20, metadata={"source": f"doc{i}"})
+    for i in range(3)
+]
+
+
+def _retriever(path) -> ParentChildRetriever:
+    return ParentChildRetriever(
+        CountingEmbeddings(), index_backend="local", index_path=str(path / "index"),
+        parent_store_dir=str(path / "parents"), manifest_path=str(path / "manifest.json"),
+        embedding_dimension=64, child_chunk_size=150, child_overlap=20,
+    )
+
+
+def test_reingest_embeds_only_changed_documents(tmp_path):
+    retriever = _retriever(tmp_path)
+    retriever.add_documents(DOCUMENTS)
+    vectors = retriever.describe()["total_vector_count"]
+    retriever.parent_docs.close()
+
+    retriever = _retriever(tmp_path)
+    retriever.add_documents(DOCUMENTS)
+    assert retriever.embedding_model.texts == 0
+
+    changed = Document(page_content="Answer 0: renamed subject " * 20, metadata={"source": "doc0"})
+    retriever.add_documents([changed] + DOCUMENTS[1:])
+
+    assert 0 < retriever.embedding_model.texts < vectors
+    assert len(retriever.parent_docs) == 3
+    assert retriever.invoke("renamed subject", top_k=1)[0].page_content == changed.page_content
+    retriever.parent_docs.close()
+
+
+def test_prune_deletes_documents_missing_from_the_ingest(tmp_path):
+    retriever = _retriever(tmp_path)
+    retriever.add_documents(DOCUMENTS)
+    vectors = retriever.describe()["total_vector_count"]
+    retriever.parent_docs.close()
+
+    retriever = _retriever(tmp_path)
+    retriever.add_documents(DOCUMENTS[:2], prune=True)
+
+    assert retriever.embedding_model.texts == 0
+    assert len(retriever.parent_docs) == 2
+    assert retriever.describe()["total_vector_count"] < vectors
+    contents = [doc.page_content for doc in retriever.invoke("topic2 details", top_k=3)]
+    assert DOCUMENTS[2].page_content not in contents
+    retriever.parent_docs.close()
@@ -0,0 +1,26 @@
+from thread_store import LocalFileBackend, ThreadStore
+
+
+def _message(role, text):
+    return {"role": role, "content": [{"text": text}]}
+
+
+def test_stale_write_merges_the_local_tail(tmp_path):
+    first = ThreadStore(LocalFileBackend(str(tmp_path)))
+    second = ThreadStore(LocalFileBackend(str(tmp_path)))
+    first["t1"] = [_message("user", "hi")]
+    first.flush()
+
+    second["t1"].append(_message("assistant", "hello"))
+    second.mark_dirty("t1")
+    second.flush()
+
+    # Based on the first version: the write conflicts and is merged
+    first["t1"].append(_message("user", "bye"))
+    first.mark_dirty("t1")
+    first.flush()
+
+    expected = [_message("user", "hi"), _message("assistant", "hello"), _message("user", "bye")]
+    assert first.stats()["conflicts"] == 1
+    assert first["t1"] == expected
+    assert ThreadStore(LocalFileBackend(str(tmp_path)))["t1"] == expected
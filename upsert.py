@@ -0,0 +1,193 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+from typing import Iterable, Iterator, List, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestion import estimate_batch_size
+from retry import backoff_delay, is_retryable_error, is_throttling_error
+
+logger = logging.Logger(__name__)
+
+
+class UpsertReport():
+    """Outcome of one ``BulkUpserter.upsert`` call."""
+
+    def __init__(self):
+        self.upserted = 0
+        self.batches = 0
+        self.bytes = 0
+        self.failed_ids: List[str] = []
+
+    def as_dict(self) -> dict:
+        return {
+            "upserted": self.upserted,
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "failed": len(self.failed_ids),
+        }
+
+
+class BulkUpserter():
+    """Direct, parallel upserts of Pinecone-style vector dicts
+    (``id``, ``values``, ``metadata``) into a Pinecone or local index.
+
+    Vectors are packed into requests bounded by ``max_batch_bytes`` of
+    estimated payload and ``max_batch_items`` vectors (Pinecone's limits
+    are 2 MB and 1000), which ``max_workers`` threads send concurrently,
+    with at most ``max_pending`` requests queued. Failed requests are
+    retried with jittered exponential backoff. A request rejected as
+    invalid is split in halves, so only the offending vectors fail, and
+    their ids are reported.
+    """
+
+    def __init__(
+            self,
+            index,
+            namespace: str = "",
+            max_batch_bytes: int = 2 * 1024 * 1024,
+            max_batch_items: int = 1000,
+            max_workers: int = 4,
+            max_pending: int = None,
+            max_retries: int = 4,
+            base_delay: float = 0.5,
+            max_delay: float = 30.0,
+            bytes_per_value: int = 20,
+            tracer=None
+        ):
+        self.index = index
+        self.namespace = namespace
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_items = max_batch_items
+        self.max_workers = max_workers
+        self.max_pending = max_pending or 2 * max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Floats are sent as JSON text by the REST client
+        self.bytes_per_value = bytes_per_value
+        # Optional lambda_files/tracing.py tracer for per-request records
+        self.tracer = tracer
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "vectors": 0, "bytes": 0,
+                          "retries": 0, "throttles": 0, "splits": 0, "failures": 0}
+
+    def estimate_bytes(self, vector: dict) -> int:
+        return estimate_batch_size(
+            [vector["id"], json.dumps(vector.get("metadata") or {}, default=str)]
+        ) + self.bytes_per_value * len(vector["values"])
+
+    def plan_batches(self, vectors: Iterable[dict]) -> Iterator[Tuple[List[dict], int]]:
+        """Greedy packing of consecutive vectors under both limits, as
+        ``(batch, estimated bytes)``; a vector larger than
+        ``max_batch_bytes`` goes alone."""
+        batch, batch_bytes = [], 0
+        for vector in vectors:
+            size = self.estimate_bytes(vector)
+            if batch and (len(batch) >= self.max_batch_items
+                          or batch_bytes + size > self.max_batch_bytes):
+                yield batch, batch_bytes
+                batch, batch_bytes = [], 0
+            batch.append(vector)
+            batch_bytes += size
+        if batch:
+            yield batch, batch_bytes
+
+    def _count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self._counters[name] += value
+
+    def _send(self, batch: List[dict]) -> List[str]:
+        """Upsert one request with retries; returns the ids that failed."""
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                self.index.upsert(vectors=batch, namespace=self.namespace)
+                self._count(requests=1, vectors=len(batch))
+                if self.tracer is not None and self.tracer.enabled:
+                    self.tracer.record("upsert", (time.perf_counter() - started) * 1000, {
+                        "vectors": len(batch),
+                        "bytes": (sum(map(self.estimate_bytes, batch)), "Bytes"),
+                        "retries": attempt,
+                    })
+                return []
+            except Exception as e:
+                throttled = is_throttling_error(e)
+                if throttled:
+                    self._count(throttles=1)
+                if not is_retryable_error(e) or (not throttled and _is_client_error(e)):
+                    if len(batch) > 1:
+                        self._count(splits=1)
+                        middle = len(batch) // 2
+                        return self._send(batch[:middle]) + self._send(batch[middle:])
+                    self._count(failures=1)
+                    logger.error(f"Upsert of {batch[0]['id']} rejected: {e}")
+                    return [batch[0]["id"]]
+                if attempt >= self.max_retries:
+                    self._count(failures=1)
+                    logger.error(
+                        f"Upsert batch of {len(batch)} vectors failed after "
+                        f"{attempt + 1} attempts: {e}"
+                    )
+                    return [vector["id"] for vector in batch]
+
+                self._count(retries=1)
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                logger.warning(
+                    f"Upsert batch failed ({'throttled' if throttled else e}), "
+                    f"retrying in {delay:.2f}s."
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def upsert(self, vectors: Iterable[dict]) -> UpsertReport:
+        """Upserts ``vectors`` (consumed lazily) and waits for all requests."""
+        report = UpsertReport()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        pending = deque()
+
+        def collect(batch, future):
+            failed = future.result()
+            report.failed_ids.extend(failed)
+            report.upserted += len(batch) - len(failed)
+
+        for batch, batch_bytes in self.plan_batches(vectors):
+            report.batches += 1
+            report.bytes += batch_bytes
+            self._count(bytes=batch_bytes)
+            # Run in the caller's context, so records keep its trace
+            pending.append((batch, self._executor.submit(
+                contextvars.copy_context().run, self._send, batch
+            )))
+            if len(pending) >= self.max_pending:
+                collect(*pending.popleft())
+        while pending:
+            collect(*pending.popleft())
+        return report
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+
+def _is_client_error(exc: Exception) -> bool:
+    """Invalid requests: HTTP 4xx responses (other than 429) from the
+    Pinecone client, or invalid vectors rejected by the local index."""
+    if isinstance(exc, (ValueError, TypeError, KeyError)):
+        return True
+    status = getattr(exc, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
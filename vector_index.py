@@ -0,0 +1,610 @@
+import os
+import copy
+import json
+import logging
+import threading
+from typing import Dict, List, Optional
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+
+logger = logging.Logger(__name__)
+
+
+DEFAULT_NAMESPACE_DIR = "__default__"
+
+QUANTIZATIONS = (None, "int8", "binary")
+# Candidates per requested result scored exactly after the quantized scan
+DEFAULT_RESCORE_FACTORS = {"int8": 4, "binary": 16}
+# Rows per block of the quantized scan, bounding its float32 temporaries
+SCAN_BLOCK = 1024
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(codes: np.ndarray) -> np.ndarray:
+    """Set bits per byte (``np.bitwise_count`` on NumPy 2, else a table)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT[codes]
+
+
+class _Namespace():
+    """Row storage of one namespace: a growable float32 matrix of unit
+    vectors with the ids and metadata aligned to its rows, plus their
+    quantized codes when the index is quantized."""
+
+    def __init__(self, dimension: int, quantization: Optional[str] = None):
+        self.dimension = dimension
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        self.size = 0
+        self.quantization = quantization
+        self.codes = np.zeros(
+            (0, _code_width(dimension, quantization)), dtype=_code_dtype(quantization)
+        )
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.ids: List[str] = []
+        self.metadata: List[dict] = []
+        self.rows: Dict[str, int] = {}
+
+        # IVF state, rebuilt lazily when stale: the lists are valid for
+        # the write ``version`` they were assigned at
+        self.centroids = None
+        self.assignments = None
+        self.list_order = None
+        self.list_offsets = None
+        self.trained_size = 0
+        self.version = 0
+        self.ivf_version = None
+        self.dirty = True
+        # Set while a query may hold a snapshot of the row buffers
+        self.shared = False
+
+    def matrix(self) -> np.ndarray:
+        return self.vectors[:self.size]
+
+    def snapshot(self) -> "_Namespace":
+        """A view of the rows as of now, for a query to read without the
+        write lock: appends and deletes do not touch the buffers it
+        references, and overwrites copy them first (see ``upsert``)."""
+        self.shared = True
+        return copy.copy(self)
+
+    def _unshare(self):
+        self.vectors = np.array(self.vectors)
+        self.metadata = list(self.metadata)
+        if self.quantization is not None:
+            self.codes, self.scales = self.codes.copy(), self.scales.copy()
+        self.shared = False
+
+    def _reserve(self, extra: int):
+        """Grow the buffers geometrically so appends stay amortized O(1)."""
+        needed = self.size + extra
+        if needed <= self.vectors.shape[0] and self.vectors.flags.writeable:
+            return
+        capacity = max(needed, 2 * self.vectors.shape[0], 64)
+        grown = np.zeros((capacity, self.dimension), dtype=np.float32)
+        grown[:self.size] = self.vectors[:self.size]
+        self.vectors = grown
+        if self.quantization is not None:
+            codes = np.zeros((capacity, self.codes.shape[1]), dtype=self.codes.dtype)
+            codes[:self.size] = self.codes[:self.size]
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[:self.size] = self.scales[:self.size]
+            self.codes, self.scales = codes, scales
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, metadata: List[dict]):
+        if self.shared and any(vec_id in self.rows for vec_id in ids):
+            self._unshare()
+        self._reserve(len(ids))
+        rows = []
+        for vec_id, meta in zip(ids, metadata):
+            row = self.rows.get(vec_id)
+            if row is None:
+                row = self.size
+                self.size += 1
+                self.rows[vec_id] = row
+                self.ids.append(vec_id)
+                self.metadata.append(meta)
+            else:
+                self.metadata[row] = meta
+            rows.append(row)
+        self.vectors[rows] = vectors
+        if self.quantization is not None:
+            self.codes[rows], self.scales[rows] = _quantize(vectors, self.quantization)
+        self.dirty = True
+        self.invalidate_ivf()
+
+    def encode(self):
+        """(Re)build the codes of all rows, e.g. after loading floats only."""
+        self.codes = np.zeros((self.size, self.codes.shape[1]), dtype=self.codes.dtype)
+        self.scales = np.zeros(self.size, dtype=np.float32)
+        for start in range(0, self.size, SCAN_BLOCK):
+            block = np.asarray(self.vectors[start:start + SCAN_BLOCK])
+            self.codes[start:start + len(block)], self.scales[start:start + len(block)] = (
+                _quantize(block, self.quantization)
+            )
+
+    def delete(self, ids: List[str]):
+        drop = {self.rows[vec_id] for vec_id in ids if vec_id in self.rows}
+        if not drop:
+            return
+        keep = np.array(
+            [row for row in range(self.size) if row not in drop], dtype=np.int64
+        )
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+        if self.quantization is not None:
+            self.codes = np.ascontiguousarray(self.codes[keep])
+            self.scales = np.ascontiguousarray(self.scales[keep])
+        self.size = len(keep)
+        self.ids = [self.ids[row] for row in keep]
+        self.metadata = [self.metadata[row] for row in keep]
+        self.rows = {vec_id: row for row, vec_id in enumerate(self.ids)}
+        self.dirty = True
+        self.invalidate_ivf()
+
+    def invalidate_ivf(self):
+        """Any write makes the IVF lists stale, including overwrites and
+        deletes followed by inserts that leave the row count unchanged."""
+        self.version += 1
+
+
+class LocalVectorIndex():
+    """In-process cosine vector index exposing the subset of the Pinecone
+    ``Index`` API used by ``ParentChildRetriever``.
+
+    Vectors are kept L2-normalized in a float32 matrix per namespace, so a
+    query is a single matrix-vector product followed by an ``argpartition``
+    top-k. When ``n_lists`` is set, namespaces larger than ``ivf_min_size``
+    are partitioned with spherical k-means and only the ``n_probe`` closest
+    lists are scanned. With a ``path`` the index is persisted as ``.npy``
+    files and reopened memory-mapped.
+
+    With ``quantization`` ("int8": one signed byte per dimension and a
+    per-row scale; "binary": one sign bit per dimension) queries scan the
+    compact codes for ``rescore_factor * top_k`` candidates and rescore
+    only those against the float32 rows. Persisted indexes keep the codes
+    in RAM and the floats memory-mapped, so the floats are paged in only
+    for rescored rows. ``memory_stats`` reports the bytes saved.
+    """
+
+    def __init__(
+            self,
+            dimension: int,
+            path: Optional[str] = None,
+            n_lists: int = 0,
+            n_probe: int = 8,
+            ivf_min_size: int = 10000,
+            seed: int = 0,
+            quantization: Optional[str] = None,
+            rescore_factor: Optional[int] = None
+        ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.dimension = dimension
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor or DEFAULT_RESCORE_FACTORS.get(quantization, 1)
+        self.path = Path(path) if path else None
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.ivf_min_size = ivf_min_size
+        self.seed = seed
+
+        self.namespaces: Dict[str, _Namespace] = {}
+        # Serializes the lazy IVF (re)builds of concurrent queries
+        self._ivf_lock = threading.Lock()
+        # Serializes writers: ingestion deletes the children of changed
+        # documents while upserts of the same run are in flight (see
+        # ingestion.py and upsert.py)
+        self._write_lock = threading.Lock()
+
+        if self.path is not None and self.path.exists():
+            self._load()
+
+    def _namespace(self, namespace: str, create: bool = False) -> Optional[_Namespace]:
+        ns = self.namespaces.get(namespace)
+        if ns is None and create:
+            ns = _Namespace(self.dimension, self.quantization)
+            self.namespaces[namespace] = ns
+        return ns
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors: List[dict], namespace: str = "", **kwargs) -> dict:
+        """Insert or overwrite vectors given as Pinecone-style dicts with
+        ``id``, ``values`` and optional ``metadata``."""
+        if not vectors:
+            return {"upserted_count": 0}
+
+        ids = [v["id"] for v in vectors]
+        matrix = self._normalize([v["values"] for v in vectors])
+        metadata = [dict(v.get("metadata") or {}) for v in vectors]
+
+        with self._write_lock:
+            self._namespace(namespace, create=True).upsert(ids, matrix, metadata)
+        return {"upserted_count": len(ids)}
+
+    def upsert_from_dataframe(
+            self, df, namespace: str = "", batch_size: int = 500,
+            show_progress: bool = True
+        ) -> dict:
+        """Upsert the ``id``/``values``/``metadata`` columns of a DataFrame."""
+        total = 0
+        for start in range(0, len(df), batch_size):
+            batch = df.iloc[start:start + batch_size]
+            total += self.upsert(
+                vectors=[
+                    {"id": vec_id, "values": values, "metadata": metadata}
+                    for vec_id, values, metadata in zip(
+                        batch["id"], batch["values"], batch["metadata"])
+                ],
+                namespace=namespace
+            )["upserted_count"]
+        return {"upserted_count": total}
+
+    def query(
+            self,
+            vector,
+            top_k: int = 10,
+            namespace: str = "",
+            filter: Optional[dict] = None,
+            include_metadata: bool = False,
+            include_values: bool = False,
+            **kwargs
+        ) -> dict:
+        """Return the ``top_k`` most cosine-similar vectors of a namespace."""
+        with self._write_lock:
+            stored = self._namespace(namespace)
+            ns = stored.snapshot() if stored is not None else None
+        if ns is None or ns.size == 0 or top_k <= 0:
+            return {"matches": [], "namespace": namespace}
+
+        # The retriever wraps the query vector in a list, as Pinecone allows
+        query_vec = self._normalize(vector)[0]
+        candidates = self._candidates(stored, ns, query_vec)
+
+        if filter:
+            keep = [row for row in (
+                candidates if candidates is not None else range(ns.size))
+                if _matches_filter(ns.metadata[row], filter)]
+            candidates = np.asarray(keep, dtype=np.int64)
+
+        if self.quantization is not None:
+            rows = self._quantized_candidates(ns, query_vec, candidates, top_k)
+            scores = ns.vectors[rows] @ query_vec
+            best = _top_k(scores, top_k)
+            rows, row_scores = rows[best], scores[best]
+        elif candidates is None:
+            scores = ns.matrix() @ query_vec
+            rows = _top_k(scores, top_k)
+            row_scores = scores[rows]
+        else:
+            if len(candidates) == 0:
+                return {"matches": [], "namespace": namespace}
+            scores = ns.vectors[candidates] @ query_vec
+            best = _top_k(scores, top_k)
+            rows, row_scores = candidates[best], scores[best]
+
+        matches = []
+        for row, score in zip(rows, row_scores):
+            match = {"id": ns.ids[row], "score": float(score)}
+            if include_metadata:
+                match["metadata"] = ns.metadata[row]
+            if include_values:
+                match["values"] = ns.vectors[row].tolist()
+            matches.append(match)
+
+        return {"matches": matches, "namespace": namespace}
+
+    def _quantized_candidates(
+            self, ns: _Namespace, query_vec: np.ndarray,
+            candidates: Optional[np.ndarray], top_k: int
+    ) -> np.ndarray:
+        """The best ``rescore_factor * top_k`` rows by quantized score, in
+        ascending row order (so the float rows are read sequentially)."""
+        n_rows = ns.size if candidates is None else len(candidates)
+        n_keep = min(n_rows, self.rescore_factor * top_k)
+        if n_keep == n_rows:
+            return np.arange(ns.size) if candidates is None else candidates
+
+        if self.quantization == "binary":
+            query_code = np.packbits(query_vec > 0)
+        scores = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, SCAN_BLOCK):
+            # Slices for a full scan, gathers for IVF/filter candidates
+            rows = (slice(start, min(start + SCAN_BLOCK, n_rows)) if candidates is None
+                    else candidates[start:start + SCAN_BLOCK])
+            codes = ns.codes[rows]
+            if self.quantization == "int8":
+                block = (codes.astype(np.float32) @ query_vec) * ns.scales[rows]
+            else:
+                # Fewer differing sign bits = higher score
+                block = -_popcount(np.bitwise_xor(codes, query_code)).sum(axis=1, dtype=np.int32)
+            scores[start:start + len(codes)] = block
+        best = np.argpartition(-scores, n_keep - 1)[:n_keep]
+        return np.sort(best if candidates is None else candidates[best])
+
+    def _candidates(
+            self, stored: _Namespace, view: _Namespace, query_vec: np.ndarray
+    ) -> Optional[np.ndarray]:
+        """Rows of the snapshot ``view`` to scan for a query: ``None`` means
+        brute force over all rows."""
+        if not self.n_lists or view.size < self.ivf_min_size:
+            return None
+
+        with self._ivf_lock:
+            centroids, list_order, list_offsets = self._ensure_ivf(stored, view)
+        centroid_scores = centroids @ query_vec
+        probes = _top_k(centroid_scores, min(self.n_probe, len(centroids)))
+        return np.concatenate([
+            list_order[list_offsets[p]:list_offsets[p + 1]] for p in probes
+        ])
+
+    def _ensure_ivf(self, ns: _Namespace, view: _Namespace):
+        """(Re)train the coarse quantizer when the namespace has doubled
+        since the last training, otherwise only reassign the rows when
+        they were written since. Returns the lists of the ``view``."""
+        if ns.centroids is None or view.size >= 2 * ns.trained_size:
+            ns.centroids = _spherical_kmeans(
+                view.matrix(), min(self.n_lists, view.size), seed=self.seed
+            )
+            ns.trained_size = view.size
+            ns.assignments = None
+
+        if ns.assignments is None or ns.ivf_version != view.version:
+            ns.assignments = _assign(view.matrix(), ns.centroids)
+            ns.ivf_version = view.version
+            ns.list_order = None
+
+        if ns.list_order is None:
+            ns.list_order = np.argsort(ns.assignments, kind="stable")
+            counts = np.bincount(ns.assignments, minlength=len(ns.centroids))
+            ns.list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        return ns.centroids, ns.list_order, ns.list_offsets
+
+    def memory_stats(self) -> dict:
+        """Bytes of the float32 vectors, of their codes, and of what a query
+        keeps resident (memory-mapped floats are paged in on demand)."""
+        float_bytes = code_bytes = resident_bytes = 0
+        for ns in self.namespaces.values():
+            ns_float = ns.size * self.dimension * 4
+            ns_code = (ns.codes[:ns.size].nbytes + ns.scales[:ns.size].nbytes
+                       if self.quantization else 0)
+            float_bytes += ns_float
+            code_bytes += ns_code
+            resident_bytes += ns_code
+            if not isinstance(ns.vectors, np.memmap):
+                resident_bytes += ns_float
+        return {
+            "quantization": self.quantization,
+            "float_bytes": float_bytes,
+            "code_bytes": code_bytes,
+            "resident_bytes": resident_bytes,
+            # Against the vectors held as Python lists of floats
+            "python_list_bytes": sum(ns.size for ns in self.namespaces.values())
+                                 * (56 + 32 * self.dimension),
+            "compression": float_bytes / code_bytes if code_bytes else 1.0,
+        }
+
+    def describe_index_stats(self) -> dict:
+        namespaces = {
+            name: {"vector_count": ns.size} for name, ns in self.namespaces.items()
+        }
+        return {
+            "dimension": self.dimension,
+            "index_fullness": 0.0,
+            "namespaces": namespaces,
+            "total_vector_count": sum(ns.size for ns in self.namespaces.values()),
+        }
+
+    def list(self, prefix: str = "", namespace: str = "", limit: int = 100):
+        """Yield pages of the ids starting with ``prefix``, like Pinecone's
+        ``Index.list``."""
+        ns = self._namespace(namespace)
+        if ns is None:
+            return
+        with self._write_lock:
+            ids = [vec_id for vec_id in ns.ids if vec_id.startswith(prefix)]
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def delete(
+            self,
+            ids: Optional[List[str]] = None,
+            delete_all: bool = False,
+            namespace: str = "",
+            **kwargs
+        ) -> dict:
+        with self._write_lock:
+            ns = self._namespace(namespace)
+            if ns is None:
+                return {}
+            if delete_all:
+                del self.namespaces[namespace]
+                self._remove_namespace_files(namespace)
+            elif ids:
+                ns.delete(ids)
+        return {}
+
+    def persist(self):
+        """Write every namespace to ``path`` (no-op for in-memory indexes)."""
+        if self.path is None:
+            return
+
+        with self._write_lock:
+            for name, ns in self.namespaces.items():
+                if not ns.dirty:
+                    continue
+                ns_dir = self.path / _namespace_dir(name)
+                ns_dir.mkdir(parents=True, exist_ok=True)
+
+                # Write-then-rename: the old file may still be memory-mapped
+                _save_npy(ns_dir / "vectors.npy", np.ascontiguousarray(ns.matrix()))
+                with open(ns_dir / "rows.json.tmp", "w", encoding="utf8") as f:
+                    json.dump(
+                        {"namespace": name, "ids": ns.ids, "metadata": ns.metadata}, f
+                    )
+                os.replace(ns_dir / "rows.json.tmp", ns_dir / "rows.json")
+
+                if self.quantization is not None:
+                    _save_npy(ns_dir / f"codes_{self.quantization}.npy",
+                              np.ascontiguousarray(ns.codes[:ns.size]))
+                    _save_npy(ns_dir / f"scales_{self.quantization}.npy",
+                              np.ascontiguousarray(ns.scales[:ns.size]))
+
+                if ns.centroids is not None and ns.ivf_version == ns.version:
+                    _save_npy(ns_dir / "centroids.npy", ns.centroids)
+                    _save_npy(ns_dir / "assignments.npy", ns.assignments)
+                    with open(ns_dir / "ivf.json", "w") as f:
+                        json.dump({"trained_size": ns.trained_size}, f)
+                ns.dirty = False
+
+        logger.info("Local index persisted to %s.", self.path)
+
+    def _load(self):
+        for ns_dir in self.path.iterdir():
+            rows_path = ns_dir / "rows.json"
+            if not rows_path.exists():
+                continue
+
+            with open(rows_path, "r", encoding="utf8") as f:
+                rows = json.load(f)
+
+            ns = _Namespace(self.dimension, self.quantization)
+            # Read-only memory map; copied into RAM on the first write
+            ns.vectors = np.load(ns_dir / "vectors.npy", mmap_mode="r")
+            ns.size = ns.vectors.shape[0]
+            ns.ids = rows["ids"]
+            ns.metadata = rows["metadata"]
+            ns.rows = {vec_id: row for row, vec_id in enumerate(ns.ids)}
+            ns.dirty = False
+
+            if self.quantization is not None:
+                codes_path = ns_dir / f"codes_{self.quantization}.npy"
+                if codes_path.exists():
+                    # Codes stay in RAM: the quantized scan reads all of them
+                    ns.codes = np.load(codes_path)
+                    ns.scales = np.load(ns_dir / f"scales_{self.quantization}.npy")
+                else:
+                    ns.encode()
+                    ns.dirty = True
+
+            if (ns_dir / "ivf.json").exists():
+                with open(ns_dir / "ivf.json", "r") as f:
+                    ns.trained_size = json.load(f)["trained_size"]
+                ns.centroids = np.load(ns_dir / "centroids.npy")
+                ns.assignments = np.load(ns_dir / "assignments.npy")
+                ns.ivf_version = ns.version
+
+            self.namespaces[rows["namespace"]] = ns
+
+        logger.info("Local index loaded from %s.", self.path)
+
+    def _remove_namespace_files(self, namespace: str):
+        if self.path is None:
+            return
+        ns_dir = self.path / _namespace_dir(namespace)
+        if ns_dir.exists():
+            for file in ns_dir.iterdir():
+                os.remove(file)
+            ns_dir.rmdir()
+
+
+def _save_npy(path: Path, array: np.ndarray):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _code_width(dimension: int, quantization: Optional[str]) -> int:
+    if quantization == "binary":
+        return (dimension + 7) // 8
+    return dimension if quantization == "int8" else 0
+
+
+def _code_dtype(quantization: Optional[str]):
+    return np.int8 if quantization == "int8" else np.uint8
+
+
+def _quantize(vectors: np.ndarray, quantization: str):
+    """Codes and per-row scales of unit vectors. int8 scales each row by its
+    largest component, binary keeps the signs (scales unused)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "binary":
+        return np.packbits(vectors > 0, axis=1), np.ones(len(vectors), dtype=np.float32)
+    peaks = np.abs(vectors).max(axis=1)
+    peaks[peaks == 0] = 1.0
+    codes = np.rint(vectors * (127.0 / peaks[:, None])).astype(np.int8)
+    return codes, (peaks / 127.0).astype(np.float32)
+
+
+def _namespace_dir(namespace: str) -> str:
+    return quote(namespace, safe="") if namespace else DEFAULT_NAMESPACE_DIR
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, sorted in descending order."""
+    k = min(k, len(scores))
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    """Index of the nearest centroid for each row, computed in blocks."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        out[start:start + batch] = np.argmax(
+            vectors[start:start + batch] @ centroids.T, axis=1)
+    return out
+
+
+def _spherical_kmeans(
+        vectors: np.ndarray, n_lists: int, n_iter: int = 10,
+        sample_size: int = 50000, seed: int = 0
+    ) -> np.ndarray:
+    """Train unit-norm centroids on a sample of the (unit-norm) vectors."""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Keep the previous centroid for lists that lost all their members
+        sums[empty] = centroids[empty]
+        norms[empty] = 1.0
+        centroids = sums / norms
+
+    return centroids.astype(np.float32)
+
+
+def _matches_filter(metadata: dict, filter: dict) -> bool:
+    """Equality, ``$eq``, ``$ne`` and ``$in`` subset of Pinecone filters."""
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True